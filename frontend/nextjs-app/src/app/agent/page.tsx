@@ -2,6 +2,24 @@
 import { useState } from "react";
 import { API_BASE } from "@/lib/config";
 
+async function waitForTicket(ticketId: string, onStatus: (s: string) => void): Promise<string> {
+  let etag: string | undefined;
+  for (let tries = 0; tries < 60; tries++) {
+    const params = new URLSearchParams({ taskId: ticketId, wait: "20" });
+    if (etag) params.set("etag", etag);
+    const res = await fetch(`${API_BASE}/agent-task?${params.toString()}`);
+    if (res.status === 304) continue;
+    const data = await res.json();
+    if (!res.ok) throw new Error(data.message || "Agent error");
+    etag = res.headers.get("ETag") || undefined;
+    if (data.status === "FAILED") throw new Error(data.error || "Agent error");
+    if (data.status === "COMPLETED") return JSON.parse(data.result || "{}").text || "";
+    onStatus(data.status === "RUNNING" ? "Agent is answering…" : "Queued…");
+    if (!etag) await new Promise(r => setTimeout(r, 1000));
+  }
+  throw new Error("Timed out waiting for the agent");
+}
+
 export default function AgentConsolePage() {
   const [prompt, setPrompt] = useState("");
   const [sessionId, setSessionId] = useState("");
@@ -21,7 +39,14 @@ export default function AgentConsolePage() {
       const data = await res.json();
       if (!res.ok) throw new Error(data.message || "Agent error");
       setSessionId(data.sessionId || "");
-      setAnswer(data.text || "");
+      if (res.status === 202 && data.ticketId) {
+        // Queued: wait for the ticket like any other agent task
+        setStatus("Queued…");
+        const text = await waitForTicket(data.ticketId, setStatus);
+        setAnswer(text);
+      } else {
+        setAnswer(data.text || "");
+      }
       setStatus("Done");
     } catch (err: any) {
       setStatus(err.message || "Error");
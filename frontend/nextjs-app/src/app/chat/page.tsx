@@ -2,20 +2,25 @@
 import { useState, useEffect, useRef } from "react";
 import { API_BASE } from "@/lib/config";
 
-async function startTask(prompt: string, documentIds: string[], mode: 'retrieval' | 'baseline') {
+async function startTask(prompt: string, documentIds: string[], mode: 'retrieval' | 'baseline', sessionId?: string) {
   const res = await fetch(`${API_BASE}/agent-task`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ prompt, documentIds, userId: "demo", mode })
+    body: JSON.stringify({ prompt, documentIds, userId: "demo", mode, sessionId })
   });
   if (!res.ok) throw new Error("Failed to start task");
   return res.json();
 }
 
-async function pollTask(taskId: string) {
-  const res = await fetch(`${API_BASE}/agent-task?taskId=${encodeURIComponent(taskId)}`);
+// Long-polls: with the ETag of the last seen state the server holds the request until the
+// task changes (or `wait` seconds pass) and answers 304 when nothing did
+async function pollTask(taskId: string, etag?: string) {
+  const params = new URLSearchParams({ taskId, wait: "20" });
+  if (etag) params.set("etag", etag);
+  const res = await fetch(`${API_BASE}/agent-task?${params.toString()}`);
+  if (res.status === 304) return { notModified: true, etag };
   if (!res.ok) throw new Error("Failed to get task");
-  return res.json();
+  return { ...(await res.json()), etag: res.headers.get("ETag") || undefined };
 }
 
 type ChatRole = 'user' | 'assistant';
@@ -40,6 +45,8 @@ export default function ChatPage() {
   const [status, setStatus] = useState("");
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [mode, setMode] = useState<'retrieval' | 'baseline'>('retrieval');
+  // Follow-up questions reuse the session so retrieval can start from the previous turns
+  const sessionRef = useRef<string | undefined>(undefined);
   const textRef = useRef<HTMLTextAreaElement | null>(null);
   const fileInputRef = useRef<HTMLInputElement | null>(null);
   const scrollRef = useRef<HTMLDivElement | null>(null);
@@ -75,13 +82,29 @@ export default function ChatPage() {
         .split(',')
         .map((s) => s.trim())
         .filter(Boolean);
-      const { taskId } = await startTask(currentPrompt, ids, mode);
+      const started = await startTask(currentPrompt, ids, mode, sessionRef.current);
+      sessionRef.current = started.sessionId || sessionRef.current;
+      const taskId = started.taskId;
       setStatus("Thinking…");
       let tries = 0;
+      let etag: string | undefined;
       while (tries < 60) {
-        const data = await pollTask(taskId);
+        // Fast-path answers come back with the task already completed
+        const data = tries === 0 && started.status === "COMPLETED" ? started : await pollTask(taskId, etag);
+        etag = data.etag;
+        if (data.notModified) {
+          tries += 1;
+          continue;
+        }
         if (data.status === "COMPLETED") {
-          const parsed = data.result ? JSON.parse(data.result) : null;
+          let parsed = data.result ? JSON.parse(data.result) : null;
+          if (data.resultUrl) {
+            // Large results are stored compressed in S3; the task only carries a preview
+            try {
+              const full = await fetch(data.resultUrl);
+              if (full.ok) parsed = await full.json();
+            } catch {}
+          }
           const assistantMsg: ChatMessage = {
             id: generateId(),
             role: 'assistant',
@@ -99,7 +122,8 @@ export default function ChatPage() {
           setStatus("Failed");
           break;
         }
-        await new Promise(r => setTimeout(r, Math.min(1000 + tries * 250, 5000)));
+        // Older deployments answer immediately; the delay only applies when no ETag came back
+        if (!etag) await new Promise(r => setTimeout(r, Math.min(1000 + tries * 250, 5000)));
         tries += 1;
       }
     } catch (e: any) {
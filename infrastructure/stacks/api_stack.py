@@ -7,6 +7,7 @@ from aws_cdk import (
     aws_lambda as _lambda,
     aws_dynamodb as dynamodb,
     aws_s3 as s3,
+    aws_sqs as sqs,
     aws_stepfunctions as sfn,
     aws_stepfunctions_tasks as tasks,
     CfnOutput,
@@ -15,6 +16,7 @@ from aws_cdk import aws_iam as iam
 from aws_cdk import aws_bedrock as bedrock
 from aws_cdk import aws_s3_deployment as s3deploy
 from aws_cdk import aws_s3_notifications as s3n
+from aws_cdk import aws_lambda_event_sources as event_sources
 from pathlib import Path
 from constructs import Construct
 
@@ -47,6 +49,19 @@ class ApiStack(Stack):
             enforce_ssl=True,
             removal_policy=RemovalPolicy.DESTROY,
             auto_delete_objects=True,
+            # Cached answers (ANSWER_CACHE_TTL_SECONDS, a day) and chat sessions' retrieval
+            # state (SESSION_CACHE_TTL_SECONDS, 30 minutes) lapse on their own; collect leftovers
+            lifecycle_rules=[
+                s3.LifecycleRule(prefix="answers/", expiration=Duration.days(2)),
+                s3.LifecycleRule(prefix="sessions/", expiration=Duration.days(1)),
+            ],
+        )
+        # Browsers fetch offloaded task results through presigned URLs
+        reports_bucket.add_cors_rule(
+            allowed_methods=[s3.HttpMethods.GET],
+            allowed_origins=["*"],
+            allowed_headers=["*"],
+            max_age=3000,
         )
 
         # DynamoDB tables
@@ -58,10 +73,20 @@ class ApiStack(Stack):
             time_to_live_attribute="ttl",
             removal_policy=RemovalPolicy.DESTROY,
         )
+        # One item per uploaded document: key, size, ETag, filename and index status
+        documents_table = dynamodb.Table(
+            self,
+            "DocumentCatalog",
+            partition_key=dynamodb.Attribute(name="userId", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="documentId", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
 
         # Lambdas
         common_env = {
             "AGENT_TASKS_TABLE": tasks_table.table_name,
+            "DOCUMENT_CATALOG_TABLE": documents_table.table_name,
             "UPLOADS_BUCKET": uploads_bucket.bucket_name,
             "REPORTS_BUCKET": reports_bucket.bucket_name,
             # Secrets Manager ID where the LlamaParse API key is stored
@@ -86,9 +111,30 @@ class ApiStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="get_result.handler",
             code=_lambda.Code.from_asset("lambda"),
+            # Long-polling callers may wait up to RESULT_MAX_WAIT_SECONDS (20) for a change
+            timeout=Duration.seconds(28),
+            environment=common_env,
+        )
+        # Status (and optionally results) of many tasks per call, via BatchGetItem
+        get_results_fn = _lambda.Function(
+            self,
+            "GetResultsLambda",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="get_results.handler",
+            code=_lambda.Code.from_asset("lambda"),
             timeout=Duration.seconds(15),
             environment=common_env,
         )
+        # Relays answer increments of streaming tasks (long-polls the task's stream record)
+        stream_result_fn = _lambda.Function(
+            self,
+            "StreamResultLambda",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="stream_result.handler",
+            code=_lambda.Code.from_asset("lambda"),
+            timeout=Duration.seconds(28),
+            environment=common_env,
+        )
         bedrock_agent_fn = _lambda.Function(
             self,
             "BedrockAgentLambda",
@@ -108,6 +154,16 @@ class ApiStack(Stack):
             environment=common_env,
         )
 
+        list_documents_fn = _lambda.Function(
+            self,
+            "ListDocumentsLambda",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="list_documents.handler",
+            code=_lambda.Code.from_asset("lambda"),
+            timeout=Duration.seconds(10),
+            environment=common_env,
+        )
+
         # Indexing ETL Lambda: parse->chunk->embed->write JSONL (reuses Reports bucket path)
         index_etl_fn = _lambda.Function(
             self,
@@ -138,12 +194,24 @@ class ApiStack(Stack):
             environment=agent_tools_env,
         )
         uploads_bucket.grant_read(parse_tool_fn)
+        # Serves stored parsed JSON and stores what it has to parse itself
+        reports_bucket.grant_read_write(parse_tool_fn)
         llama_secret.grant_read(parse_tool_fn)
 
         # Permissions
         tasks_table.grant_read_write_data(start_task_fn)
         tasks_table.grant_read_data(get_result_fn)
+        tasks_table.grant_read_data(stream_result_fn)
+        # Presigned URLs for offloaded results are signed with GetResult's role
+        reports_bucket.grant_read(get_result_fn)
+        tasks_table.grant_read_data(get_results_fn)
+        reports_bucket.grant_read(get_results_fn)
         tasks_table.grant_read_write_data(bedrock_agent_fn)
+        documents_table.grant_read_write_data(presign_fn)
+        documents_table.grant_read_write_data(index_etl_fn)
+        documents_table.grant_read_data(bedrock_agent_fn)
+        documents_table.grant_read_data(start_task_fn)
+        documents_table.grant_read_data(list_documents_fn)
 
         uploads_bucket.grant_read_write(bedrock_agent_fn)
         uploads_bucket.grant_read_write(presign_fn)
@@ -153,6 +221,21 @@ class ApiStack(Stack):
         # Allow Lambdas to read LlamaParse secret
         llama_secret.grant_read(bedrock_agent_fn)
         llama_secret.grant_read(index_etl_fn)
+        # StartTask answers questions over small indexed documents inline (fast path), so it
+        # needs what bedrock_agent needs on the retrieval path
+        uploads_bucket.grant_read(start_task_fn)
+        reports_bucket.grant_read_write(start_task_fn)
+        llama_secret.grant_read(start_task_fn)
+        start_task_fn.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "bedrock:InvokeModel",
+                    "bedrock:Converse",
+                    "bedrock:InvokeModelWithResponseStream",
+                ],
+                resources=["*"],
+            )
+        )
         # Allow invoking Bedrock models directly
         bedrock_agent_fn.add_to_role_policy(
             iam.PolicyStatement(
@@ -203,14 +286,19 @@ class ApiStack(Stack):
             key={
                 "taskId": tasks.DynamoAttributeValue.from_string(sfn.JsonPath.string_at("$.taskId"))
             },
-            update_expression="SET #status = :c, #result = :r, #completedAt = :t, #sessionId = :s",
+            update_expression=(
+                "SET #status = :c, #result = :r, #completedAt = :t, #sessionId = :s"
+                " ADD #version :one"
+            ),
             expression_attribute_names={
                 "#status": "status",
                 "#result": "result",
                 "#completedAt": "completedAt",
                 "#sessionId": "sessionId",
+                "#version": "version",
             },
             expression_attribute_values={
+                ":one": tasks.DynamoAttributeValue.from_number(1),
                 ":c": tasks.DynamoAttributeValue.from_string("COMPLETED"),
                 ":r": tasks.DynamoAttributeValue.from_string(
                     sfn.JsonPath.string_at("$.agent.agentResult")
@@ -230,9 +318,14 @@ class ApiStack(Stack):
             key={
                 "taskId": tasks.DynamoAttributeValue.from_string(sfn.JsonPath.string_at("$.taskId"))
             },
-            update_expression="SET #status = :f, #error = :e",
-            expression_attribute_names={"#status": "status", "#error": "error"},
+            update_expression="SET #status = :f, #error = :e ADD #version :one",
+            expression_attribute_names={
+                "#status": "status",
+                "#error": "error",
+                "#version": "version",
+            },
             expression_attribute_values={
+                ":one": tasks.DynamoAttributeValue.from_number(1),
                 ":f": tasks.DynamoAttributeValue.from_string("FAILED"),
                 ":e": tasks.DynamoAttributeValue.from_string(
                     sfn.JsonPath.string_at("$.errorMessage")
@@ -275,12 +368,34 @@ class ApiStack(Stack):
             apigw.LambdaIntegration(get_result_fn),
         )
 
+        agent_task_stream = agent_task.add_resource("stream")
+        agent_task_stream.add_method(
+            "GET",
+            apigw.LambdaIntegration(stream_result_fn),
+        )
+
+        agent_task_batch = agent_task.add_resource("batch")
+        agent_task_batch.add_method(
+            "POST",
+            apigw.LambdaIntegration(get_results_fn),
+        )
+        agent_task_batch.add_method(
+            "GET",
+            apigw.LambdaIntegration(get_results_fn),
+        )
+
         upload_request = api.root.add_resource("upload-request")
         upload_request.add_method(
             "POST",
             apigw.LambdaIntegration(presign_fn),
         )
 
+        documents = api.root.add_resource("documents")
+        documents.add_method(
+            "GET",
+            apigw.LambdaIntegration(list_documents_fn),
+        )
+
         # Outputs that frontend might need would be added here in future
         CfnOutput(self, "ApiUrl", value=api.url)
         CfnOutput(self, "UploadsBucketName", value=uploads_bucket.bucket_name)
@@ -361,6 +476,62 @@ class ApiStack(Stack):
             iam.PolicyStatement(actions=["bedrock:InvokeAgent"], resources=["*"])
         )
 
+        # Queued agent chat: AgentChatLambda answers 202 with a ticket and the worker drains
+        # the queue at a shared rate. Deferred messages come back via their visibility timeout;
+        # the DLQ only catches tickets the worker could not even mark as failed.
+        agent_chat_dlq = sqs.Queue(
+            self, "AgentChatDeadLetterQueue", retention_period=Duration.days(4)
+        )
+        agent_chat_queue = sqs.Queue(
+            self,
+            "AgentChatQueue",
+            visibility_timeout=Duration.seconds(90),
+            retention_period=Duration.hours(1),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=15, queue=agent_chat_dlq),
+        )
+        # One item per token bucket shared by all worker containers
+        rate_limits_table = dynamodb.Table(
+            self,
+            "RateLimits",
+            partition_key=dynamodb.Attribute(name="bucketId", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        agent_chat_worker_fn = _lambda.Function(
+            self,
+            "AgentChatWorkerLambda",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="agent_chat_worker.handler",
+            code=_lambda.Code.from_asset("lambda"),
+            timeout=Duration.seconds(60),
+            environment={
+                **common_env,
+                "BEDROCK_AGENT_ID": agent.attr_agent_id,
+                "BEDROCK_AGENT_ALIAS_ID": agent_alias.attr_agent_alias_id,
+                "AGENT_CHAT_QUEUE_URL": agent_chat_queue.queue_url,
+                "RATE_LIMITS_TABLE": rate_limits_table.table_name,
+                "AGENT_CHAT_RATE_PER_SEC": "2",
+            },
+        )
+        # Caps concurrent agent invocations regardless of how many tickets are waiting
+        agent_chat_worker_fn.add_event_source(
+            event_sources.SqsEventSource(
+                agent_chat_queue,
+                batch_size=1,
+                max_concurrency=4,
+                report_batch_item_failures=True,
+            )
+        )
+        agent_chat_worker_fn.add_to_role_policy(
+            iam.PolicyStatement(actions=["bedrock:InvokeAgent"], resources=["*"])
+        )
+        agent_chat_queue.grant_consume_messages(agent_chat_worker_fn)
+        rate_limits_table.grant_read_write_data(agent_chat_worker_fn)
+        tasks_table.grant_read_write_data(agent_chat_worker_fn)
+        agent_chat_queue.grant_send_messages(agent_chat_fn)
+        tasks_table.grant_read_write_data(agent_chat_fn)
+        agent_chat_fn.add_environment("AGENT_CHAT_QUEUE_URL", agent_chat_queue.queue_url)
+
         # API: POST /agent-chat -> AgentChatLambda
         agent_chat = api.root.add_resource("agent-chat")
         agent_chat.add_method("POST", apigw.LambdaIntegration(agent_chat_fn))
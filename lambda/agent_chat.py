@@ -1,33 +1,19 @@
 import json
 import os
+import secrets
 import time
-import random
+from functools import lru_cache
 from typing import Any, Dict
-import boto3
-from botocore.config import Config
-from botocore.exceptions import ClientError
+from common import bedrock
+from common.aws import get_boto3_client, get_boto3_resource
 
 AGENT_ID = os.environ["BEDROCK_AGENT_ID"]
 AGENT_ALIAS_ID = os.environ["BEDROCK_AGENT_ALIAS_ID"]
 
-brt = boto3.client("bedrock-agent-runtime", config=Config(retries={"max_attempts": 1}))
 
-
-def _is_throttling_error(exc: Exception) -> bool:
-    msg = str(exc).lower()
-    if "throttling" in msg or "rate" in msg:
-        return True
-    if isinstance(exc, ClientError):
-        code = exc.response.get("Error", {}).get("Code", "")
-        return code.lower() in {
-            "throttling",
-            "throttlingexception",
-            "throttled",
-            "throttlingerror",
-            "toomanyrequestsexception",
-            "throttlingerrorexception",
-        }
-    return False
+@lru_cache(maxsize=1)
+def _tasks_table() -> Any:
+    return get_boto3_resource("dynamodb").Table(os.environ["AGENT_TASKS_TABLE"])
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -42,58 +28,95 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             "body": json.dumps({"message": "prompt is required"}),
         }
 
-    max_retries = 3
-    base_delay = 1.0  # seconds
-    last_exc: Exception | None = None
-    for attempt in range(max_retries):
-        try:
-            resp = brt.invoke_agent(
-                agentId=AGENT_ID,
-                agentAliasId=AGENT_ALIAS_ID,
-                sessionId=session_id,
-                inputText=prompt,
-            )
-            chunks = []
-            try:
-                for ev in resp.get("completion", []):
-                    chunk = ev.get("chunk") or {}
-                    txt = chunk.get("bytes")
-                    if isinstance(txt, (bytes, bytearray)):
-                        try:
-                            chunks.append(txt.decode("utf-8"))
-                        except Exception:
-                            pass
-            except Exception as stream_exc:
-                # If throttled during streaming, do not re-invoke to avoid bursty retries.
-                # Return any partial content if present; otherwise surface a 429-like error.
-                if _is_throttling_error(stream_exc):
-                    if chunks:
-                        text = "".join(chunks)
-                        return {
-                            "statusCode": 200,
-                            "headers": {"Access-Control-Allow-Origin": "*"},
-                            "body": json.dumps({"text": text, "sessionId": session_id}),
-                        }
-                    last_exc = stream_exc
-                    break
-                raise
-            text = "".join(chunks)
-            return {
-                "statusCode": 200,
-                "headers": {"Access-Control-Allow-Origin": "*"},
-                "body": json.dumps({"text": text, "sessionId": session_id}),
+    # With a queue configured the request becomes a ticket drained by agent_chat_worker at the
+    # shared admission rate; {"mode": "sync"} keeps the direct call
+    if os.environ.get("AGENT_CHAT_QUEUE_URL") and body.get("mode") != "sync":
+        return _enqueue(prompt, session_id)
+
+    # Admission, retries with jitter and backoff under throttling live in the shared gateway
+    try:
+        resp = bedrock.invoke_agent(AGENT_ID, AGENT_ALIAS_ID, session_id, prompt)
+    except Exception as exc:
+        return _error_response(exc)
+
+    chunks = []
+    try:
+        for ev in resp.get("completion", []):
+            chunk = ev.get("chunk") or {}
+            txt = chunk.get("bytes")
+            if isinstance(txt, (bytes, bytearray)):
+                try:
+                    chunks.append(txt.decode("utf-8"))
+                except Exception:
+                    pass
+    except Exception as stream_exc:
+        # If throttled during streaming, do not re-invoke to avoid bursty retries.
+        # Return any partial content if present; otherwise surface a 429-like error.
+        if not chunks or not bedrock.is_throttling_error(stream_exc):
+            return _error_response(stream_exc)
+    text = "".join(chunks)
+    return {
+        "statusCode": 200,
+        "headers": {"Access-Control-Allow-Origin": "*"},
+        "body": json.dumps({"text": text, "sessionId": session_id}),
+    }
+
+
+def _enqueue(prompt: str, session_id: str) -> Dict[str, Any]:
+    """Queue the prompt and answer 202 with a ticket, pollable like any agent task
+    (GET /agent-task, /agent-task/stream)."""
+    ticket_id = f"chat_{int(time.time()*1000)}_{secrets.token_hex(3)}"
+    _tasks_table().put_item(
+        Item={
+            "taskId": ticket_id,
+            "kind": "chat",
+            "status": "QUEUED",
+            "version": 1,
+            "prompt": prompt,
+            "sessionId": session_id,
+            "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+    )
+    try:
+        get_boto3_client("sqs").send_message(
+            QueueUrl=os.environ["AGENT_CHAT_QUEUE_URL"],
+            MessageBody=json.dumps(
+                {"ticketId": ticket_id, "prompt": prompt, "sessionId": session_id}
+            ),
+        )
+    except Exception as exc:
+        _tasks_table().update_item(
+            Key={"taskId": ticket_id},
+            UpdateExpression="SET #status = :f, #error = :e ADD #version :one",
+            ExpressionAttributeNames={
+                "#status": "status",
+                "#error": "error",
+                "#version": "version",
+            },
+            ExpressionAttributeValues={":f": "FAILED", ":e": str(exc), ":one": 1},
+        )
+        return {
+            "statusCode": 503,
+            "headers": {"Access-Control-Allow-Origin": "*"},
+            "body": json.dumps({"message": "Could not queue the request, try again"}),
+        }
+    return {
+        "statusCode": 202,
+        "headers": {"Access-Control-Allow-Origin": "*"},
+        "body": json.dumps(
+            {
+                "ticketId": ticket_id,
+                "taskId": ticket_id,
+                "sessionId": session_id,
+                "status": "QUEUED",
             }
-        except Exception as exc:
-            if _is_throttling_error(exc) and attempt < max_retries - 1:
-                delay = base_delay * (2**attempt) * (0.5 + random.random())
-                time.sleep(delay)
-                last_exc = exc
-                continue
-            last_exc = exc
-            break
+        ),
+    }
+
 
+def _error_response(exc: Exception) -> Dict[str, Any]:
     return {
         "statusCode": 429,
         "headers": {"Access-Control-Allow-Origin": "*"},
-        "body": json.dumps({"message": str(last_exc) if last_exc else "Throttled"}),
+        "body": json.dumps({"message": str(exc) or "Throttled"}),
     }
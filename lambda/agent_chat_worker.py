@@ -0,0 +1,158 @@
+import json
+import os
+import random
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from common import bedrock
+from common.admission import SharedTokenBucket
+from common.aws import get_boto3_client, get_boto3_resource
+from common.stream import open_writer
+
+# Drains the agent chat queue. The SQS event source caps how many of these run at once
+# (AGENT_CHAT_MAX_CONCURRENCY in the stack) and every invoke_agent call first takes a token
+# from the shared bucket (AGENT_CHAT_RATE_PER_SEC, default 2; AGENT_CHAT_BURST, default twice
+# the rate).
+# A message that cannot run now (no token, or throttled by Bedrock) is handed back to the
+# queue with a visibility timeout instead of sleeping in the Lambda; once a message has been
+# received AGENT_CHAT_MAX_RECEIVES times (default 10) without running, its ticket fails.
+
+AGENT_ID = os.environ.get("BEDROCK_AGENT_ID", "")
+AGENT_ALIAS_ID = os.environ.get("BEDROCK_AGENT_ALIAS_ID", "")
+
+
+@lru_cache(maxsize=1)
+def _tasks_table() -> Any:
+    return get_boto3_resource("dynamodb").Table(os.environ["AGENT_TASKS_TABLE"])
+
+
+@lru_cache(maxsize=1)
+def _bucket() -> SharedTokenBucket:
+    rate = float(os.environ.get("AGENT_CHAT_RATE_PER_SEC") or 2)
+    return SharedTokenBucket(
+        f"agent:{AGENT_ID}", rate, float(os.environ.get("AGENT_CHAT_BURST") or 2 * rate)
+    )
+
+
+def _set_status(ticket_id: str, status: str, **fields: Any) -> None:
+    names = {"#status": "status", "#version": "version"}
+    values: Dict[str, Any] = {":s": status, ":one": 1}
+    sets = ["#status = :s"]
+    for i, (name, value) in enumerate(fields.items()):
+        names[f"#f{i}"] = name
+        values[f":f{i}"] = value
+        sets.append(f"#f{i} = :f{i}")
+    _tasks_table().update_item(
+        Key={"taskId": ticket_id},
+        UpdateExpression=f"SET {', '.join(sets)} ADD #version :one",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+
+
+def _mark_running(ticket_id: str) -> None:
+    # Only the first start changes the ticket; redeliveries leave its version alone
+    try:
+        _tasks_table().update_item(
+            Key={"taskId": ticket_id},
+            UpdateExpression="SET #status = :r ADD #version :one",
+            ConditionExpression="#status = :q",
+            ExpressionAttributeNames={"#status": "status", "#version": "version"},
+            ExpressionAttributeValues={":r": "RUNNING", ":q": "QUEUED", ":one": 1},
+        )
+    except ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+            raise
+
+
+def _defer(record: Dict[str, Any], seconds: float) -> None:
+    """Hand the message back to the queue, visible again after `seconds`."""
+    try:
+        get_boto3_client("sqs").change_message_visibility(
+            QueueUrl=os.environ["AGENT_CHAT_QUEUE_URL"],
+            ReceiptHandle=record["receiptHandle"],
+            VisibilityTimeout=int(min(900, max(1, round(seconds)))),
+        )
+    except Exception:
+        # The queue's own visibility timeout applies instead
+        pass
+
+
+def _process(record: Dict[str, Any], context: Any) -> Optional[str]:
+    """Run one ticket. Returns None when the message is done, or a reason to retry it."""
+    message = json.loads(record.get("body") or "{}")
+    ticket_id = message["ticketId"]
+    receives = int((record.get("attributes") or {}).get("ApproximateReceiveCount") or 1)
+    last_chance = receives >= int(os.environ.get("AGENT_CHAT_MAX_RECEIVES") or 10)
+
+    wait = _bucket().acquire()
+    if wait > 0:
+        if last_chance:
+            _set_status(ticket_id, "FAILED", error="Agent capacity unavailable, try again later")
+            return None
+        # Spread deferred messages so they do not come back as one burst
+        _defer(record, wait + random.uniform(0, 1 + wait))
+        return "rate limited"
+
+    _mark_running(ticket_id)
+    deadline = None
+    if context is not None:
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000.0 - 5.0
+    writer = open_writer(ticket_id)
+    chunks: List[str] = []
+    try:
+        # One attempt: retrying is the queue's job, not a sleep inside this invocation
+        resp = bedrock.invoke_agent(
+            AGENT_ID,
+            AGENT_ALIAS_ID,
+            message["sessionId"],
+            message["prompt"],
+            deadline=deadline,
+            max_attempts=1,
+        )
+        for ev in resp.get("completion", []):
+            txt = (ev.get("chunk") or {}).get("bytes")
+            if isinstance(txt, (bytes, bytearray)):
+                try:
+                    chunks.append(txt.decode("utf-8"))
+                except Exception:
+                    continue
+                if writer is not None:
+                    writer.append(chunks[-1])
+    except Exception as exc:
+        # Partial output is kept rather than replayed, as in the synchronous path
+        if not chunks:
+            if bedrock.is_retryable_error(exc) and not last_chance:
+                _defer(record, min(120.0, random.uniform(1, 2**receives)))
+                return "throttled"
+            _set_status(ticket_id, "FAILED", error=str(exc) or "Agent error")
+            if writer is not None:
+                writer.close("")
+            return None
+
+    text = "".join(chunks)
+    if writer is not None:
+        writer.close(text)
+    _set_status(
+        ticket_id,
+        "COMPLETED",
+        result=json.dumps({"text": text, "sessionId": message["sessionId"]}),
+        completedAt=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    )
+    return None
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    failures = []
+    for record in event.get("Records") or []:
+        try:
+            retry = _process(record, context)
+        except Exception:
+            retry = "error"
+        if retry is not None:
+            failures.append({"itemIdentifier": record["messageId"]})
+    # Partial batch response: only the listed messages return to the queue
+    return {"batchItemFailures": failures}
@@ -1,12 +1,18 @@
 import json
 import os
-import boto3
-from botocore.config import Config
-from typing import Any, Dict
-from common import llama_parse
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from common import manifest
+from common import parse_document
+from common.aws import get_boto3_client
+from common.cache import get_cache
+from common.deadline import Deadline
 
-s3 = boto3.client("s3", config=Config(retries={"max_attempts": 3}))
 UPLOADS_BUCKET = os.environ.get("UPLOADS_BUCKET", "")
+REPORTS_BUCKET = os.environ.get("REPORTS_BUCKET", "")
+
+# Bedrock caps action group responses at 25 KB; leave room for the envelope and tables
+_MAX_CHARS_LIMIT = 20000
 
 
 def _ok_response(action_group: str, function: str, body: Dict[str, Any]) -> Dict[str, Any]:
@@ -26,29 +32,257 @@ def _ok_response(action_group: str, function: str, body: Dict[str, Any]) -> Dict
     }
 
 
+def _payload(event: Dict[str, Any]) -> Dict[str, Any]:
+    request = event.get("requestBody") or {}
+    if isinstance(request, dict) and "content" in request:
+        # Some payloads nest under content -> application/json -> body, OpenAPI action groups
+        # send content -> application/json -> properties: [{name, type, value}]
+        content = request.get("content", {}).get("application/json", {})
+        if isinstance(content.get("properties"), list):
+            return {p.get("name"): p.get("value") for p in content["properties"] if p.get("name")}
+        payload = content.get("body") or {}
+        return payload if isinstance(payload, dict) else {}
+    return request if isinstance(request, dict) else {}
+
+
+def _int(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _load_parsed(
+    s3: Any, user_id: str, document_id: str, key: str, etag: str, deadline: Deadline
+) -> Tuple[Dict[str, Any], str]:
+    """Parsed document and where it came from: "cache", "artifact" or "parsed".
+
+    Looks in the container's parsed cache (shared with bedrock_agent and index_etl), then the
+    parsed JSON stored for this upload, and only parses (and stores the result) on a miss.
+    A parse cut short by the deadline raises TimeoutError after recording its LlamaParse job
+    in the manifest's "parseJob", so the next call waits for that job instead of a new one.
+    """
+    cache = get_cache("parsed", memory_mb=64, disk_mb=192)
+    cache_key = f"{UPLOADS_BUCKET}/{key}"
+    if etag:
+        parsed = cache.get(cache_key, etag=etag)
+        if parsed is not None:
+            return parsed, "cache"
+    doc_manifest: Dict[str, Any] = {}
+    if REPORTS_BUCKET:
+        doc_manifest = manifest.load_manifest(s3, REPORTS_BUCKET, user_id, document_id) or {}
+    entry = doc_manifest.get("parsed")
+    stored_keys = []
+    if manifest.is_current(entry, etag):
+        stored_keys.append(entry["key"])
+    elif REPORTS_BUCKET and not doc_manifest:
+        # Documents processed before manifests existed only have the unversioned parse
+        stored_keys.append(manifest.legacy_parsed_key(user_id, document_id))
+    for stored_key in stored_keys:
+        try:
+            body = s3.get_object(Bucket=REPORTS_BUCKET, Key=stored_key)["Body"].read()
+            parsed = json.loads(body.decode("utf-8"))
+        except Exception:
+            continue
+        if parse_document.is_stub(parsed):
+            continue
+        if etag:
+            cache.put(cache_key, parsed, size=len(body), etag=etag)
+        return parsed, "artifact"
+
+    job = doc_manifest.get("parseJob") or {}
+    job_id = job.get("jobId") if etag and job.get("sourceEtag") == etag else None
+    pdf_bytes = s3.get_object(Bucket=UPLOADS_BUCKET, Key=key)["Body"].read()
+    try:
+        parsed = parse_document.parse_pdf_bytes(
+            pdf_bytes, filename=f"{document_id}.pdf", deadline=deadline.at, job_id=job_id
+        )
+    except TimeoutError as exc:
+        running = getattr(exc, "job_id", None)
+        if REPORTS_BUCKET and etag and running and running != job_id:
+            try:
+                manifest.update_manifest(
+                    s3,
+                    REPORTS_BUCKET,
+                    user_id,
+                    document_id,
+                    parseJob={
+                        "jobId": running,
+                        "sourceEtag": etag,
+                        "startedAt": manifest.now_iso(),
+                    },
+                )
+            except Exception:
+                pass
+        raise
+    if parse_document.is_stub(parsed):
+        # A failed parse is neither cached nor stored; the next call parses afresh
+        if REPORTS_BUCKET and job_id:
+            try:
+                manifest.update_manifest(s3, REPORTS_BUCKET, user_id, document_id, parseJob=None)
+            except Exception:
+                pass
+        return parsed, "parsed"
+    serialized = json.dumps(parsed).encode("utf-8")
+    if etag:
+        cache.put(cache_key, parsed, size=len(serialized), etag=etag)
+    if REPORTS_BUCKET and etag:
+        # Stored like bedrock_agent does, so the next call on any container skips the parse
+        try:
+            parsed_key = manifest.parsed_key(user_id, document_id, etag)
+            s3.put_object(
+                Bucket=REPORTS_BUCKET,
+                Key=parsed_key,
+                Body=serialized,
+                ContentType="application/json",
+            )
+            manifest.update_manifest(
+                s3,
+                REPORTS_BUCKET,
+                user_id,
+                document_id,
+                parsed={
+                    "key": parsed_key,
+                    "sourceEtag": etag,
+                    "status": manifest.READY,
+                    "updatedAt": manifest.now_iso(),
+                },
+                parseJob=None,
+            )
+        except Exception:
+            pass
+    return parsed, "parsed"
+
+
+def _page_number(page: Dict[str, Any], index: int) -> int:
+    return _int(page.get("page")) or _int(page.get("pageNumber")) or index + 1
+
+
+def _paginate(
+    parsed: Dict[str, Any],
+    page_start: Optional[int],
+    page_end: Optional[int],
+    max_chars: int,
+    cursor: Optional[str],
+) -> Dict[str, Any]:
+    """The pages in [page_start, page_end] from `cursor` on, up to `max_chars` of text.
+
+    A page that does not fit is cut and continued by the returned "nextCursor" (None once the
+    range is exhausted). Cursors are "<position in range>:<character offset>". The text is
+    returned once, with "--- Page N ---" markers; "pages" only describes what it covers.
+    """
+    pages = [p for p in parsed.get("pages") or [] if isinstance(p, dict)]
+    numbered = [
+        (_page_number(p, i), str(p.get("text") or p.get("md") or "")) for i, p in enumerate(pages)
+    ]
+    if not numbered and parsed.get("text"):
+        # Parses without page structure are served as one page
+        numbered = [(1, str(parsed["text"]))]
+    selected = [
+        (n, t)
+        for n, t in numbered
+        if (page_start is None or n >= page_start) and (page_end is None or n <= page_end)
+    ]
+    position, offset = 0, 0
+    if cursor:
+        try:
+            position, offset = (int(x) for x in str(cursor).split(":", 1))
+        except ValueError:
+            position, offset = 0, 0
+    out: List[Dict[str, Any]] = []
+    texts: List[str] = []
+    budget = max_chars
+    next_cursor = None
+    while position < len(selected):
+        number, text = selected[position]
+        rest = text[offset:]
+        if len(rest) > budget:
+            if out and budget < min(len(rest), 500):
+                # Too little room for a useful slice; start the page fresh next time
+                next_cursor = f"{position}:{offset}"
+                break
+            out.append(
+                {"page": number, "chars": budget, "continued": offset > 0, "complete": False}
+            )
+            texts.append(f"--- Page {number} ---\n{rest[:budget]}")
+            next_cursor = f"{position}:{offset + budget}"
+            break
+        out.append({"page": number, "chars": len(rest), "continued": offset > 0, "complete": True})
+        texts.append(f"--- Page {number} ---\n{rest}")
+        budget -= len(rest)
+        position, offset = position + 1, 0
+    returned = {p["page"] for p in out if p["complete"]}
+    last_page = selected[-1][0] if selected else None
+    tables = []
+    for table in parsed.get("tables") or []:
+        # Tables go out with their page; ones without a page number with the last page
+        if not isinstance(table, dict):
+            continue
+        page = _int(table.get("page")) or _int(table.get("pageNumber"))
+        size = len(json.dumps(table, default=str))
+        if (page or last_page) in returned and size <= budget:
+            tables.append(table)
+            budget -= size
+    metadata = parsed.get("metadata") or {}
+    return {
+        "text": "\n\n".join(texts),
+        "pages": out,
+        "tables": tables,
+        "metadata": {k: v for k, v in metadata.items() if isinstance(v, (str, int, float, bool))},
+        "pageCount": len(numbered),
+        "nextCursor": next_cursor,
+        "truncated": next_cursor is not None,
+    }
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    # Expecting Bedrock Agent action group event (OpenAPI based)
-    # Extract request JSON
+    """Bedrock Agent action group tool: one window of a parsed PDF.
+
+    Parameters (OpenAPI): documentId, userId, optional pageStart/pageEnd (1-based, inclusive),
+    maxChars (default PARSE_TOOL_MAX_CHARS, 12000; at most 20000) and cursor (the nextCursor
+    of the previous call, to continue where it stopped). Served from the parsed cache or the
+    stored parsed JSON; the PDF is only parsed when neither exists. A parse that outlasts the
+    call keeps running at LlamaParse and the next call waits for it (error with parsing: true).
+    """
+    action_group = event.get("actionGroup", "DocParseTools")
+    function = event.get("function", "parse_pdf")
     try:
-        request = event.get("requestBody") or {}
-        if isinstance(request, dict) and "content" in request:
-            # Some payloads nest under content -> application/json -> body
-            content = request.get("content", {}).get("application/json", {})
-            payload = content.get("body") or {}
-        else:
-            payload = request if isinstance(request, dict) else {}
+        payload = _payload(event)
         document_id = payload.get("documentId")
         user_id = payload.get("userId") or "anon"
         if not document_id:
-            return _ok_response(event.get("actionGroup", "DocParseTools"), event.get("function", "parse_pdf"), {
-                "error": "documentId is required"
-            })
+            return _ok_response(action_group, function, {"error": "documentId is required"})
         key = f"{user_id}/{document_id}.pdf"
-        obj = s3.get_object(Bucket=UPLOADS_BUCKET, Key=key)
-        pdf_bytes = obj["Body"].read()
-        parsed = llama_parse.parse_pdf_bytes(pdf_bytes, filename=f"{document_id}.pdf")
-        return _ok_response(event.get("actionGroup", "DocParseTools"), event.get("function", "parse_pdf"), parsed)
+        s3 = get_boto3_client("s3")
+        etag = (s3.head_object(Bucket=UPLOADS_BUCKET, Key=key).get("ETag") or "").strip('"')
+        started = time.time()
+        try:
+            parsed, source = _load_parsed(
+                s3, user_id, document_id, key, etag, Deadline.from_context(context)
+            )
+        except TimeoutError:
+            return _ok_response(
+                action_group,
+                function,
+                {
+                    "error": "The document is still being parsed. Call parse_pdf again with "
+                    "the same arguments to keep waiting for this parse.",
+                    "parsing": True,
+                },
+            )
+        max_chars = (
+            _int(payload.get("maxChars")) or _int(os.environ.get("PARSE_TOOL_MAX_CHARS")) or 12000
+        )
+        window = _paginate(
+            parsed,
+            _int(payload.get("pageStart")),
+            _int(payload.get("pageEnd")),
+            max(1, min(max_chars, _MAX_CHARS_LIMIT)),
+            payload.get("cursor"),
+        )
+        window["documentId"] = document_id
+        window["source"] = source
+        window["loadMs"] = round((time.time() - started) * 1000.0, 1)
+        return _ok_response(action_group, function, window)
     except Exception as exc:
-        return _ok_response(event.get("actionGroup", "DocParseTools"), event.get("function", "parse_pdf"), {
-            "error": str(exc)
-        })
+        return _ok_response(action_group, function, {"error": str(exc)})
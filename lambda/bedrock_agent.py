@@ -2,163 +2,481 @@ import json
 import os
 import time
 import re
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Any, Dict, List, Tuple
-import boto3
-from botocore.config import Config
+from common import answer_cache
+from common import bedrock
+from common.aws import get_boto3_client
+from common import catalog
+from common.cache import get_cache
+from common.context import default_budget, pack_context
+from common.deadline import Deadline, run_with_timeout
+from common import manifest
+from common import map_reduce
 from common import parse_document
+from common import results
+from common import session_cache
+from common.filters import filters_from_prompt, normalize_filters
 from common.retrieval import retrieve_top_k
+from common.stream import open_writer
 
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    # Placeholder that returns a deterministic fake result for now
-    prompt = event.get("prompt") if isinstance(event, dict) else None
-    mode = (event.get("mode") or "retrieval").lower()
-    document_ids: List[str] = event.get("documentIds") or []
-
-    s3 = boto3.client("s3", config=Config(retries={"max_attempts": 3}))
-    uploads_bucket = os.environ.get("UPLOADS_BUCKET", "")
-    reports_bucket = os.environ.get("REPORTS_BUCKET", "")
+def _load_document(
+    s3: Any,
+    uploads_bucket: str,
+    reports_bucket: str,
+    user_prefix: str,
+    doc_id: str,
+    entry: Dict[str, Any] | None = None,
+    deadline: Deadline | None = None,
+) -> Dict[str, Any]:
+    """Locate, load (or parse) and persist one document. Returns {documentId, parsed, filename}.
 
-    # Simple in-memory memoization (per warm Lambda container)
-    # Keyed by (bucket, key, etag) -> parsed dict
-    global _PARSED_CACHE  # type: ignore[var-annotated]
-    try:
-        _PARSED_CACHE  # type: ignore[name-defined]
-    except NameError:
-        _PARSED_CACHE = {}  # type: ignore[assignment]
-
-    parsed_docs = []
-    sources = []
-    doc_id_to_filename: Dict[str, str] = {}
-    for doc_id in document_ids:
-        # Try both pdf and xlsx keys to locate the uploaded object
-        user_prefix = event.get("userId", "anon")
-        tried_keys = [
+    `entry` is the document's catalog item; when it records the upload's key and ETag the
+    object is not probed at all. With a `deadline`, a document that still needs parsing is
+    skipped (docType "skipped") when less than AGENT_PARSE_MIN_SECONDS (default 15) remain,
+    or when the parse does not finish in time; skipped parses are never cached or persisted.
+    """
+    doc_manifest = manifest.load_manifest(s3, reports_bucket, user_prefix, doc_id) or {}
+    entry = entry or {}
+    head = None
+    key_used = None
+    etag: str | None = None
+    if entry.get("key") and entry.get("etag"):
+        key_used = entry["key"]
+        etag = entry["etag"]
+        head = {
+            "ETag": etag,
+            "ContentLength": entry.get("size"),
+            "Metadata": {"original-filename": entry.get("filename") or ""},
+        }
+    # Otherwise try the manifest's source key first, then both pdf and xlsx keys (HEAD only)
+    source = doc_manifest.get("source") or {}
+    tried_keys = [
+        k
+        for k in (
+            entry.get("key"),
+            source.get("key"),
             f"{user_prefix}/{doc_id}.pdf",
             f"{user_prefix}/{doc_id}.xlsx",
-        ]
-        obj = None
-        key_used = None
-        etag: str | None = None
-        for key in tried_keys:
+        )
+        if k and head is None
+    ]
+    for key in dict.fromkeys(tried_keys):
+        try:
+            head = s3.head_object(Bucket=uploads_bucket, Key=key)
+            key_used = key
+            etag = (head.get("ETag") or "").strip('"') or None
+            break
+        except Exception:
+            continue
+    if head is None or key_used is None:
+        parsed = {
+            "docType": "missing",
+            "text": "",
+            "tables": [],
+            "metadata": {"error": "object not found"},
+        }
+        return {"documentId": doc_id, "parsed": parsed, "filename": ""}
+
+    filename_only = (head.get("Metadata") or {}).get("original-filename") or os.path.basename(
+        key_used
+    )
+    parsed: Dict[str, Any] | None = None
+    raw_key: str | None = None
+    serialized: bytes | None = None
+    # Parsed documents are cached per upload key and ETag across requests in this container
+    cache = get_cache("parsed", memory_mb=64, disk_mb=192)
+    cache_key = f"{uploads_bucket}/{key_used}"
+    if etag:
+        parsed = cache.get(cache_key, etag=etag)
+    # Parsed JSON written for this exact upload (by index_etl or an earlier request)
+    entry = doc_manifest.get("parsed")
+    if reports_bucket and manifest.is_current(entry, etag):
+        raw_key = entry["key"]
+        if parsed is None:
             try:
-                obj = s3.get_object(Bucket=uploads_bucket, Key=key)
-                key_used = key
-                etag = (obj.get("ETag") or "").strip('"') or None
-                break
+                body = s3.get_object(Bucket=reports_bucket, Key=raw_key)["Body"].read()
+                parsed = json.loads(body.decode("utf-8"))
+                if parse_document.is_stub(parsed):
+                    raise ValueError("stored parse is a stub")
+                cache.put(cache_key, parsed, size=len(body), etag=etag)
             except Exception:
-                continue
-        parsed: Dict[str, Any] = {"docType": "unknown", "text": "", "tables": [], "metadata": {}}
-        if obj is not None and key_used is not None:
-            # Try S3-persisted normalized parse first (memoized artifact)
-            user_prefix = event.get("userId", "anon")
-            raw_key = f"parsed/{user_prefix}/{doc_id}.json"
-            used_cached = False
-            if reports_bucket:
-                try:
-                    raw_obj = s3.get_object(Bucket=reports_bucket, Key=raw_key)
-                    parsed = json.loads(raw_obj["Body"].read().decode("utf-8"))
-                    used_cached = True
-                except Exception:
-                    used_cached = False
-            if not used_cached:
-                # In-memory LRU-style cache by (bucket,key,etag)
-                cache_key: Tuple[str, str, str] | None = (
-                    uploads_bucket,
-                    key_used,
-                    etag or "",
+                parsed, raw_key = None, None
+    if parsed is None and reports_bucket and not doc_manifest:
+        # Documents processed before manifests existed only have the unversioned parse
+        try:
+            legacy_key = manifest.legacy_parsed_key(user_prefix, doc_id)
+            raw_obj = s3.get_object(Bucket=reports_bucket, Key=legacy_key)
+            parsed = json.loads(raw_obj["Body"].read().decode("utf-8"))
+            raw_key = legacy_key
+        except Exception:
+            parsed = None
+    if parsed is None and deadline is not None:
+        min_parse = float(os.environ.get("AGENT_PARSE_MIN_SECONDS") or 15)
+        if deadline.remaining() < min_parse:
+            return _skipped(doc_id, filename_only, "parse skipped: not enough time left")
+    if parsed is None:
+        data = s3.get_object(Bucket=uploads_bucket, Key=key_used)["Body"].read()
+        parse_by = deadline.at if deadline is not None else None
+        if key_used.endswith(".pdf"):
+            try:
+                parsed = parse_document.parse_pdf_bytes(
+                    data, filename=filename_only, deadline=parse_by
                 )
-                if cache_key and cache_key in _PARSED_CACHE:  # type: ignore[index]
-                    parsed = _PARSED_CACHE[cache_key]  # type: ignore[index]
-                    used_cached = True
-                else:
-                    data = obj["Body"].read()
-                    if key_used.endswith(".pdf"):
-                        original_filename = (obj.get("Metadata") or {}).get(
-                            "original-filename"
-                        ) or os.path.basename(key_used)
-                        parsed = parse_document.parse_pdf_bytes(data, filename=original_filename)
-                    elif key_used.endswith(".xlsx"):
-                        try:
-                            original_filename = (obj.get("Metadata") or {}).get(
-                                "original-filename"
-                            ) or os.path.basename(key_used)
-                            parsed = parse_document.parse_xlsx_bytes(
-                                data, filename=original_filename
-                            )
-                        except Exception:
-                            parsed = {
-                                "docType": "xlsx",
-                                "text": "",
-                                "tables": [],
-                                "metadata": {"error": "xlsx parse failed"},
-                            }
-                    else:
-                        parsed = {"docType": "unknown", "text": "", "tables": [], "metadata": {}}
-                    if cache_key:
-                        # Bounded cache: keep at most ~32 entries
-                        if len(_PARSED_CACHE) > 32:  # type: ignore[arg-type]
-                            _PARSED_CACHE.clear()  # type: ignore[call-arg]
-                        _PARSED_CACHE[cache_key] = parsed  # type: ignore[index]
+            except TimeoutError:
+                return _skipped(doc_id, filename_only, "parse did not finish in time")
+        elif key_used.endswith(".xlsx"):
+            try:
+                parsed = parse_document.parse_xlsx_bytes(
+                    data, filename=filename_only, deadline=parse_by
+                )
+            except TimeoutError:
+                return _skipped(doc_id, filename_only, "parse did not finish in time")
+            except Exception:
+                parsed = {
+                    "docType": "xlsx",
+                    "text": "",
+                    "tables": [],
+                    "metadata": {"error": "xlsx parse failed", "stub": True},
+                }
         else:
-            parsed = {
-                "docType": "missing",
-                "text": "",
-                "tables": [],
-                "metadata": {"error": "object not found"},
-            }
-        # Persist parsed JSON to S3 for zero-loss preservation and attach pointer
+            parsed = {"docType": "unknown", "text": "", "tables": [], "metadata": {}}
+        serialized = json.dumps(parsed).encode("utf-8")
+        if etag and not parse_document.is_stub(parsed):
+            cache.put(cache_key, parsed, size=len(serialized), etag=etag)
+    if raw_key is None and not parse_document.is_stub(parsed):
+        # Persist parsed JSON once per source ETag for zero-loss preservation
         try:
-            if reports_bucket:
-                raw_key = f"parsed/{user_prefix}/{doc_id}.json"
+            if reports_bucket and etag:
+                raw_key = manifest.parsed_key(user_prefix, doc_id, etag)
                 s3.put_object(
                     Bucket=reports_bucket,
                     Key=raw_key,
-                    Body=json.dumps(parsed).encode("utf-8"),
+                    Body=serialized or json.dumps(parsed).encode("utf-8"),
                     ContentType="application/json",
                 )
-                meta = parsed.get("metadata") or {}
-                meta["rawS3Uri"] = f"s3://{reports_bucket}/{raw_key}"
-                parsed["metadata"] = meta
+                manifest.update_manifest(
+                    s3,
+                    reports_bucket,
+                    user_prefix,
+                    doc_id,
+                    source={
+                        "key": key_used,
+                        "etag": etag,
+                        "size": head.get("ContentLength"),
+                        "filename": filename_only,
+                    },
+                    parsed={
+                        "key": raw_key,
+                        "sourceEtag": etag,
+                        "status": manifest.READY,
+                        "updatedAt": manifest.now_iso(),
+                    },
+                )
         except Exception:
             # Non-fatal: continue without raw pointer if write fails
-            pass
+            raw_key = None
+    if raw_key:
+        parsed = dict(parsed)
+        parsed["metadata"] = {
+            **(parsed.get("metadata") or {}),
+            "rawS3Uri": f"s3://{reports_bucket}/{raw_key}",
+        }
+    return {"documentId": doc_id, "parsed": parsed, "filename": filename_only}
 
-        filename_only = (
-            (obj.get("Metadata") or {}).get("original-filename") if obj is not None else ""
-        ) or (os.path.basename(key_used) if key_used else "")
-        if filename_only:
-            doc_id_to_filename[doc_id] = filename_only
-        parsed_docs.append({"documentId": doc_id, "parsed": parsed})
-        sources.append({"documentId": doc_id, "filename": filename_only, "pages": [1]})
 
-    # Try vector retrieval first (if embeddings exist), fall back to raw excerpts
-    reports_bucket = os.environ.get("REPORTS_BUCKET", "")
-    retrieved = []
-    if mode == "retrieval" and reports_bucket and document_ids and prompt:
+def _skipped(doc_id: str, filename: str, reason: str) -> Dict[str, Any]:
+    parsed = {"docType": "skipped", "text": "", "tables": [], "metadata": {"error": reason}}
+    return {"documentId": doc_id, "parsed": parsed, "filename": filename}
+
+
+def _load_documents(
+    s3: Any,
+    uploads_bucket: str,
+    reports_bucket: str,
+    user_prefix: str,
+    document_ids: List[str],
+    entries: Dict[str, Dict[str, Any]] | None = None,
+    deadline: Deadline | None = None,
+) -> List[Dict[str, Any]]:
+    """Load documents concurrently on a bounded pool (AGENT_LOAD_CONCURRENCY, default 8).
+
+    Results keep the order of `document_ids`; a failure in one document yields an error entry
+    for that document only. `entries` are catalog items by document id. Documents still
+    loading at the `deadline` are returned as skipped and left to finish in the background.
+    """
+
+    def load(doc_id: str) -> Dict[str, Any]:
         try:
-            retrieved = retrieve_top_k(
+            return _load_document(
+                s3,
+                uploads_bucket,
+                reports_bucket,
+                user_prefix,
+                doc_id,
+                (entries or {}).get(doc_id),
+                deadline,
+            )
+        except Exception as exc:
+            return {
+                "documentId": doc_id,
+                "parsed": {
+                    "docType": "error",
+                    "text": "",
+                    "tables": [],
+                    "metadata": {"error": str(exc)},
+                },
+                "filename": "",
+            }
+
+    if not document_ids:
+        return []
+    if deadline is None and len(document_ids) == 1:
+        return [load(document_ids[0])]
+    workers = max(1, int(os.environ.get("AGENT_LOAD_CONCURRENCY") or 8))
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(document_ids)))
+    futures = [pool.submit(load, doc_id) for doc_id in document_ids]
+    wait(futures, timeout=deadline.remaining() if deadline is not None else None)
+    # Do not block on stragglers: the answer is assembled from whatever finished
+    pool.shutdown(wait=False, cancel_futures=True)
+    return [
+        f.result() if f.done() else _skipped(doc_id, "", "load did not finish in time")
+        for doc_id, f in zip(document_ids, futures)
+    ]
+
+
+def _raw_excerpt_hits(
+    parsed_docs: List[Dict[str, Any]], prompt: str, top_k: int = 5
+) -> List[Dict[str, Any]]:
+    """Score parsed pages/tables by prompt-term counts; shaped like retrieval hits."""
+    terms = [t for t in re.findall(r"[a-zA-Z][a-zA-Z0-9_-]{2,}", prompt.lower())]
+    if not terms:
+        return []
+    hits: List[Dict[str, Any]] = []
+    for doc in parsed_docs:
+        parsed = doc.get("parsed") or {}
+        title = (parsed.get("metadata") or {}).get("title")
+        units: List[Tuple[str, Dict[str, Any]]] = []
+        for page in parsed.get("pages") or []:
+            if isinstance(page, dict) and page.get("text"):
+                page_num = page.get("pageNumber") or page.get("page")
+                units.append((page["text"], {"page": page_num} if page_num else {}))
+        for table in parsed.get("tables") or []:
+            if isinstance(table, dict) and table.get("text"):
+                sheet = table.get("name") or table.get("sheet")
+                units.append((table["text"], {"sheet": sheet} if sheet else {}))
+        if not units and parsed.get("text"):
+            units.append((parsed["text"], {}))
+        for text, meta in units:
+            lt = text.lower()
+            score = sum(lt.count(t) for t in terms)
+            if score > 0:
+                hits.append(
+                    {
+                        "documentId": doc.get("documentId"),
+                        "text": text,
+                        "metadata": {"docType": parsed.get("docType"), "title": title, **meta},
+                        "score": score,
+                    }
+                )
+    hits.sort(key=lambda h: h["score"], reverse=True)
+    return hits[:top_k]
+
+
+def _retrieve_per_document(
+    prompt: str,
+    user_id: str,
+    document_ids: List[str],
+    reports_bucket: str,
+    versions: Dict[str, Any],
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Top AGENT_MAP_HITS_PER_DOC (default 4) hits of each document, retrieved concurrently."""
+    top_k = int(os.environ.get("AGENT_MAP_HITS_PER_DOC") or 4)
+
+    def one(doc_id: str) -> List[Dict[str, Any]]:
+        try:
+            return retrieve_top_k(
                 prompt=prompt,
-                user_id=event.get("userId", "anon"),
-                document_ids=document_ids,
+                user_id=user_id,
+                document_ids=[doc_id],
                 reports_bucket=reports_bucket,
-                top_k=5,
+                top_k=top_k,
+                versions={doc_id: versions.get(doc_id)},
             )
+        except Exception:
+            return []
+
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(document_ids)))) as pool:
+        found = list(pool.map(one, document_ids))
+    return {d: hits for d, hits in zip(document_ids, found) if hits}
+
+
+def _notes_md(degraded: List[str]) -> str:
+    if not degraded:
+        return ""
+    return "\n## Incomplete\n\n" + "\n".join(f"- {note}" for note in degraded) + "\n"
+
+
+def _output(
+    event: Dict[str, Any], s3: Any, reports_bucket: str, agent_result: str
+) -> Dict[str, Any]:
+    # Large results go to S3 (gzipped) so the task item only carries a preview and pointer
+    return {
+        "agentResult": results.offload(s3, reports_bucket, event.get("taskId"), agent_result),
+        "completedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "sessionId": event.get("sessionId", ""),
+    }
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    # Placeholder that returns a deterministic fake result for now
+    prompt = event.get("prompt") if isinstance(event, dict) else None
+    mode = (event.get("mode") or "retrieval").lower()
+    document_ids: List[str] = event.get("documentIds") or []
+
+    s3 = get_boto3_client("s3")
+    uploads_bucket = os.environ.get("UPLOADS_BUCKET", "")
+    reports_bucket = os.environ.get("REPORTS_BUCKET", "")
+
+    user_id = event.get("userId", "anon")
+    sources: List[Dict[str, Any]] = []
+    # Every stage works against the invocation deadline and degrades instead of overrunning it;
+    # what was cut short is reported in the result's "degraded" list
+    deadline = Deadline.from_context(context)
+    if event.get("budgetMs"):
+        # Callers answering inline (start_task's fast path) cap the whole request
+        deadline = Deadline(min(deadline.at, time.time() + float(event["budgetMs"]) / 1000.0))
+    total_seconds = deadline.remaining()
+    degraded: List[str] = []
+    # Streaming tasks publish answer text to the task's stream record as tokens arrive
+    writer = open_writer(event.get("taskId")) if event.get("stream") else None
+
+    # One batched catalog lookup resolves upload keys, ETags and live index versions
+    entries = catalog.get_documents(user_id, document_ids)
+    versions = {
+        d: e.get("indexVersion") for d, e in entries.items() if e.get("status") == catalog.INDEXED
+    }
+    use_retrieval = mode == "retrieval" and bool(reports_bucket and document_ids and prompt)
+    # Scope retrieval before scoring: explicit event filters win over ones read from the
+    # prompt (e.g. "page 3", "rows 5-9", 'sheet "Q1"')
+    filters = (
+        {**filters_from_prompt(prompt), **normalize_filters(event.get("filters"))}
+        if use_retrieval
+        else {}
+    )
+
+    # Answers are cached per prompt, document set (with index versions), model and filters
+    answer_keys = None
+    if use_retrieval and answer_cache.enabled():
+        answer_keys = answer_cache.cache_keys(
+            prompt, document_ids, versions, os.environ.get("BEDROCK_MODEL_ID"), filters
+        )
+    if answer_keys is not None:
+        try:
+            hit = answer_cache.get_answer(s3, reports_bucket, answer_keys, prompt)
+        except Exception:
+            hit = None
+        if hit is not None:
+            cached_result = json.loads(hit[0])
+            cached_result["cached"] = hit[1]
+            if writer is not None:
+                writer.close(cached_result.get("text") or "")
+            return _output(event, s3, reports_bucket, json.dumps(cached_result))
+
+    # Questions over many documents are answered per document and merged (map-reduce), so
+    # evidence from a few documents cannot crowd out the rest; filtered questions target
+    # specific pages or rows and keep the single prompt
+    spread = (
+        use_retrieval
+        and not filters
+        and map_reduce.wanted(event.get("answerMode"), len(document_ids))
+    )
+    per_doc: Dict[str, List[Dict[str, Any]]] = {}
+
+    # Follow-ups in a chat session first rescore the chunks earlier turns retrieved
+    session = None
+    if use_retrieval and not spread and session_cache.enabled():
+        try:
+            session = session_cache.load(
+                s3,
+                reports_bucket,
+                user_id,
+                event.get("sessionId") or "",
+                document_ids,
+                versions,
+                filters,
+            )
+        except Exception:
+            session = None
+
+    def retrieve() -> List[Dict[str, Any]]:
+        if spread:
+            per_doc_hits = _retrieve_per_document(
+                prompt, user_id, document_ids, reports_bucket, versions
+            )
+            per_doc.update(per_doc_hits)
+            return [h for hits in per_doc_hits.values() for h in hits]
+        hits = session_cache.rescore(session, prompt, top_k=5) if session else []
+        if hits:
+            session_cache.record(s3, reports_bucket, session, prompt, hits)
+            return hits
+        pool: List[Dict[str, Any]] | None = [] if session is not None else None
+        hits = retrieve_top_k(
+            prompt=prompt,
+            user_id=user_id,
+            document_ids=document_ids,
+            reports_bucket=reports_bucket,
+            top_k=5,
+            filters=filters,
+            versions=versions,
+            candidate_pool=pool,
+        )
+        if session is not None and hits:
+            session_cache.record(s3, reports_bucket, session, prompt, hits, pool)
+        return hits
+
+    # Try vector retrieval first (if embeddings exist); hits carry filename/title from the
+    # index header, so the full documents are not needed when the index answers.
+    retrieved: List[Dict[str, Any]] = []
+    if use_retrieval:
+        retrieval_by = deadline.slice(
+            0.4, float(os.environ.get("AGENT_RETRIEVAL_MAX_SECONDS") or 30)
+        )
+        try:
+            retrieved, finished = run_with_timeout(retrieve, retrieval_by.remaining(), default=[])
+            if not finished:
+                degraded.append("retrieval timed out")
         except Exception:
             retrieved = []
 
+    parsed_docs: List[Dict[str, Any]] = []
+    doc_id_to_filename: Dict[str, str] = {
+        str(r.get("documentId")): r["filename"] for r in retrieved if r.get("filename")
+    }
+    if not retrieved:
+        # Retrieval missed (e.g. the documents are not indexed yet): load the parsed documents
+        # and fall back to raw excerpts that lexically match the prompt
+        loaded = _load_documents(
+            s3,
+            uploads_bucket,
+            reports_bucket,
+            user_id,
+            document_ids,
+            entries,
+            # Leave room for the answer call
+            deadline.slice(0.75),
+        )
+        for doc in loaded:
+            if doc["parsed"].get("docType") == "skipped":
+                degraded.append(f"{doc['documentId']}: {doc['parsed']['metadata']['error']}")
+            if doc["filename"]:
+                doc_id_to_filename[doc["documentId"]] = doc["filename"]
+            parsed_docs.append({"documentId": doc["documentId"], "parsed": doc["parsed"]})
+        retrieved = _raw_excerpt_hits(parsed_docs, prompt or "", top_k=5)
+
     excerpts: list[str] = []
     if retrieved:
-        # If the prompt asks for a specific page (e.g., "page 3"), bias to that page
-        try:
-            m = re.search(r"\bpage\s+(\d+)\b", (prompt or ""), re.IGNORECASE)
-            if m:
-                page_num = int(m.group(1))
-                filt = [r for r in retrieved if (r.get("metadata") or {}).get("page") == page_num]
-                if filt:
-                    retrieved = filt
-        except Exception:
-            pass
         # Lightweight keyword filter to prefer chunks that actually contain request terms
         try:
             q = (prompt or "").lower()
@@ -233,12 +551,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     "sheets": set(),
                 },
             )
-            if isinstance(meta.get("page"), int):
-                entry["pages"].add(int(meta["page"]))
-            if isinstance(meta.get("row"), int):
-                entry["rows"].add(int(meta["row"]))
-            if meta.get("sheet"):
-                entry["sheets"].add(str(meta["sheet"]))
+            # A collapsed duplicate chunk cites every page/sheet/row it appeared on
+            for cite in [meta] + list(meta.get("citations") or []):
+                if isinstance(cite.get("page"), int):
+                    entry["pages"].add(int(cite["page"]))
+                if isinstance(cite.get("row"), int):
+                    entry["rows"].add(int(cite["row"]))
+                if cite.get("sheet"):
+                    entry["sheets"].add(str(cite["sheet"]))
         # Convert sets to sorted lists
         sources = []
         for e in agg.values():
@@ -252,32 +572,79 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             sources.append(src)
     else:
         # Strict retrieval mode: if no hits, return an explicit no-evidence message
-        answer_text = (
-            "No evidence found in the provided documents for your request. "
-            "Try rephrasing the question or uploading a document that contains the answer."
-        )
+        if degraded:
+            answer_text = (
+                "The request ran out of time before evidence could be gathered from the "
+                "provided documents. Please try again shortly."
+            )
+        else:
+            answer_text = (
+                "No evidence found in the provided documents for your request. "
+                "Try rephrasing the question or uploading a document that contains the answer."
+            )
         report_md = f"# Report\n\n## Prompt\n{prompt}\n\nNo retrieval hits.\n"
         result = {
             "text": answer_text,
             "sources": [],
-            "report": {"format": "markdown", "content": report_md},
-        }
-        completed_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        return {
-            "agentResult": json.dumps(result),
-            "completedAt": completed_at,
-            "sessionId": event.get("sessionId", ""),
+            "report": {"format": "markdown", "content": report_md + _notes_md(degraded)},
         }
+        if degraded:
+            result["degraded"] = degraded
+        if writer is not None:
+            writer.close(answer_text)
+        return _output(event, s3, reports_bucket, json.dumps(result))
 
+    # Only answers the model produced are cached; excerpt fallbacks are served but not kept
+    model_answered = False
     if excerpts:
         # Limit to a reasonable preview length (use the most relevant slice only)
         preview = (excerpts[0] if excerpts else "")[:2000]
+        # The model sees every retrieved hit: overlapping spans merged, rows compacted into
+        # tables, ranked and cited, within CONTEXT_TOKEN_BUDGET (halved when time is short:
+        # under AGENT_SHORT_PROMPT_SECONDS, or under half of a smaller request budget)
+        token_budget = default_budget()
+        short = min(float(os.environ.get("AGENT_SHORT_PROMPT_SECONDS") or 20), total_seconds / 2)
+        if deadline.remaining() < short:
+            token_budget = max(500, token_budget // 2)
+        packed = pack_context(
+            [
+                {
+                    **r,
+                    "filename": r.get("filename")
+                    or doc_id_to_filename.get(str(r.get("documentId")), ""),
+                }
+                for r in retrieved
+            ],
+            token_budget,
+        )
+        evidence = packed["text"] or preview
         # Call Bedrock Runtime directly with prompt + parsed context. Then fallback to excerpts.
         answer_text = None
         bedrock_model_id = os.environ.get("BEDROCK_MODEL_ID")
-        if bedrock_model_id:
+        if bedrock_model_id and deadline.remaining() < float(
+            os.environ.get("AGENT_LLM_MIN_SECONDS") or 3
+        ):
+            degraded.append("answer generation skipped: not enough time left")
+        elif bedrock_model_id and per_doc:
+            try:
+                mapped = map_reduce.answer(
+                    prompt,
+                    per_doc,
+                    bedrock_model_id,
+                    deadline,
+                    on_text=writer.append if writer is not None else None,
+                )
+            except Exception:
+                mapped = {"text": "", "notes": ["answer generation failed"]}
+            degraded.extend(mapped["notes"])
+            answer_text = mapped["text"] or None
+            if answer_text:
+                model_answered = True
+                evidence = mapped["evidence"]
+                # Cite only the documents the merged answer drew on
+                sources = [s for s in sources if s["documentId"] in mapped["documentIds"]]
+        elif bedrock_model_id:
             try:
-                brt = boto3.client("bedrock-runtime", config=Config(retries={"max_attempts": 3}))
                 system_inst = (
                     "You are a document analysis assistant. Answer ONLY with the facts needed to answer the user's question. "
                     "Do not add disclaimers or statements about missing details. Do not include a Sources section in your text. "
@@ -285,42 +652,77 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 )
                 content_text = (
                     f"Question: {prompt}\n\n"
-                    f"Parsed content excerpt (may be truncated):\n{preview}"
-                )
-                resp = brt.converse(
-                    modelId=bedrock_model_id,
-                    messages=[{"role": "user", "content": [{"text": content_text}]}],
-                    system=[{"text": system_inst}],
+                    f"Evidence from the documents, numbered by source (may be truncated):\n"
+                    f"{evidence}"
                 )
+                messages = [{"role": "user", "content": [{"text": content_text}]}]
+
+                def generate() -> Dict[str, Any]:
+                    if writer is not None:
+                        return bedrock.converse_stream(
+                            bedrock_model_id,
+                            messages,
+                            writer.append,
+                            system=[{"text": system_inst}],
+                            deadline=deadline.at,
+                        )
+                    return bedrock.converse(
+                        bedrock_model_id,
+                        messages,
+                        system=[{"text": system_inst}],
+                        deadline=deadline.at,
+                    )
+
+                resp, finished = run_with_timeout(generate, deadline.remaining(), default={})
+                if not finished:
+                    if writer is not None and writer.text:
+                        # Keep what was streamed before the deadline; closing first stops
+                        # the abandoned stream from appending past the published answer
+                        writer.close()
+                        resp = {"output": {"message": {"content": [{"text": writer.text}]}}}
+                        degraded.append("answer truncated at the deadline")
+                    else:
+                        degraded.append("answer generation timed out")
                 parts = resp.get("output", {}).get("message", {}).get("content", [])
                 if parts:
                     answer_text = parts[0].get("text") or ""
+                    model_answered = bool(answer_text)
+            except TimeoutError:
+                # The gateway refuses to start a call once the deadline has passed
+                degraded.append("answer generation timed out")
+            except bedrock.BedrockThrottled:
+                # No rate-limit token could be had before the deadline
+                degraded.append("answer generation throttled")
             except Exception:
-                answer_text = None
+                degraded.append("answer generation failed")
         if not answer_text:
             answer_text = f"Here is an excerpt based on your question: '{prompt}'.\n\n" + preview
-        report_md = f"# Report\n\n## Prompt\n{prompt}\n\n## Excerpts\n\n{preview}\n"
+        report_md = f"# Report\n\n## Prompt\n{prompt}\n\n## Excerpts\n\n{evidence}\n"
     else:
-        joined_titles = ", ".join(
-            [
-                p["parsed"].get("metadata", {}).get("title", doc.get("documentId"))
-                for doc in parsed_docs
-                for p in [doc]
-            ]
-        )
+        titled = [
+            (doc["documentId"], doc["parsed"].get("metadata", {}).get("title"))
+            for doc in parsed_docs
+        ] or [(r.get("documentId"), r.get("title") or r.get("filename")) for r in retrieved]
+        titles: Dict[Any, Any] = {}
+        for doc_id, title in titled:
+            titles.setdefault(doc_id, title or doc_id)
+        joined_titles = ", ".join(str(t) for t in titles.values())
         answer_text = (
-            f"No parsed text extracted. Parsed {len(parsed_docs)} document(s): {joined_titles}."
+            f"No parsed text extracted. Parsed {len(titles)} document(s): {joined_titles}."
         )
         report_md = f"# Report\n\n{answer_text}\n"
 
     result = {
         "text": answer_text,
         "sources": sources,
-        "report": {"format": "markdown", "content": report_md},
-    }
-    completed_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-    return {
-        "agentResult": json.dumps(result),
-        "completedAt": completed_at,
-        "sessionId": event.get("sessionId", ""),
+        "report": {"format": "markdown", "content": report_md + _notes_md(degraded)},
     }
+    if degraded:
+        # Partial result: the answer stands on whatever evidence was gathered in time
+        result["degraded"] = degraded
+    if writer is not None:
+        # Fallback answers (no model, excerpts only) are published whole
+        writer.close(answer_text)
+    if answer_keys is not None and model_answered and not degraded:
+        answer_cache.put_answer(s3, reports_bucket, answer_keys, prompt, json.dumps(result))
+    return _output(event, s3, reports_bucket, json.dumps(result))
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import os
+import time
+from decimal import Decimal
+from typing import Any, Optional
+
+from botocore.exceptions import ClientError
+
+from .aws import get_boto3_resource
+
+# Token bucket shared by every container, stored as one item per bucket in RATE_LIMITS_TABLE
+# ({"bucketId", "tokens", "updatedAt"}). Taking a token is a read followed by a conditional
+# write on the previous "updatedAt", so concurrent takers cannot spend the same token; the
+# loser re-reads. Without a table (local runs) every acquire succeeds.
+#
+# Unlike common.bedrock's per-container bucket this never sleeps: acquire() reports how long
+# until a token is available and the caller decides how to wait (e.g. by deferring a queued
+# message instead of holding a Lambda idle).
+
+
+class SharedTokenBucket:
+    def __init__(self, bucket_id: str, rate: float, burst: float, table_name: Optional[str] = None):
+        self.bucket_id = bucket_id
+        self.rate = max(0.01, float(rate))
+        self.burst = max(1.0, float(burst))
+        self.table_name = (
+            table_name if table_name is not None else os.environ.get("RATE_LIMITS_TABLE", "")
+        )
+
+    def _table(self) -> Any:
+        return get_boto3_resource("dynamodb").Table(self.table_name)
+
+    def acquire(self) -> float:
+        """Take one token. Returns 0.0 when taken, else the seconds until one accrues."""
+        if not self.table_name:
+            return 0.0
+        try:
+            for _ in range(3):
+                now = time.time()
+                item = (
+                    self._table()
+                    .get_item(Key={"bucketId": self.bucket_id}, ConsistentRead=True)
+                    .get("Item")
+                )
+                previous = item.get("updatedAt") if item else None
+                tokens = self.burst
+                if item:
+                    elapsed = max(0.0, now - float(item.get("updatedAt") or now))
+                    tokens = min(self.burst, float(item.get("tokens") or 0) + elapsed * self.rate)
+                if tokens < 1.0:
+                    return (1.0 - tokens) / self.rate
+                condition = (
+                    "attribute_not_exists(updatedAt)" if previous is None else "updatedAt = :prev"
+                )
+                values = {
+                    ":t": Decimal(str(round(tokens - 1.0, 6))),
+                    ":u": Decimal(str(round(now, 6))),
+                }
+                if previous is not None:
+                    values[":prev"] = previous
+                try:
+                    self._table().update_item(
+                        Key={"bucketId": self.bucket_id},
+                        UpdateExpression="SET tokens = :t, updatedAt = :u",
+                        ConditionExpression=condition,
+                        ExpressionAttributeValues=values,
+                    )
+                    return 0.0
+                except ClientError as exc:
+                    if (
+                        exc.response.get("Error", {}).get("Code")
+                        != "ConditionalCheckFailedException"
+                    ):
+                        raise
+            # Heavily contended: back off briefly rather than spin
+            return 1.0 / self.rate
+        except Exception:
+            # The limiter must not take the service down with it; fail open
+            return 0.0
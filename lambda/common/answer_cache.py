@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .cache import get_cache
+from .retrieval import embed_query
+
+# Cache of finished answers, shared by every container through the reports bucket:
+#
+#   answers/<key>.json       {"prompt", "agentResult", "expiresAt"}
+#   answers/sets/<set>.json  {"entries": [{"key", "prompt", "vector", "expiresAt"}, ...]}
+#
+# The exact key hashes the normalized prompt, the sorted document ids with each document's
+# index version, the answer model id and any retrieval filters. Re-indexing a document gives
+# it a new index version, so every answer built on the old index stops matching without an
+# explicit purge; stale objects age out after ANSWER_CACHE_TTL_SECONDS (default 86400).
+# Warm containers also keep answers in the "answers" memory cache.
+#
+# Optional semantic tier (ANSWER_CACHE_SEMANTIC=1): the set file lists the recent prompts
+# asked of the same document set (same versions, model and filters) with their embeddings;
+# a prompt whose cosine similarity to one of them is at least ANSWER_CACHE_SIMILARITY
+# (default 0.95) reuses that answer.
+
+_PREFIX = "answers"
+_MAX_SET_ENTRIES = 50
+
+
+def _ttl() -> float:
+    try:
+        return float(os.environ.get("ANSWER_CACHE_TTL_SECONDS") or 86400)
+    except ValueError:
+        return 86400.0
+
+
+def enabled() -> bool:
+    return (os.environ.get("ANSWER_CACHE_ENABLED") or "1") != "0"
+
+
+def normalize_prompt(prompt: str) -> str:
+    text = re.sub(r"\s+", " ", (prompt or "").strip().lower())
+    return text.rstrip(" ?!.")
+
+
+def cache_keys(
+    prompt: str,
+    document_ids: List[str],
+    versions: Dict[str, Optional[str]],
+    model_id: Optional[str],
+    filters: Optional[Dict[str, Any]] = None,
+) -> Optional[Tuple[str, str]]:
+    """(answer key, document-set key), or None unless every document has an index version."""
+    docs = sorted(set(document_ids))
+    if not docs or not all(versions.get(d) for d in docs):
+        return None
+    scope = json.dumps(
+        {
+            "documents": [[d, versions[d]] for d in docs],
+            "model": model_id or "",
+            "filters": filters or {},
+        },
+        sort_keys=True,
+        default=str,
+    )
+    set_key = hashlib.sha256(scope.encode("utf-8")).hexdigest()
+    answer_key = hashlib.sha256(
+        f"{set_key}\n{normalize_prompt(prompt)}".encode("utf-8")
+    ).hexdigest()
+    return answer_key, set_key
+
+
+def _read_json(s3: Any, bucket: str, key: str) -> Optional[Dict[str, Any]]:
+    try:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        data = json.loads(body.decode("utf-8"))
+        return data if isinstance(data, dict) else None
+    except Exception:
+        return None
+
+
+def _semantic() -> bool:
+    return (os.environ.get("ANSWER_CACHE_SEMANTIC") or "0") == "1"
+
+
+def _threshold() -> float:
+    try:
+        return float(os.environ.get("ANSWER_CACHE_SIMILARITY") or 0.95)
+    except ValueError:
+        return 0.95
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    n = min(len(a), len(b))
+    dot = sum(a[i] * b[i] for i in range(n))
+    na = sum(a[i] * a[i] for i in range(n)) ** 0.5
+    nb = sum(b[i] * b[i] for i in range(n)) ** 0.5
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def _get(s3: Any, bucket: str, answer_key: str) -> Optional[str]:
+    memory = get_cache("answers", memory_mb=16, disk_mb=32)
+    entry = memory.get(answer_key)
+    if entry is None:
+        entry = _read_json(s3, bucket, f"{_PREFIX}/{answer_key}.json")
+        if entry is None:
+            return None
+        memory.put(answer_key, entry, size=len(entry.get("agentResult") or "") + 256)
+    if float(entry.get("expiresAt") or 0) < time.time():
+        memory.invalidate(answer_key)
+        return None
+    return entry.get("agentResult")
+
+
+def get_answer(
+    s3: Any, bucket: str, keys: Tuple[str, str], prompt: str
+) -> Optional[Tuple[str, str]]:
+    """(agentResult JSON, "exact" | "semantic") for a cached answer, or None."""
+    answer_key, set_key = keys
+    found = _get(s3, bucket, answer_key)
+    if found is not None:
+        return found, "exact"
+    if not _semantic():
+        return None
+    listing = _read_json(s3, bucket, f"{_PREFIX}/sets/{set_key}.json") or {}
+    now = time.time()
+    candidates = [e for e in listing.get("entries") or [] if float(e.get("expiresAt") or 0) >= now]
+    if not candidates:
+        return None
+    vector = embed_query(prompt)
+    if not any(vector):
+        return None
+    best = max(candidates, key=lambda e: _cosine(vector, e.get("vector") or []))
+    if _cosine(vector, best.get("vector") or []) < _threshold():
+        return None
+    found = _get(s3, bucket, str(best.get("key")))
+    return (found, "semantic") if found is not None else None
+
+
+def put_answer(s3: Any, bucket: str, keys: Tuple[str, str], prompt: str, agent_result: str) -> None:
+    """Store an answer (best effort; failures are ignored)."""
+    answer_key, set_key = keys
+    expires_at = time.time() + _ttl()
+    entry = {"prompt": prompt, "agentResult": agent_result, "expiresAt": expires_at}
+    try:
+        s3.put_object(
+            Bucket=bucket,
+            Key=f"{_PREFIX}/{answer_key}.json",
+            Body=json.dumps(entry).encode("utf-8"),
+            ContentType="application/json",
+        )
+    except Exception:
+        return
+    get_cache("answers", memory_mb=16, disk_mb=32).put(
+        answer_key, entry, size=len(agent_result) + 256
+    )
+    if not _semantic():
+        return
+    try:
+        vector = embed_query(prompt)
+        if not any(vector):
+            return
+        set_path = f"{_PREFIX}/sets/{set_key}.json"
+        listing = _read_json(s3, bucket, set_path) or {}
+        now = time.time()
+        # Concurrent writers may drop each other's entries; that only costs a semantic miss
+        entries = [
+            e
+            for e in listing.get("entries") or []
+            if e.get("key") != answer_key and float(e.get("expiresAt") or 0) >= now
+        ]
+        entries.append(
+            {"key": answer_key, "prompt": prompt, "vector": vector, "expiresAt": expires_at}
+        )
+        s3.put_object(
+            Bucket=bucket,
+            Key=set_path,
+            Body=json.dumps({"entries": entries[-_MAX_SET_ENTRIES:]}).encode("utf-8"),
+            ContentType="application/json",
+        )
+    except Exception:
+        pass
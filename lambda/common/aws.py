@@ -1,12 +1,93 @@
+import base64
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
 import boto3
-from functools import lru_cache
+from botocore.config import Config
+
+# Container-wide registry of boto3 clients and resources, keyed by service and config.
+#
+# Clients are built once per container (construction costs tens of milliseconds and each new
+# client opens its own connection pool and TLS sessions), with pooled connections, TCP
+# keepalive, bounded timeouts and standard-mode retries by default. Callers pass Config
+# keyword overrides, e.g. get_boto3_client("bedrock-runtime", read_timeout=60).
+#
+# AWS_MAX_POOL_CONNECTIONS (default 32), AWS_CONNECT_TIMEOUT (default 3s) and
+# AWS_READ_TIMEOUT (default 30s) tune the defaults. Nothing is created at import time: handlers
+# call these on first use so cold starts only pay for the clients a request actually needs.
+
+_LOCK = threading.Lock()
+_CLIENTS: Dict[Tuple[str, str, str], Any] = {}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def _config(overrides: Dict[str, Any]) -> Config:
+    options: Dict[str, Any] = {
+        "max_pool_connections": _env_int("AWS_MAX_POOL_CONNECTIONS", 32),
+        "connect_timeout": _env_int("AWS_CONNECT_TIMEOUT", 3),
+        "read_timeout": _env_int("AWS_READ_TIMEOUT", 30),
+        "tcp_keepalive": True,
+        "retries": {"max_attempts": 3, "mode": "standard"},
+    }
+    options.update(overrides)
+    return Config(**options)
+
+
+def _get(kind: str, service_name: str, overrides: Dict[str, Any]) -> Any:
+    key = (kind, service_name, json.dumps(overrides, sort_keys=True, default=str))
+    found = _CLIENTS.get(key)
+    if found is not None:
+        return found
+    # The default boto3 session is not safe for concurrent client creation
+    with _LOCK:
+        found = _CLIENTS.get(key)
+        if found is None:
+            factory = boto3.client if kind == "client" else boto3.resource
+            found = factory(service_name, config=_config(overrides))
+            _CLIENTS[key] = found
+        return found
+
+
+def get_boto3_client(service_name: str, **config: Any):
+    return _get("client", service_name, config)
+
+
+def get_boto3_resource(service_name: str, **config: Any):
+    return _get("resource", service_name, config)
+
 
+_SECRETS_LOCK = threading.Lock()
+_SECRETS: Dict[str, Tuple[float, str]] = {}
 
-@lru_cache(maxsize=1)
-def get_boto3_client(service_name: str):
-    return boto3.client(service_name)
 
+def get_secret_string(secret_id: str, ttl_seconds: Optional[float] = None) -> Optional[str]:
+    """Secrets Manager value, memoized per container for SECRETS_TTL_SECONDS (default 300).
 
-@lru_cache(maxsize=1)
-def get_boto3_resource(service_name: str):
-    return boto3.resource(service_name)
+    A failed refresh keeps serving the previous value rather than failing the caller.
+    """
+    if ttl_seconds is None:
+        ttl_seconds = _env_int("SECRETS_TTL_SECONDS", 300)
+    now = time.monotonic()
+    with _SECRETS_LOCK:
+        cached = _SECRETS.get(secret_id)
+    if cached is not None and now - cached[0] < ttl_seconds:
+        return cached[1]
+    try:
+        resp = get_boto3_client("secretsmanager").get_secret_value(SecretId=secret_id)
+        value = resp.get("SecretString") or base64.b64decode(
+            resp.get("SecretBinary") or b""
+        ).decode("utf-8")
+    except Exception:
+        return cached[1] if cached is not None else None
+    with _SECRETS_LOCK:
+        _SECRETS[secret_id] = (now, value)
+    return value
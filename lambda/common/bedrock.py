@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from .aws import get_boto3_client
+
+# Gateway for all Bedrock traffic (bedrock-runtime and bedrock-agent-runtime).
+#
+# - One pooled client per service per container; botocore retries are off so that retrying
+#   happens here, once, instead of stacking botocore retries under our own.
+# - A token bucket per model (BEDROCK_RATE_PER_SEC, default 5; BEDROCK_BURST, default 2x the
+#   rate) admits calls. Throttling halves the model's admitted rate and successes restore it
+#   additively, so a throttled container backs off as a whole instead of every thread
+#   retrying on its own schedule.
+# - At most BEDROCK_MAX_CONCURRENCY (default 4) calls per model are in flight.
+# - Retryable errors (throttling, 5xx, timeouts) are retried up to BEDROCK_MAX_ATTEMPTS
+#   (default 4) times with full-jitter exponential backoff, never past the caller's deadline.
+# - Every call records latency, attempts, throttles and token usage; see metrics().
+# - Embedding calls (invoke_model with kind="embedding") are limited separately, since
+#   index_etl embeds one chunk per call: BEDROCK_EMBED_RATE_PER_SEC (default 30),
+#   BEDROCK_EMBED_BURST (default 2x the rate), BEDROCK_EMBED_MAX_CONCURRENCY (default 8).
+# Per-model overrides: BEDROCK_MODEL_LIMITS='{"<modelId>": {"rate": 2, "burst": 2,
+# "concurrency": 2}}'.
+
+_RETRYABLE_CODES = {
+    "throttlingexception",
+    "throttling",
+    "throttled",
+    "toomanyrequestsexception",
+    "servicequotaexceededexception",
+    "serviceunavailableexception",
+    "serviceunavailable",
+    "internalserverexception",
+    "modelnotreadyexception",
+    "modeltimeoutexception",
+    "requesttimeout",
+    "requesttimeoutexception",
+}
+_THROTTLE_CODES = {
+    "throttlingexception",
+    "throttling",
+    "throttled",
+    "toomanyrequestsexception",
+    "servicequotaexceededexception",
+    "throttlingerror",
+    "throttlingerrorexception",
+}
+
+
+class BedrockThrottled(Exception):
+    """Raised when a call cannot be admitted by the rate limiter before the deadline."""
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def _error_code(exc: Exception) -> str:
+    if isinstance(exc, ClientError):
+        return str(exc.response.get("Error", {}).get("Code", "")).lower()
+    return ""
+
+
+def is_throttling_error(exc: Exception) -> bool:
+    if isinstance(exc, BedrockThrottled):
+        return True
+    msg = str(exc).lower()
+    if "throttl" in msg or "rate exceeded" in msg or "too many requests" in msg:
+        return True
+    return _error_code(exc) in _THROTTLE_CODES
+
+
+def is_retryable_error(exc: Exception) -> bool:
+    if is_throttling_error(exc):
+        return True
+    if _error_code(exc) in _RETRYABLE_CODES:
+        return True
+    if isinstance(exc, ClientError):
+        status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return int(status) >= 500
+    # Connection resets and read timeouts surface as botocore/urllib3 exceptions
+    return type(exc).__name__ in {
+        "ReadTimeoutError",
+        "ConnectTimeoutError",
+        "EndpointConnectionError",
+        "ConnectionClosedError",
+    }
+
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts to throttling (halve on throttle, +5% per success)."""
+
+    def __init__(self, rate: float, burst: float):
+        self.max_rate = max(0.01, float(rate))
+        self.rate = self.max_rate
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        """Take one token, waiting for it; False if it cannot be had before `deadline`."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return True
+                wait = (1.0 - self.tokens) / self.rate
+            if deadline is not None and time.time() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.rate = max(self.max_rate * 0.1, self.rate * 0.5)
+            # Drop any accumulated burst so queued callers space out immediately
+            self.tokens = min(self.tokens, 0.0)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+# Environment variables (rate, burst, concurrency) and their defaults per kind of call
+_LIMIT_DEFAULTS = {
+    "generation": (("BEDROCK_RATE_PER_SEC", 5), "BEDROCK_BURST", ("BEDROCK_MAX_CONCURRENCY", 4)),
+    "embedding": (
+        ("BEDROCK_EMBED_RATE_PER_SEC", 30),
+        "BEDROCK_EMBED_BURST",
+        ("BEDROCK_EMBED_MAX_CONCURRENCY", 8),
+    ),
+}
+
+
+class _ModelLimits:
+    def __init__(self, rate: float, burst: float, concurrency: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = max(1, concurrency)
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+
+
+_LIMITS: Dict[str, _ModelLimits] = {}
+_LIMITS_LOCK = threading.Lock()
+
+
+def _limits(model_key: str, kind: str = "generation") -> _ModelLimits:
+    with _LIMITS_LOCK:
+        limits = _LIMITS.get(model_key)
+        if limits is None:
+            try:
+                overrides = json.loads(os.environ.get("BEDROCK_MODEL_LIMITS") or "{}")
+            except ValueError:
+                overrides = {}
+            override = overrides.get(model_key) if isinstance(overrides, dict) else None
+            override = override if isinstance(override, dict) else {}
+            rate_env, burst_env, concurrency_env = _LIMIT_DEFAULTS.get(
+                kind, _LIMIT_DEFAULTS["generation"]
+            )
+            rate = float(override.get("rate") or _env_float(*rate_env))
+            limits = _ModelLimits(
+                rate=rate,
+                burst=float(override.get("burst") or _env_float(burst_env, 2 * rate)),
+                concurrency=int(override.get("concurrency") or _env_float(*concurrency_env)),
+            )
+            _LIMITS[model_key] = limits
+        return limits
+
+
+def max_concurrency(model_key: str, kind: str = "generation") -> int:
+    """How many calls to `model_key` this container runs at once; size fan-out below this."""
+    return _limits(model_key, kind).concurrency
+
+
+def client(service: str = "bedrock-runtime") -> Any:
+    """Pooled client shared by every caller in the container (retries handled by the gateway)."""
+    return get_boto3_client(
+        service,
+        retries={"max_attempts": 1, "mode": "standard"},
+        max_pool_connections=int(_env_float("BEDROCK_MAX_POOL_CONNECTIONS", 16)),
+        connect_timeout=int(_env_float("BEDROCK_CONNECT_TIMEOUT", 5)),
+        read_timeout=int(_env_float("BEDROCK_READ_TIMEOUT", 60)),
+    )
+
+
+# -- metrics ----------------------------------------------------------------------------------
+
+_METRICS_LOCK = threading.Lock()
+_RECENT: Deque[Dict[str, Any]] = deque(maxlen=200)
+_TOTALS: Dict[str, Dict[str, float]] = {}
+
+
+def _record(entry: Dict[str, Any]) -> None:
+    with _METRICS_LOCK:
+        _RECENT.append(entry)
+        key = f"{entry['operation']}:{entry['modelId']}"
+        totals = _TOTALS.setdefault(
+            key,
+            {
+                "calls": 0,
+                "errors": 0,
+                "attempts": 0,
+                "throttles": 0,
+                "latencyMs": 0.0,
+                "inputTokens": 0,
+                "outputTokens": 0,
+            },
+        )
+        totals["calls"] += 1
+        totals["errors"] += 0 if entry["ok"] else 1
+        for field in ("attempts", "throttles", "latencyMs", "inputTokens", "outputTokens"):
+            totals[field] += entry.get(field) or 0
+
+
+def metrics(recent: int = 0) -> Dict[str, Any]:
+    """Per operation/model totals for this container, plus the last `recent` calls."""
+    with _METRICS_LOCK:
+        out: Dict[str, Any] = {"totals": {k: dict(v) for k, v in _TOTALS.items()}}
+        if recent:
+            out["recent"] = list(_RECENT)[-recent:]
+    return out
+
+
+def _usage(operation: str, resp: Any) -> Dict[str, int]:
+    if not isinstance(resp, dict):
+        return {}
+    usage = resp.get("usage")
+    if isinstance(usage, dict):
+        return {
+            "inputTokens": int(usage.get("inputTokens") or 0),
+            "outputTokens": int(usage.get("outputTokens") or 0),
+        }
+    headers = (resp.get("ResponseMetadata") or {}).get("HTTPHeaders") or {}
+    return {
+        "inputTokens": int(headers.get("x-amzn-bedrock-input-token-count") or 0),
+        "outputTokens": int(headers.get("x-amzn-bedrock-output-token-count") or 0),
+    }
+
+
+# -- calls ------------------------------------------------------------------------------------
+
+
+def call(
+    service: str,
+    operation: str,
+    model_key: str,
+    deadline: Optional[float] = None,
+    max_attempts: Optional[int] = None,
+    kind: str = "generation",
+    **params: Any,
+) -> Any:
+    """Invoke `operation` on the pooled `service` client under `model_key`'s limits.
+
+    `deadline` is an epoch time (seconds) after which no call is started and no backoff slept.
+    `kind` ("generation" or "embedding") picks the default limits for a model seen first.
+    """
+    limits = _limits(model_key, kind)
+    attempts = max(1, int(max_attempts or _env_float("BEDROCK_MAX_ATTEMPTS", 4)))
+    fn: Callable[..., Any] = getattr(client(service), operation)
+    started = time.time()
+    throttles = 0
+    attempt = 0
+    last_exc: Optional[Exception] = None
+    resp: Any = None
+    ok = False
+    try:
+        while attempt < attempts:
+            if deadline is not None and time.time() >= deadline:
+                raise last_exc or TimeoutError(f"deadline passed before calling {model_key}")
+            attempt += 1
+            if not limits.bucket.acquire(deadline):
+                raise BedrockThrottled(f"Throttled: rate limit for {model_key} before deadline")
+            wait = None if deadline is None else max(0.0, deadline - time.time())
+            if not limits.slots.acquire(timeout=wait):
+                raise BedrockThrottled(f"Throttled: no free slot for {model_key} before deadline")
+            # The slot may have freed up only after the deadline; send nothing nobody awaits
+            if deadline is not None and time.time() >= deadline:
+                limits.slots.release()
+                raise last_exc or TimeoutError(f"deadline passed before calling {model_key}")
+            try:
+                resp = fn(**params)
+                ok = True
+            except Exception as exc:
+                last_exc = exc
+            finally:
+                limits.slots.release()
+            if ok or last_exc is None:
+                limits.bucket.on_success()
+                return resp
+            if is_throttling_error(last_exc):
+                throttles += 1
+                limits.bucket.on_throttle()
+            if not is_retryable_error(last_exc) or attempt >= attempts:
+                raise last_exc
+            # Full jitter: spread retries uniformly so throttled callers do not re-align
+            delay = random.uniform(0, min(8.0, 0.25 * (2**attempt)))
+            if deadline is not None and time.time() + delay >= deadline:
+                raise last_exc
+            time.sleep(delay)
+        raise last_exc or BedrockThrottled(f"Throttled: {model_key}")
+    finally:
+        _record(
+            {
+                "operation": operation,
+                "modelId": model_key,
+                "ok": ok,
+                "attempts": attempt,
+                "throttles": throttles,
+                "latencyMs": round((time.time() - started) * 1000.0, 1),
+                **(_usage(operation, resp) if ok else {}),
+            }
+        )
+
+
+def converse(
+    model_id: str,
+    messages: List[Dict[str, Any]],
+    system: Optional[List[Dict[str, Any]]] = None,
+    deadline: Optional[float] = None,
+    **params: Any,
+) -> Dict[str, Any]:
+    if system:
+        params["system"] = system
+    return call(
+        "bedrock-runtime",
+        "converse",
+        model_id,
+        deadline=deadline,
+        modelId=model_id,
+        messages=messages,
+        **params,
+    )
+
+
+def converse_stream(
+    model_id: str,
+    messages: List[Dict[str, Any]],
+    on_text: Callable[[str], None],
+    system: Optional[List[Dict[str, Any]]] = None,
+    deadline: Optional[float] = None,
+    **params: Any,
+) -> Dict[str, Any]:
+    """ConverseStream: `on_text` receives each text delta as it arrives.
+
+    Returns a converse-shaped response ({"output": {"message": ...}, "usage", "stopReason"})
+    so callers can treat it like converse(). Only opening the stream is admitted and retried
+    by the gateway; a stream that fails midway raises, since replaying it would repeat output
+    the caller has already consumed.
+    """
+    if system:
+        params["system"] = system
+    resp = call(
+        "bedrock-runtime",
+        "converse_stream",
+        model_id,
+        deadline=deadline,
+        modelId=model_id,
+        messages=messages,
+        **params,
+    )
+    parts: List[str] = []
+    usage: Dict[str, Any] = {}
+    stop_reason = None
+    for event in resp.get("stream") or []:
+        delta = (event.get("contentBlockDelta") or {}).get("delta") or {}
+        if delta.get("text"):
+            parts.append(delta["text"])
+            on_text(delta["text"])
+        elif "messageStop" in event:
+            stop_reason = event["messageStop"].get("stopReason")
+        elif "metadata" in event:
+            usage = event["metadata"].get("usage") or {}
+    return {
+        "output": {"message": {"role": "assistant", "content": [{"text": "".join(parts)}]}},
+        "usage": usage,
+        "stopReason": stop_reason,
+    }
+
+
+def invoke_model(
+    model_id: str,
+    body: bytes,
+    deadline: Optional[float] = None,
+    kind: str = "generation",
+    **params: Any,
+) -> Dict[str, Any]:
+    params.setdefault("accept", "application/json")
+    params.setdefault("contentType", "application/json")
+    return call(
+        "bedrock-runtime",
+        "invoke_model",
+        model_id,
+        deadline=deadline,
+        kind=kind,
+        modelId=model_id,
+        body=body,
+        **params,
+    )
+
+
+def invoke_agent(
+    agent_id: str,
+    agent_alias_id: str,
+    session_id: str,
+    input_text: str,
+    deadline: Optional[float] = None,
+    **params: Any,
+) -> Dict[str, Any]:
+    """Start an agent invocation. The completion stream is read by the caller and is not
+    retried here: re-invoking after partial output would repeat the agent's work."""
+    return call(
+        "bedrock-agent-runtime",
+        "invoke_agent",
+        f"agent:{agent_id}",
+        deadline=deadline,
+        agentId=agent_id,
+        agentAliasId=agent_alias_id,
+        sessionId=session_id,
+        inputText=input_text,
+        **params,
+    )
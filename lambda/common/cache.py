@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Two-tier artifact cache shared by the handlers of a warm Lambda container.
+#
+#   memory  byte-budgeted LRU of decoded values; entries evicted from it spill to disk
+#   disk    byte-budgeted LRU of pickled entries under /tmp/<cache>/ (survives while the
+#           container is warm; /tmp is private to the container)
+#
+# Entries may carry an ETag (or any version string). A lookup with an ETag only hits an entry
+# stored with the same one, so a re-uploaded object is never served stale. Sizes are given by
+# the caller (usually the length of the serialized artifact) and drive eviction; a value
+# larger than the memory budget goes straight to disk, one larger than both is not cached.
+#
+# Budgets per cache come from CACHE_<NAME>_MEMORY_MB / CACHE_<NAME>_DISK_MB, falling back to
+# the defaults given to get_cache().
+
+_MB = 1024 * 1024
+
+
+class ArtifactCache:
+    def __init__(
+        self, name: str, memory_bytes: int, disk_bytes: int, disk_dir: Optional[str] = None
+    ):
+        self.name = name
+        self.memory_bytes = max(0, int(memory_bytes))
+        self.disk_bytes = max(0, int(disk_bytes))
+        self.disk_dir = disk_dir or os.path.join(tempfile.gettempdir(), f"cache-{name}")
+        self._lock = threading.Lock()
+        # key -> (etag, value, size)
+        self._memory: "OrderedDict[str, Tuple[Optional[str], Any, int]]" = OrderedDict()
+        self._memory_used = 0
+        # file path -> size; loaded from the directory on first use
+        self._disk: Optional["OrderedDict[str, int]"] = None
+        self._disk_used = 0
+        self._stats = {
+            "memoryHits": 0,
+            "diskHits": 0,
+            "misses": 0,
+            "stale": 0,
+            "memoryEvictions": 0,
+            "diskEvictions": 0,
+        }
+
+    # -- public API ---------------------------------------------------------------------------
+
+    def get(self, key: str, etag: Optional[str] = None) -> Any:
+        """Return the cached value for `key` (and `etag`, when given), or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if etag is None or entry[0] == etag:
+                    self._memory.move_to_end(key)
+                    self._stats["memoryHits"] += 1
+                    return entry[1]
+                self._stats["stale"] += 1
+        if entry is not None:
+            # Superseded object: drop both tiers (a spilled copy carries the same ETag)
+            self.invalidate(key)
+            return None
+        found = self._read_disk(key, etag)
+        with self._lock:
+            if found is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["diskHits"] += 1
+        stored_etag, value, size = found
+        # Promote so the next lookup is served from memory
+        self._store_memory(key, stored_etag, value, size)
+        return value
+
+    def put(self, key: str, value: Any, size: int, etag: Optional[str] = None) -> None:
+        if value is None:
+            return
+        size = max(1, int(size))
+        if size > self.memory_bytes:
+            self._write_disk(key, etag, value, size)
+            return
+        self._store_memory(key, etag, value, size)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._drop_memory(key)
+        path = self._path(key)
+        with self._lock:
+            disk = self._disk_index()
+            if path in disk:
+                self._disk_used -= disk.pop(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "memoryEntries": len(self._memory),
+                "memoryBytes": self._memory_used,
+                "diskEntries": len(self._disk or {}),
+                "diskBytes": self._disk_used,
+            }
+
+    # -- memory tier --------------------------------------------------------------------------
+
+    def _drop_memory(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_used -= entry[2]
+
+    def _store_memory(self, key: str, etag: Optional[str], value: Any, size: int) -> None:
+        spilled: List[Tuple[str, Optional[str], Any, int]] = []
+        with self._lock:
+            self._drop_memory(key)
+            self._memory[key] = (etag, value, size)
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes and len(self._memory) > 1:
+                old_key, (old_etag, old_value, old_size) = self._memory.popitem(last=False)
+                self._memory_used -= old_size
+                self._stats["memoryEvictions"] += 1
+                spilled.append((old_key, old_etag, old_value, old_size))
+        # Pickling happens outside the lock
+        for old_key, old_etag, old_value, old_size in spilled:
+            self._write_disk(old_key, old_etag, old_value, old_size)
+
+    # -- disk tier ----------------------------------------------------------------------------
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.pkl")
+
+    def _disk_index(self) -> "OrderedDict[str, int]":
+        """Caller holds the lock. Existing files (oldest first) seed the LRU order."""
+        if self._disk is None:
+            self._disk = OrderedDict()
+            try:
+                files = [
+                    os.path.join(self.disk_dir, f)
+                    for f in os.listdir(self.disk_dir)
+                    if f.endswith(".pkl")
+                ]
+                for path in sorted(files, key=os.path.getmtime):
+                    size = os.path.getsize(path)
+                    self._disk[path] = size
+                    self._disk_used += size
+            except OSError:
+                pass
+        return self._disk
+
+    def _read_disk(self, key: str, etag: Optional[str]) -> Optional[Tuple[Optional[str], Any, int]]:
+        if not self.disk_bytes:
+            return None
+        path = self._path(key)
+        with self._lock:
+            disk = self._disk_index()
+            if path not in disk:
+                return None
+            disk.move_to_end(path)
+        try:
+            with open(path, "rb") as fh:
+                stored_key, stored_etag, value, size = pickle.load(fh)
+        except Exception:
+            stored_key, stored_etag, value, size = None, None, None, 0
+        if stored_key != key or (etag is not None and stored_etag != etag):
+            with self._lock:
+                if stored_key == key:
+                    self._stats["stale"] += 1
+            self.invalidate(key)
+            return None
+        return stored_etag, value, size
+
+    def _write_disk(self, key: str, etag: Optional[str], value: Any, size: int) -> None:
+        if not self.disk_bytes:
+            return
+        try:
+            payload = pickle.dumps((key, etag, value, size), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        if len(payload) > self.disk_bytes:
+            return
+        path = self._path(key)
+        removed: List[str] = []
+        with self._lock:
+            disk = self._disk_index()
+            if path in disk:
+                self._disk_used -= disk.pop(path)
+            while disk and self._disk_used + len(payload) > self.disk_bytes:
+                old_path, old_size = disk.popitem(last=False)
+                self._disk_used -= old_size
+                self._stats["diskEvictions"] += 1
+                removed.append(old_path)
+            disk[path] = len(payload)
+            self._disk_used += len(payload)
+        for old_path in removed:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # Write-then-rename so a concurrent reader never sees a partial file
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(payload)
+            os.replace(tmp, path)
+        except OSError:
+            with self._lock:
+                if self._disk is not None and path in self._disk:
+                    self._disk_used -= self._disk.pop(path)
+
+
+_CACHES: Dict[str, ArtifactCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def _env_mb(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def get_cache(name: str, memory_mb: float = 32, disk_mb: float = 128) -> ArtifactCache:
+    """Return the container-wide cache called `name`, creating it on first use."""
+    with _CACHES_LOCK:
+        cache = _CACHES.get(name)
+        if cache is None:
+            env = name.upper().replace("-", "_")
+            cache = ArtifactCache(
+                name,
+                memory_bytes=int(_env_mb(f"CACHE_{env}_MEMORY_MB", memory_mb) * _MB),
+                disk_bytes=int(_env_mb(f"CACHE_{env}_DISK_MB", disk_mb) * _MB),
+            )
+            _CACHES[name] = cache
+        return cache
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    with _CACHES_LOCK:
+        caches = list(_CACHES.values())
+    return {c.name: c.stats() for c in caches}
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import os
+import time
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import BotoCoreError, ClientError
+
+from .aws import get_boto3_resource
+
+# Document catalog: one DynamoDB item per upload, keyed (userId, documentId).
+#
+# {
+#   "userId", "documentId", "key", "extension", "filename", "contentType",
+#   "size", "etag", "status", "indexVersion", "chunks", "error", "createdAt", "updatedAt"
+# }
+#
+# get_presigned_upload creates the item, index_etl fills in size/ETag and index status.
+# Handlers resolve documents with one BatchGetItem instead of probing `<user>/<doc>.pdf`
+# then `.xlsx` in the uploads bucket, and a user's documents are listed with a Query.
+# Lookups and updates fail soft: without the table (DOCUMENT_CATALOG_TABLE unset) or on
+# errors, callers fall back to S3 probing.
+
+UPLOAD_PENDING = "UPLOAD_PENDING"
+UPLOADED = "UPLOADED"
+INDEXING = "INDEXING"
+INDEXED = "INDEXED"
+FAILED = "FAILED"
+
+_BATCH_GET_LIMIT = 100
+
+logger = logging.getLogger(__name__)
+
+
+def table_name() -> str:
+    return os.environ.get("DOCUMENT_CATALOG_TABLE", "")
+
+
+def _resource() -> Any:
+    return get_boto3_resource("dynamodb")
+
+
+def _table() -> Any:
+    return _resource().Table(table_name())
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def _plain(item: Dict[str, Any]) -> Dict[str, Any]:
+    """DynamoDB numbers come back as Decimal; return ints so items are JSON-serializable."""
+    return {k: int(v) if isinstance(v, Decimal) else v for k, v in item.items()}
+
+
+def register_upload(
+    user_id: str, document_id: str, key: str, extension: str, filename: str, content_type: str
+) -> bool:
+    """Record a new upload before the client PUTs it (status UPLOAD_PENDING)."""
+    if not table_name():
+        return False
+    now = _now()
+    try:
+        _table().put_item(
+            Item={
+                "userId": user_id,
+                "documentId": document_id,
+                "key": key,
+                "extension": extension,
+                "filename": filename,
+                "contentType": content_type,
+                "status": UPLOAD_PENDING,
+                "createdAt": now,
+                "updatedAt": now,
+            }
+        )
+        return True
+    except Exception:
+        return False
+
+
+def update_document(user_id: str, document_id: str, **fields: Any) -> bool:
+    """Set the given attributes on a catalog item (creating it if needed); None removes one."""
+    if not table_name() or not fields:
+        return False
+    fields["updatedAt"] = _now()
+    sets: List[str] = []
+    removes: List[str] = []
+    names: Dict[str, str] = {}
+    values: Dict[str, Any] = {}
+    for i, (name, value) in enumerate(fields.items()):
+        names[f"#f{i}"] = name
+        if value is None:
+            removes.append(f"#f{i}")
+        else:
+            sets.append(f"#f{i} = :v{i}")
+            values[f":v{i}"] = value
+    expression = "SET " + ", ".join(sets)
+    if removes:
+        expression += " REMOVE " + ", ".join(removes)
+    try:
+        _table().update_item(
+            Key={"userId": user_id, "documentId": document_id},
+            UpdateExpression=expression,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+        return True
+    except Exception:
+        return False
+
+
+def get_documents(user_id: str, document_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Batch-resolve catalog items for one user's documents; missing ids are omitted."""
+    if not table_name() or not document_ids:
+        return {}
+    name = table_name()
+    out: Dict[str, Dict[str, Any]] = {}
+    unique = list(dict.fromkeys(str(d) for d in document_ids))
+    try:
+        for start in range(0, len(unique), _BATCH_GET_LIMIT):
+            request: Dict[str, Any] = {
+                name: {
+                    "Keys": [
+                        {"userId": user_id, "documentId": d}
+                        for d in unique[start : start + _BATCH_GET_LIMIT]
+                    ]
+                }
+            }
+            # BatchGetItem may return part of the batch under load; retry the remainder
+            for attempt in range(4):
+                resp = _resource().batch_get_item(RequestItems=request)
+                for item in (resp.get("Responses") or {}).get(name, []):
+                    out[str(item.get("documentId"))] = _plain(item)
+                request = resp.get("UnprocessedKeys") or {}
+                if not request:
+                    break
+                time.sleep(0.05 * (2**attempt))
+    except Exception:
+        pass
+    return out
+
+
+def list_documents(
+    user_id: str, limit: int = 50, next_token: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of a user's documents (Query on the partition key) plus the next-page token.
+
+    Like the lookups, fails soft: a query error (e.g. a missing table) is logged and listed
+    as no documents.
+    """
+    if not table_name():
+        return [], None
+    kwargs: Dict[str, Any] = {
+        "KeyConditionExpression": Key("userId").eq(user_id),
+        "Limit": max(1, min(int(limit), 200)),
+    }
+    if next_token:
+        try:
+            start_key = json.loads(base64.urlsafe_b64decode(next_token))
+        except Exception:
+            start_key = None
+        # A token only continues a listing of the same user's partition
+        if isinstance(start_key, dict) and start_key.get("userId") == user_id:
+            kwargs["ExclusiveStartKey"] = start_key
+    try:
+        resp = _table().query(**kwargs)
+    except (BotoCoreError, ClientError) as exc:
+        logger.warning("catalog query for %s failed: %s", user_id, exc)
+        return [], None
+    items = [_plain(i) for i in resp.get("Items") or []]
+    last = resp.get("LastEvaluatedKey")
+    token = (
+        base64.urlsafe_b64encode(json.dumps(last).encode("utf-8")).decode("ascii") if last else None
+    )
+    return items, token
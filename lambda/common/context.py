@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+# Packs retrieval hits into the evidence block of the answer prompt under a token budget.
+#
+# Hits from the same document and page (or sheet) are merged into spans: consecutive chunk
+# ids and overlapping text (the overlap left by chunking) are joined once. Spreadsheet row hits
+# sharing a sheet and column set become one compact table. Blocks are ranked by their best hit
+# score and added until the budget is spent; the block that crosses it is truncated. Every
+# block carries a numbered citation tag, e.g. "[2] report.pdf p.3".
+#
+# Tokens are estimated at ~4 characters each (no tokenizer in the Lambda bundle).
+
+_CHARS_PER_TOKEN = 4
+_MIN_OVERLAP = 24
+_MIN_TRUNCATED_TOKENS = 48
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def default_budget() -> int:
+    try:
+        return max(1, int(os.environ.get("CONTEXT_TOKEN_BUDGET") or 3000))
+    except ValueError:
+        return 3000
+
+
+def _join_overlapping(a: str, b: str) -> str:
+    """Append b to a, dropping the longest suffix of a that b starts with."""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    longest = min(len(a), len(b))
+    for size in range(longest, _MIN_OVERLAP - 1, -1):
+        if a.endswith(b[:size]):
+            return a + b[size:]
+    return a.rstrip() + " … " + b.lstrip()
+
+
+def _is_row_hit(meta: Dict[str, Any]) -> bool:
+    return isinstance(meta.get("row"), int) and isinstance(meta.get("columns"), dict)
+
+
+def _text_blocks(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    groups: Dict[Tuple[Any, Any, Any], List[Dict[str, Any]]] = {}
+    for hit in hits:
+        meta = hit.get("metadata") or {}
+        groups.setdefault((hit.get("documentId"), meta.get("page"), meta.get("sheet")), []).append(
+            hit
+        )
+    blocks: List[Dict[str, Any]] = []
+    for (doc_id, page, sheet), members in groups.items():
+        members.sort(key=lambda h: (h.get("chunkId") is None, h.get("chunkId") or 0))
+        spans: List[Dict[str, Any]] = []
+        for hit in members:
+            text = (hit.get("text") or "").strip()
+            if not text:
+                continue
+            last = spans[-1] if spans else None
+            chunk_id = hit.get("chunkId")
+            adjacent = (
+                last is not None
+                and isinstance(chunk_id, int)
+                and isinstance(last["lastChunkId"], int)
+                and chunk_id - last["lastChunkId"] <= 1
+            )
+            if last is not None and (adjacent or text in last["text"]):
+                last["text"] = _join_overlapping(last["text"], text)
+                last["score"] = max(last["score"], float(hit.get("score") or 0.0))
+                last["lastChunkId"] = chunk_id
+                continue
+            spans.append(
+                {
+                    "documentId": doc_id,
+                    "filename": hit.get("filename") or "",
+                    "page": page,
+                    "sheet": sheet,
+                    "text": text,
+                    "score": float(hit.get("score") or 0.0),
+                    "lastChunkId": chunk_id,
+                }
+            )
+        blocks.extend(spans)
+    return blocks
+
+
+def _row_blocks(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    groups: Dict[Tuple[Any, Any, Tuple[str, ...]], List[Dict[str, Any]]] = {}
+    for hit in hits:
+        meta = hit.get("metadata") or {}
+        columns = tuple(str(c) for c in meta["columns"])
+        groups.setdefault((hit.get("documentId"), meta.get("sheet"), columns), []).append(hit)
+    blocks: List[Dict[str, Any]] = []
+    for (doc_id, sheet, columns), members in groups.items():
+        by_row: Dict[int, Dict[str, Any]] = {}
+        for hit in members:
+            by_row.setdefault(hit["metadata"]["row"], hit)
+        rows = sorted(by_row.items())
+        # Columns that are empty in every selected row carry no evidence
+        keep = [
+            c
+            for c in columns
+            if any(str(h["metadata"]["columns"].get(c) or "").strip() for _, h in rows)
+        ]
+        lines = [" | ".join(["row"] + keep)]
+        for row, hit in rows:
+            cells = hit["metadata"]["columns"]
+            lines.append(" | ".join([str(row)] + [str(cells.get(c) or "").strip() for c in keep]))
+        blocks.append(
+            {
+                "documentId": doc_id,
+                "filename": members[0].get("filename") or "",
+                "sheet": sheet,
+                "rows": [row for row, _ in rows],
+                "text": "\n".join(lines),
+                "score": max(float(h.get("score") or 0.0) for h in members),
+            }
+        )
+    return blocks
+
+
+def _citation(block: Dict[str, Any]) -> str:
+    parts = [str(block.get("filename") or block.get("documentId") or "document")]
+    if block.get("page") is not None:
+        parts.append(f"p.{block['page']}")
+    if block.get("sheet"):
+        parts.append(f"sheet {block['sheet']}")
+    rows = block.get("rows") or []
+    if rows:
+        parts.append(f"rows {rows[0]}-{rows[-1]}" if len(rows) > 1 else f"row {rows[0]}")
+    return " ".join(parts)
+
+
+def _truncate(text: str, tokens: int, table: bool) -> str:
+    limit = tokens * _CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    if table:
+        # Keep the header and as many whole rows as fit
+        out: List[str] = []
+        used = 0
+        for line in text.split("\n"):
+            if used + len(line) + 1 > limit and out:
+                break
+            out.append(line)
+            used += len(line) + 1
+        return "\n".join(out)
+    cut = text[: max(0, limit - 1)]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > limit // 2 else cut).rstrip() + "…"
+
+
+def pack_context(
+    hits: List[Dict[str, Any]], token_budget: Optional[int] = None, first_tag: int = 1
+) -> Dict[str, Any]:
+    """Merge, rank and pack retrieval hits into a cited evidence block.
+
+    Returns {"text", "tokens", "blocks": [{documentId, citation, score, tokens, ...}],
+    "dropped"} where "dropped" counts blocks that did not fit the budget
+    (CONTEXT_TOKEN_BUDGET, default 3000). Citation tags are numbered from `first_tag`, so
+    blocks packed separately can share one numbering.
+    """
+    budget = token_budget if token_budget is not None else default_budget()
+    row_hits = [h for h in hits if _is_row_hit(h.get("metadata") or {})]
+    text_hits = [h for h in hits if not _is_row_hit(h.get("metadata") or {})]
+    blocks = _text_blocks(text_hits) + _row_blocks(row_hits)
+    blocks.sort(key=lambda b: b["score"], reverse=True)
+
+    packed: List[Dict[str, Any]] = []
+    parts: List[str] = []
+    used = 0
+    dropped = 0
+    for block in blocks:
+        tag = f"[{len(packed) + first_tag}] {_citation(block)}"
+        cost_tag = estimate_tokens(tag) + 1
+        remaining = budget - used - cost_tag
+        if remaining < min(_MIN_TRUNCATED_TOKENS, estimate_tokens(block["text"])):
+            dropped += 1
+            continue
+        text = _truncate(block["text"], remaining, table="rows" in block)
+        cost = cost_tag + estimate_tokens(text)
+        parts.append(f"{tag}\n{text}")
+        packed.append(
+            {
+                "documentId": block["documentId"],
+                "citation": tag,
+                "score": block["score"],
+                "tokens": cost,
+                "truncated": text != block["text"],
+            }
+        )
+        used += cost
+    return {"text": "\n\n".join(parts), "tokens": used, "blocks": packed, "dropped": dropped}
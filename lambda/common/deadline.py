@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple
+
+# Invocation deadline shared by the stages of a request.
+#
+# Built from the Lambda context's remaining time minus a reserve (AGENT_DEADLINE_RESERVE_SECONDS,
+# default 5) kept back for assembling and returning the result. Stages take a slice of what is
+# left (a fraction, capped in seconds) and pass the slice's epoch time to calls that accept a
+# deadline; work that cannot be interrupted runs through run_with_timeout so the caller can
+# move on with a degraded result instead of being killed with the invocation.
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+class Deadline:
+    def __init__(self, at: float):
+        self.at = at
+
+    @classmethod
+    def from_context(cls, context: Any, reserve_seconds: Optional[float] = None) -> "Deadline":
+        """Deadline for this invocation; without a Lambda context, AGENT_TIMEOUT_SECONDS (120)."""
+        if reserve_seconds is None:
+            reserve_seconds = _env_float("AGENT_DEADLINE_RESERVE_SECONDS", 5)
+        try:
+            remaining = float(context.get_remaining_time_in_millis()) / 1000.0
+        except Exception:
+            remaining = _env_float("AGENT_TIMEOUT_SECONDS", 120)
+        return cls(time.time() + max(0.0, remaining - reserve_seconds))
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.time())
+
+    def expired(self) -> bool:
+        return time.time() >= self.at
+
+    def slice(self, fraction: float, max_seconds: Optional[float] = None) -> "Deadline":
+        """Sub-deadline for one stage: `fraction` of the time left, at most `max_seconds`."""
+        budget = self.remaining() * max(0.0, min(1.0, fraction))
+        if max_seconds is not None:
+            budget = min(budget, max_seconds)
+        return Deadline(time.time() + budget)
+
+
+def run_with_timeout(
+    fn: Callable[[], Any], timeout: float, default: Any = None
+) -> Tuple[Any, bool]:
+    """Run `fn` on a daemon thread and wait at most `timeout` seconds.
+
+    Returns (result, completed). On timeout the thread is abandoned (it finishes or is frozen
+    with the container) and `default` is returned; exceptions from `fn` propagate.
+    """
+    box: dict = {}
+
+    def target() -> None:
+        try:
+            box["result"] = fn()
+        except BaseException as exc:  # re-raised in the caller's thread
+            box["error"] = exc
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(max(0.0, timeout))
+    if thread.is_alive():
+        return default, False
+    if "error" in box:
+        raise box["error"]
+    return box.get("result"), True
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import random
+import re
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# MinHash near-duplicate detection for chunks at index time. Candidate pairs come from LSH
+# banding over the signatures and are confirmed with exact shingle-set similarity, so the
+# sketch only decides which pairs to compare.
+_MERSENNE_61 = (1 << 61) - 1
+_NUM_PERM = 32
+_BANDS = 8
+_ROWS = _NUM_PERM // _BANDS
+_rng = random.Random(1729)
+_PERMS = [
+    (_rng.randrange(1, _MERSENNE_61), _rng.randrange(0, _MERSENNE_61)) for _ in range(_NUM_PERM)
+]
+_CITATION_FIELDS = ("page", "sheet", "row")
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def _shingles(tokens: List[str], k: int = 3) -> Set[int]:
+    if len(tokens) < k:
+        return {zlib.crc32(" ".join(tokens).encode("utf-8"))} if tokens else set()
+    return {
+        zlib.crc32(" ".join(tokens[i : i + k]).encode("utf-8")) for i in range(len(tokens) - k + 1)
+    }
+
+
+def _minhash(shingles: Set[int]) -> Tuple[int, ...]:
+    return tuple(min((a * x + b) % _MERSENNE_61 for x in shingles) for a, b in _PERMS)
+
+
+def _jaccard(a: Set[int], b: Set[int]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _join_overlap(prev: str, text: str, containment: float) -> Optional[str]:
+    # `prev` extended by the rest of `text`, when text opens with at least `containment` of
+    # its length repeated from the end of prev (the overlap a page split leaves); else None
+    need = max(1, int(len(text) * containment))
+    for k in range(min(len(prev), len(text)), need - 1, -1):
+        if prev.endswith(text[:k]):
+            return prev + text[k:]
+    return None
+
+
+def _section(meta: Dict[str, Any]) -> Tuple[Any, Any]:
+    return meta.get("page"), meta.get("sheet")
+
+
+def _citation(meta: Dict[str, Any]) -> Dict[str, Any]:
+    return {f: meta[f] for f in _CITATION_FIELDS if meta.get(f) is not None}
+
+
+def dedupe_chunks(
+    chunks: List[Dict[str, Any]], threshold: float = 0.9, containment: float = 0.9
+) -> Tuple[List[Dict[str, Any]], int]:
+    """Collapse exact and near-duplicate chunks into one canonical chunk each.
+
+    A free-text chunk whose first `containment` or more of its text repeats the end of the
+    previous chunk of the same page/sheet (the overlap left by splitting a long page) is
+    joined onto that chunk, so its unique tail stays indexed. Exact duplicates (identical
+    text up to whitespace) always collapse; spreadsheet rows only collapse when identical,
+    since a single differing cell, sign or decimal separator is significant. Free-text
+    chunks also collapse when their word 3-shingle Jaccard similarity is at least `threshold`.
+
+    The longest member of a group is kept (earliest on ties) and its metadata gains a
+    `citations` list with the page/sheet/row of every member. Returns (chunks, removed).
+    """
+    total = len(chunks)
+    # Join overlap tails first; only the previous split of the same page is checked, since a
+    # short boilerplate chunk repeats the end of many unrelated chunks
+    joined: List[Dict[str, Any]] = []
+    last_in_section: Dict[Tuple[Any, Any], int] = {}
+    for chunk in chunks:
+        meta = chunk.get("metadata") or {}
+        text = chunk.get("text") or ""
+        if meta.get("row") is None and text.strip():
+            section = _section(meta)
+            j = last_in_section.get(section)
+            if j is not None:
+                merged = _join_overlap(joined[j].get("text") or "", text, containment)
+                if merged is not None:
+                    joined[j] = {**joined[j], "text": merged}
+                    continue
+            last_in_section[section] = len(joined)
+        joined.append(chunk)
+    chunks = joined
+
+    n = len(chunks)
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i: int, j: int) -> None:
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    texts = [c.get("text") or "" for c in chunks]
+    metas = [c.get("metadata") or {} for c in chunks]
+    exact: Dict[str, int] = {}
+    shingles: Dict[int, Set[int]] = {}
+    for i, text in enumerate(texts):
+        tokens = _tokens(text)
+        key = " ".join(text.split())
+        if key in exact:
+            union(exact[key], i)
+            continue
+        exact[key] = i
+        if metas[i].get("row") is None and tokens:
+            shingles[i] = _shingles(tokens)
+
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+    for i, sh in shingles.items():
+        candidates: Set[int] = set()
+        sig = _minhash(sh)
+        for band in range(_BANDS):
+            members = buckets.setdefault((band, sig[band * _ROWS : (band + 1) * _ROWS]), [])
+            candidates.update(members)
+            members.append(i)
+        for j in candidates:
+            if find(i) != find(j) and _jaccard(sh, shingles[j]) >= threshold:
+                union(i, j)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    out: List[Dict[str, Any]] = []
+    for members in sorted(groups.values(), key=lambda m: m[0]):
+        keep = max(members, key=lambda i: (len(texts[i]), -i))
+        chunk = dict(chunks[keep])
+        if len(members) > 1:
+            citations: List[Dict[str, Any]] = []
+            for i in members:
+                cite = _citation(metas[i])
+                if cite and cite not in citations:
+                    citations.append(cite)
+            chunk["metadata"] = {**metas[keep], "citations": citations}
+        out.append(chunk)
+    return out, total - len(out)
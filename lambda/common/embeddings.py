@@ -1,10 +1,20 @@
 from __future__ import annotations
 
-from typing import List
+from abc import ABC, abstractmethod
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from typing import Any, Dict, List
+import hashlib
+import math
+import operator
 import os
 import json
-import boto3
-from botocore.config import Config
+import random
+import re
+
+from . import bedrock
 
 
 def _parse_titan_response(payload: bytes | str) -> list[list[float]]:
@@ -36,37 +46,142 @@ def _parse_titan_response(payload: bytes | str) -> list[list[float]]:
     return []
 
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
-    """Compute embeddings using Bedrock text-embeddings model (e.g., amazon.titan-embed-text-v2:0).
+class EmbeddingBackend(ABC):
+    """Interface for text-embedding providers.
 
-    Returns one vector per input text. Falls back to small zero vectors if unavailable.
+    `describe()` is stored with every index so queries are embedded by the same backend
+    (and dimension) that produced the document vectors.
     """
-    model_id = os.environ.get("BEDROCK_EMBEDDINGS_MODEL_ID")
-    if not model_id:
-        return [[0.0] * 8 for _ in texts]
 
-    brt = boto3.client("bedrock-runtime", config=Config(retries={"max_attempts": 3}))
-    vectors: List[List[float]] = []
-    for text in texts:
+    name = "base"
+
+    def __init__(self, dimension: int | None = None, model_id: str | None = None):
+        self.dimension = dimension
+        self.model_id = model_id
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """One vector per text, in order."""
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "model": self.model_id, "dim": self.dimension}
+
+
+class BedrockEmbeddingBackend(EmbeddingBackend):
+    """Bedrock text-embeddings model (e.g., amazon.titan-embed-text-v2:0), one call per text.
+
+    Texts are embedded concurrently, up to BEDROCK_EMBED_MAX_CONCURRENCY (default 8) at a
+    time; the gateway's embedding limits pace the calls.
+    """
+
+    name = "bedrock"
+
+    def __init__(self, model_id: str):
+        super().__init__(dimension=None, model_id=model_id)
+
+    def _embed_one(self, text: str) -> List[float] | None:
         body = json.dumps({"inputText": text}).encode("utf-8")
-        vec: List[float] | None = None
         try:
-            resp = brt.invoke_model(
-                modelId=model_id,
-                body=body,
-                accept="application/json",
-                contentType="application/json",
-            )
+            resp = bedrock.invoke_model(self.model_id, body, kind="embedding")
             stream = resp.get("body")
             payload = stream.read() if hasattr(stream, "read") else stream
             parsed = _parse_titan_response(payload)
-            if parsed and isinstance(parsed, list) and parsed[0]:
-                vec = parsed[0]
         except Exception:
-            vec = None
-        vectors.append(vec if vec else [0.0] * 8)
+            return None
+        return parsed[0] if parsed and isinstance(parsed, list) and parsed[0] else None
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        workers = min(len(texts), int(os.environ.get("BEDROCK_EMBED_MAX_CONCURRENCY") or 8))
+        if workers <= 1:
+            vectors = [self._embed_one(text) for text in texts]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                vectors = list(pool.map(self._embed_one, texts))
+        # Failed items become zero vectors of the batch's dimensionality (at least 8)
+        dim = max((len(v) for v in vectors if v), default=self.dimension or 8)
+        return [v if v else [0.0] * dim for v in vectors]
+
+
+class LocalHashingEmbeddingBackend(EmbeddingBackend):
+    """Offline CPU embedder: feature hashing followed by a fixed random projection.
+
+    Each feature (lowercased word, plus character 4-grams of longer words at a lower weight)
+    is hashed to a 64-bit id that seeds a fixed ±1 projection row; the embedding is the
+    sublinear-tf-weighted sum of the rows, L2-normalized. Rows are memoized and summed with
+    element-wise map() so a short query embeds in well under a millisecond. Deterministic
+    across processes and needs no network or model files.
+    """
+
+    name = "local"
+
+    def __init__(self, dimension: int = 256):
+        super().__init__(dimension=max(8, int(dimension)), model_id="hashing-v1")
+
+    @staticmethod
+    def _features(text: str) -> Dict[str, float]:
+        counts: Dict[str, int] = {}
+        for word in re.findall(r"\w+", (text or "").lower()):
+            counts[word] = counts.get(word, 0) + 1
+            if len(word) > 5:
+                padded = f"#{word}#"
+                for i in range(len(padded) - 3):
+                    gram = "~" + padded[i : i + 4]
+                    counts[gram] = counts.get(gram, 0) + 1
+        return {
+            f: (1.0 + math.log(c)) * (0.25 if f.startswith("~") else 1.0) for f, c in counts.items()
+        }
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        dim = int(self.dimension or 256)
+        out: List[List[float]] = []
+        for text in texts:
+            acc = [0.0] * dim
+            for feature, weight in self._features(text).items():
+                row = _projection_row(feature, dim)
+                if weight != 1.0:
+                    row = map(operator.mul, row, repeat(weight, dim))
+                acc = list(map(operator.add, acc, row))
+            norm = math.sqrt(sum(map(operator.mul, acc, acc)))
+            out.append([x / norm for x in acc] if norm else acc)
+        return out
+
+
+@lru_cache(maxsize=65536)
+def _projection_row(feature: str, dim: int) -> array:
+    seed = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+    bits = random.Random(seed).getrandbits(dim)
+    return array("f", [1.0 if (bits >> i) & 1 else -1.0 for i in range(dim)])
+
 
-    # Ensure 1:1 and at least some dimensionality
-    if not vectors:
-        return [[0.0] * 8 for _ in texts]
-    return vectors
+@lru_cache(maxsize=8)
+def _backend(name: str, model_id: str | None, dimension: int | None) -> EmbeddingBackend:
+    if name == "bedrock" and model_id:
+        return BedrockEmbeddingBackend(model_id)
+    return LocalHashingEmbeddingBackend(dimension or 256)
+
+
+def get_backend(descriptor: Dict[str, Any] | None = None) -> EmbeddingBackend:
+    """Resolve an embedding backend.
+
+    With a descriptor (as stored in an index header) the matching backend is returned.
+    Otherwise EMBEDDINGS_BACKEND selects "bedrock" or "local"; when unset, Bedrock is used if
+    BEDROCK_EMBEDDINGS_MODEL_ID is configured and the local embedder otherwise.
+    EMBEDDINGS_LOCAL_DIM sets the local embedder's dimension (default 256).
+    """
+    model_id = os.environ.get("BEDROCK_EMBEDDINGS_MODEL_ID")
+    if descriptor and descriptor.get("backend"):
+        name = str(descriptor["backend"])
+        if name == "bedrock":
+            return _backend("bedrock", descriptor.get("model") or model_id, None)
+        return _backend("local", None, int(descriptor.get("dim") or 256))
+    name = (os.environ.get("EMBEDDINGS_BACKEND") or ("bedrock" if model_id else "local")).lower()
+    if name == "bedrock" and model_id:
+        return _backend("bedrock", model_id, None)
+    return _backend("local", None, int(os.environ.get("EMBEDDINGS_LOCAL_DIM") or 256))
+
+
+def embed_texts(texts: List[str], backend: EmbeddingBackend | None = None) -> List[List[float]]:
+    """Compute one embedding per input text with the given (or configured) backend."""
+    if not texts:
+        return []
+    return (backend or get_backend()).embed(texts)
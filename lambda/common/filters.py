@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import re
+
+# Metadata fields that get a posting list (metadata value -> chunk ids) per document
+POSTING_FIELDS = ("page", "sheet", "row", "docType")
+
+_RANGE_FIELDS = {"pages": "page", "rows": "row"}
+_VALUE_FIELDS = {"sheets": "sheet", "docTypes": "docType"}
+
+_SHEET_STOPWORDS = {
+    "a",
+    "an",
+    "and",
+    "are",
+    "contains",
+    "for",
+    "has",
+    "have",
+    "is",
+    "of",
+    "that",
+    "the",
+    "to",
+    "which",
+    "with",
+}
+
+
+def _metadata_values(metadata: Dict[str, Any]) -> Iterable[Tuple[str, Any]]:
+    for field in POSTING_FIELDS:
+        val = metadata.get(field)
+        if val is not None and val != "":
+            yield field, val
+    # Collapsed duplicates keep their own page/sheet/row citations
+    for cite in metadata.get("citations") or []:
+        if not isinstance(cite, dict):
+            continue
+        for field in ("page", "sheet", "row"):
+            val = cite.get(field)
+            if val is not None and val != "":
+                yield field, val
+
+
+def build_postings(chunks: List[Dict[str, Any]]) -> Dict[str, Dict[str, List[int]]]:
+    """Build per-document posting lists mapping metadata values to chunk ids.
+
+    Chunk ids are positions in the given list (the line index in the embeddings JSONL).
+    Keys are stringified so the structure round-trips through JSON unchanged.
+    """
+    postings: Dict[str, Dict[str, List[int]]] = {field: {} for field in POSTING_FIELDS}
+    for chunk_id, chunk in enumerate(chunks):
+        meta = chunk.get("metadata") or {}
+        for field, val in _metadata_values(meta):
+            ids = postings[field].setdefault(str(val), [])
+            if not ids or ids[-1] != chunk_id:
+                ids.append(chunk_id)
+    return {field: values for field, values in postings.items() if values}
+
+
+def _parse_ranges(values: Any) -> List[Tuple[int, int]]:
+    """Accept 3, "3", "2-4", (2, 4) or a list of any of those; [2, 4] means pages 2 and 4."""
+    if values is None:
+        return []
+    if isinstance(values, (int, str, tuple)):
+        values = [values]
+    ranges: List[Tuple[int, int]] = []
+    for v in values:
+        try:
+            if isinstance(v, (list, tuple)) and len(v) == 2:
+                lo, hi = int(v[0]), int(v[1])
+            elif isinstance(v, str) and re.fullmatch(r"\s*\d+\s*[-–]\s*\d+\s*", v):
+                lo_s, hi_s = re.split(r"[-–]", v)
+                lo, hi = int(lo_s), int(hi_s)
+            else:
+                lo = hi = int(v)
+        except (TypeError, ValueError):
+            continue
+        ranges.append((min(lo, hi), max(lo, hi)))
+    return ranges
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Normalize a user/API filter dict into {pages, rows: [(lo, hi)], sheets, docTypes: [str]}.
+
+    Accepts singular or plural keys (page/pages, sheet/sheets, row/rows, docType/docTypes).
+    Empty criteria are dropped so an empty result means "no filtering".
+    """
+    if not isinstance(filters, dict):
+        return {}
+    out: Dict[str, Any] = {}
+    for plural, field in _RANGE_FIELDS.items():
+        ranges = _parse_ranges(filters.get(plural, filters.get(field)))
+        if ranges:
+            out[plural] = ranges
+    for plural, field in _VALUE_FIELDS.items():
+        raw = filters.get(plural, filters.get(field))
+        if raw is None:
+            continue
+        if isinstance(raw, str):
+            raw = [raw]
+        vals = [str(v).strip() for v in raw if str(v).strip()]
+        if vals:
+            out[plural] = vals
+    return out
+
+
+def filters_from_prompt(prompt: str) -> Dict[str, Any]:
+    """Extract page/row/sheet scoping from free text, e.g. "page 3", "pages 2-4", "rows 5 to 9",
+    'sheet "Q1 Sales"'. Returns a normalized filter dict (possibly empty).
+    """
+    text = prompt or ""
+    raw: Dict[str, List[Any]] = {"pages": [], "rows": [], "sheets": []}
+    range_re = r"(\d+)(?:\s*(?:-|–|to|through)\s*(\d+))?"
+    for plural, words in (("pages", r"pages?|pp?\."), ("rows", r"rows?")):
+        for m in re.finditer(rf"\b(?:{words})\s*{range_re}\b", text, re.IGNORECASE):
+            lo = int(m.group(1))
+            hi = int(m.group(2)) if m.group(2) else lo
+            raw[plural].append((lo, hi))
+    for m in re.finditer(
+        r"\b(?:sheet|tab)\s+(?:named\s+|called\s+)?"
+        r"(?:\"([^\"]+)\"|'([^']+)'|([A-Za-z0-9_][\w\-]*))",
+        text,
+        re.IGNORECASE,
+    ):
+        name = m.group(1) or m.group(2) or m.group(3) or ""
+        if m.group(3) and name.lower() in _SHEET_STOPWORDS:
+            continue
+        raw["sheets"].append(name)
+    return normalize_filters({k: v for k, v in raw.items() if v})
+
+
+def _in_ranges(value: str, ranges: List[Tuple[int, int]]) -> bool:
+    try:
+        n = int(value)
+    except (TypeError, ValueError):
+        return False
+    return any(lo <= n <= hi for lo, hi in ranges)
+
+
+def select_chunk_ids(
+    postings: Dict[str, Dict[str, List[int]]], filters: Dict[str, Any]
+) -> Optional[Set[int]]:
+    """Evaluate normalized filters against posting lists.
+
+    Criteria are ORed within a field and ANDed across fields. Returns None when there is
+    nothing to filter on (every chunk is eligible), otherwise the set of eligible chunk ids.
+    """
+    if not filters:
+        return None
+    selected: Optional[Set[int]] = None
+    for plural, field in {**_RANGE_FIELDS, **_VALUE_FIELDS}.items():
+        crit = filters.get(plural)
+        if not crit:
+            continue
+        plist = postings.get(field) or {}
+        ids: Set[int] = set()
+        if plural in _RANGE_FIELDS:
+            for value, chunk_ids in plist.items():
+                if _in_ranges(value, crit):
+                    ids.update(chunk_ids)
+        else:
+            wanted = {c.casefold() for c in crit}
+            for value, chunk_ids in plist.items():
+                if value.casefold() in wanted:
+                    ids.update(chunk_ids)
+        selected = ids if selected is None else selected & ids
+    return selected
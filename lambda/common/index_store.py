@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from .cache import get_cache
+from .filters import build_postings
+from . import quantization
+
+# Per-document index layout in the reports bucket:
+#   embeddings/<userId>/<documentId>.jsonl       one chunk record per line (text, metadata)
+#   embeddings/<userId>/<documentId>.index.json  small header: counts, title/filename, posting
+#                                                lists and binary (sign-bit) vector codes
+#   embeddings/<userId>/<documentId>.f32         full-precision float32 vectors, row = chunk id
+#   embeddings/<userId>/<documentId>.q8          int8 vector codes, row = chunk id
+#   embeddings/<userId>/<documentId>.summary.json  document and page/sheet centroid vectors used
+#                                                  to prune documents before loading their chunks
+# Version 1 indexes kept the float vectors inline as "embedding" in each JSONL record.
+#
+# Indexes built since per-document manifests were introduced live under a write-once version
+# prefix instead (embeddings/<userId>/<documentId>/<version>/{chunks.jsonl, index.json,
+# vectors.f32, vectors.q8, summary.json}); the manifest's "index.version" selects the live
+# one. Every loader takes that version and falls back to the unversioned keys without it.
+# Versioned artifacts never change, so their decoded form is kept in the shared "index"
+# artifact cache; callers must treat loaded headers/records as read-only.
+INDEX_FORMAT_VERSION = 2
+
+
+def _key(user_id: str, document_id: str, version: Optional[str], legacy: str, name: str) -> str:
+    if version:
+        return f"embeddings/{user_id}/{document_id}/{version}/{name}"
+    return f"embeddings/{user_id}/{document_id}{legacy}"
+
+
+def records_key(user_id: str, document_id: str, version: Optional[str] = None) -> str:
+    return _key(user_id, document_id, version, ".jsonl", "chunks.jsonl")
+
+
+def header_key(user_id: str, document_id: str, version: Optional[str] = None) -> str:
+    return _key(user_id, document_id, version, ".index.json", "index.json")
+
+
+def vectors_key(user_id: str, document_id: str, version: Optional[str] = None) -> str:
+    return _key(user_id, document_id, version, ".f32", "vectors.f32")
+
+
+def int8_key(user_id: str, document_id: str, version: Optional[str] = None) -> str:
+    return _key(user_id, document_id, version, ".q8", "vectors.q8")
+
+
+def summary_key(user_id: str, document_id: str, version: Optional[str] = None) -> str:
+    return _key(user_id, document_id, version, ".summary.json", "summary.json")
+
+
+ARTIFACT_KEYS = (records_key, header_key, vectors_key, int8_key, summary_key)
+
+
+def _normalized(vec: Sequence[float], dim: int) -> List[float]:
+    vals = [float(x) for x in vec[:dim]] + [0.0] * max(0, dim - len(vec))
+    norm = sum(x * x for x in vals) ** 0.5
+    return [x / norm for x in vals] if norm else vals
+
+
+def _centroid(unit_vectors: List[List[float]], dim: int) -> str:
+    """Mean of the unit vectors, stored as base64 int8 codes (only its direction matters)."""
+    sums = [0.0] * dim
+    for vec in unit_vectors:
+        sums = [a + b for a, b in zip(sums, vec)]
+    codes, _scale = quantization.quantize_int8(sums)
+    return quantization.encode_b64(codes)
+
+
+def decode_centroid(payload: Any) -> List[float]:
+    if isinstance(payload, list):
+        return [float(x) for x in payload]
+    try:
+        return quantization.decode_int8_b64(payload or "")
+    except Exception:
+        return []
+
+
+def build_summary(
+    document_id: str,
+    vectors: List[Sequence[float]],
+    postings: Dict[str, Dict[str, List[int]]],
+) -> Dict[str, Any]:
+    """Centroids of unit-normalized chunk vectors for the whole document and for each
+    page/sheet section, with the chunk ids each section covers. Centroids are int8-coded so
+    the summary stays small enough to fetch for every selected document."""
+    dim = quantization.common_dim(vectors)
+    units = [_normalized(v, dim) for v in vectors]
+    sections: List[Dict[str, Any]] = []
+    for field in ("page", "sheet"):
+        for value, ids in (postings.get(field) or {}).items():
+            members = [units[i] for i in ids if i < len(units)]
+            if members:
+                sections.append(
+                    {
+                        "field": field,
+                        "value": value,
+                        "chunkIds": ids,
+                        "centroid": _centroid(members, dim),
+                    }
+                )
+    return {
+        "documentId": document_id,
+        "dim": dim,
+        "count": len(vectors),
+        "centroid": _centroid(units, dim),
+        "sections": sections,
+    }
+
+
+def build_header(
+    document_id: str,
+    chunks: List[Dict[str, Any]],
+    filename: Optional[str] = None,
+    title: Optional[str] = None,
+    doc_type: Optional[str] = None,
+    embedding: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    return {
+        "version": INDEX_FORMAT_VERSION,
+        "documentId": document_id,
+        "filename": filename,
+        "title": title,
+        "docType": doc_type,
+        "count": len(chunks),
+        "postings": build_postings(chunks),
+        # Backend/model/dimension that produced the vectors; queries must use the same one
+        "embedding": embedding,
+    }
+
+
+def write_index(
+    s3: Any,
+    bucket: str,
+    user_id: str,
+    document_id: str,
+    records: List[Dict[str, Any]],
+    vectors: List[Sequence[float]],
+    header: Dict[str, Any],
+    version: Optional[str] = None,
+) -> Dict[str, int]:
+    """Write records, vector sidecars and header (last, so readers never see a header that
+    points at missing vectors). With a version the artifacts go to a fresh prefix that only
+    becomes visible once the manifest points at it. Returns the byte size of each artifact."""
+    dim = quantization.common_dim(vectors)
+    f32 = quantization.pack_float32(vectors, dim)
+    q8, _scales = quantization.pack_int8(vectors, dim)
+    header = dict(header)
+    header["vectors"] = {
+        "dim": dim,
+        "count": len(vectors),
+        "binary": quantization.encode_b64(quantization.pack_binary(vectors, dim)),
+    }
+    body = "\n".join(json.dumps(rec) for rec in records).encode("utf-8")
+    header_body = json.dumps(header).encode("utf-8")
+    summary = build_summary(document_id, vectors, header.get("postings") or {})
+    summary["embedding"] = header.get("embedding")
+    summary_body = json.dumps(summary).encode("utf-8")
+    puts = [
+        (records_key(user_id, document_id, version), body, "application/json"),
+        (vectors_key(user_id, document_id, version), f32, "application/octet-stream"),
+        (int8_key(user_id, document_id, version), q8, "application/octet-stream"),
+        (summary_key(user_id, document_id, version), summary_body, "application/json"),
+        (header_key(user_id, document_id, version), header_body, "application/json"),
+    ]
+    for key, data, content_type in puts:
+        s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType=content_type)
+    return {
+        "records": len(body),
+        "float32": len(f32),
+        "int8": len(q8),
+        "binary": (dim + 7) // 8 * len(vectors),
+        "summary": len(summary_body),
+        "header": len(header_body),
+    }
+
+
+def _load(
+    s3: Any, bucket: str, key: str, version: Optional[str], decode: Callable[[bytes], Any]
+) -> Any:
+    """GET and decode one artifact; versioned (immutable) artifacts go through the cache."""
+    cache = get_cache("index", memory_mb=64, disk_mb=192) if version else None
+    cache_key = f"{bucket}/{key}"
+    if cache is not None:
+        hit = cache.get(cache_key)
+        if hit is not None:
+            return hit
+    try:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        value = decode(body)
+    except Exception:
+        return None
+    if cache is not None and value is not None:
+        cache.put(cache_key, value, size=len(body))
+    return value
+
+
+def _json_dict(body: bytes) -> Optional[Dict[str, Any]]:
+    data = json.loads(body.decode("utf-8"))
+    return data if isinstance(data, dict) else None
+
+
+def _jsonl_records(body: bytes) -> List[Dict[str, Any]]:
+    records: List[Dict[str, Any]] = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line.decode("utf-8"))
+        except Exception:
+            # Keep ids aligned with the header's posting lists
+            rec = {}
+        records.append(rec if isinstance(rec, dict) else {})
+    return records
+
+
+def load_header(
+    s3: Any, bucket: str, user_id: str, document_id: str, version: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    return _load(s3, bucket, header_key(user_id, document_id, version), version, _json_dict)
+
+
+def load_summary(
+    s3: Any, bucket: str, user_id: str, document_id: str, version: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    return _load(s3, bucket, summary_key(user_id, document_id, version), version, _json_dict)
+
+
+def load_records(
+    s3: Any, bucket: str, user_id: str, document_id: str, version: Optional[str] = None
+) -> Optional[List[Dict[str, Any]]]:
+    """Return chunk records in chunk-id order, or None when the document has no index."""
+    return _load(s3, bucket, records_key(user_id, document_id, version), version, _jsonl_records)
+
+
+def load_int8_codes(
+    s3: Any, bucket: str, user_id: str, document_id: str, dim: int, version: Optional[str] = None
+) -> Optional[quantization.Int8Codes]:
+    return _load(
+        s3,
+        bucket,
+        int8_key(user_id, document_id, version),
+        version,
+        lambda body: quantization.Int8Codes(body, dim),
+    )
+
+
+def load_vector_rows(
+    s3: Any,
+    bucket: str,
+    user_id: str,
+    document_id: str,
+    dim: int,
+    ids: Iterable[int],
+    version: Optional[str] = None,
+) -> Dict[int, List[float]]:
+    """Fetch full-precision vectors for the given chunk ids with one ranged GET spanning them."""
+    wanted = sorted(set(ids))
+    if not wanted or dim <= 0:
+        return {}
+    row_bytes = dim * 4
+    lo, hi = wanted[0], wanted[-1]
+    try:
+        obj = s3.get_object(
+            Bucket=bucket,
+            Key=vectors_key(user_id, document_id, version),
+            Range=f"bytes={lo * row_bytes}-{(hi + 1) * row_bytes - 1}",
+        )
+        rows = quantization.unpack_float32(obj["Body"].read(), dim)
+    except Exception:
+        return {}
+    return {i: rows[i - lo] for i in wanted if i - lo < len(rows)}
+
+
+def delete_index(s3: Any, bucket: str, user_id: str, document_id: str, version: str) -> None:
+    """Remove a superseded index version (best effort)."""
+    for key_fn in ARTIFACT_KEYS:
+        try:
+            s3.delete_object(Bucket=bucket, Key=key_fn(user_id, document_id, version))
+        except Exception:
+            pass
@@ -3,40 +3,46 @@ import json
 from typing import Dict, Any, Optional
 import urllib.request
 import urllib.error
-import base64
 import time
 import uuid
-import boto3
+
+from .aws import get_secret_string
 
 LLAMAPARSE_API_KEY_ENV = "LLAMAPARSE_API_KEY"
 LLAMAPARSE_SECRET_ID_ENV = "LLAMAPARSE_SECRET_ID"
 # Base URL of Llama Cloud Parsing API. Defaults to official endpoint.
 LLAMAPARSE_BASE_URL_ENV = "LLAMAPARSE_BASE_URL"  # e.g., https://api.cloud.llamaindex.ai/api/v1
 
-_secrets_client = boto3.client("secretsmanager")
+
+class _DeadlineExceeded(TimeoutError):
+    """The caller's deadline passed before the parse job finished.
+
+    `job_id` names the unfinished job; LlamaParse keeps running it, so a later call can pass
+    it back to parse_pdf_bytes and wait for the same job instead of starting over.
+    """
+
+    def __init__(self, message: str, job_id: Optional[str] = None):
+        super().__init__(message)
+        self.job_id = job_id
 
 
 def _get_llamaparse_api_key() -> Optional[str]:
-    # Priority: explicit env key, then Secrets Manager by ID
+    # Priority: explicit env key, then Secrets Manager by ID (memoized with a TTL)
     key = os.getenv(LLAMAPARSE_API_KEY_ENV)
     if key:
         return key
     secret_id = os.getenv(LLAMAPARSE_SECRET_ID_ENV)
     if not secret_id:
         return None
+    sec = get_secret_string(secret_id)
+    if not sec:
+        return None
+    # Allow both raw key or JSON {"api_key": "..."}
     try:
-        resp = _secrets_client.get_secret_value(SecretId=secret_id)
-        sec = resp.get("SecretString") or base64.b64decode(resp.get("SecretBinary") or b"").decode(
-            "utf-8"
-        )
-        # Allow both raw key or JSON {"api_key": "..."}
-        try:
-            data = json.loads(sec)
-            return data.get("api_key") or data.get("LLAMAPARSE_API_KEY") or sec
-        except Exception:
-            return sec
+        data = json.loads(sec)
+        return data.get("api_key") or data.get("LLAMAPARSE_API_KEY") or sec
     except Exception:
-        return None
+        return sec
 
 
 def _multipart_form(
@@ -84,13 +90,23 @@ def _normalize_result(
     return {"text": text, "pages": pages, "tables": tables, "metadata": metadata}
 
 
-def parse_pdf_bytes(pdf_bytes: bytes, filename: str = "document.pdf") -> Dict[str, Any]:
+def parse_pdf_bytes(
+    pdf_bytes: bytes,
+    filename: str = "document.pdf",
+    deadline: Optional[float] = None,
+    job_id: Optional[str] = None,
+) -> Dict[str, Any]:
     """Implements Llama Cloud job-based Parsing API flow:
     1) POST multipart to /parsing/upload -> returns job id
     2) Poll /parsing/job/<id> until SUCCESS
     3) GET /parsing/job/<id>/result/json and /result/text, then normalize
 
-    If API key is missing or any step fails, returns a stub result.
+    If API key is missing or any step fails, returns a stub result (metadata "stub" set) that
+    callers must not store as the document's parse. When the caller's `deadline` (epoch
+    seconds) passes while polling, raises TimeoutError instead so that an unfinished parse is
+    never mistaken for a result; its `job_id` attribute names the job.
+    Passing that `job_id` back resumes polling the job (a new one is uploaded if LlamaParse
+    no longer knows it).
     """
     api_key = _get_llamaparse_api_key()
     base_url = os.getenv(LLAMAPARSE_BASE_URL_ENV, "https://api.cloud.llamaindex.ai/api/v1").rstrip(
@@ -101,11 +117,10 @@ def parse_pdf_bytes(pdf_bytes: bytes, filename: str = "document.pdf") -> Dict[st
             "text": f"Parsed content for {filename} (stub)",
             "pages": [{"pageNumber": 1, "text": "Example page text (stub)"}],
             "tables": [],
-            "metadata": {"title": filename},
+            "metadata": {"title": filename, "stub": True},
         }
 
-    try:
-        # Step 1: upload
+    def upload() -> str:
         upload_url = f"{base_url}/parsing/upload"
         body, content_type = _multipart_form(pdf_bytes, filename, content_type="application/pdf")
         headers = {
@@ -119,9 +134,16 @@ def parse_pdf_bytes(pdf_bytes: bytes, filename: str = "document.pdf") -> Dict[st
         if status // 100 != 2:
             raise RuntimeError(f"Upload failed: HTTP {status}")
         upload_resp = json.loads(data)
-        job_id = upload_resp.get("id") or upload_resp.get("job_id")
-        if not job_id:
+        new_job_id = upload_resp.get("id") or upload_resp.get("job_id")
+        if not new_job_id:
             raise RuntimeError("Upload response missing job id")
+        return new_job_id
+
+    try:
+        # Step 1: upload, unless resuming a job an earlier call started
+        resumed = bool(job_id)
+        if not job_id:
+            job_id = upload()
 
         # Step 2: poll status
         status_url = f"{base_url}/parsing/job/{job_id}"
@@ -137,6 +159,12 @@ def parse_pdf_bytes(pdf_bytes: bytes, filename: str = "document.pdf") -> Dict[st
                 timeout=30,
             )
             if st_code // 100 != 2:
+                if resumed:
+                    # The earlier job expired or is unknown; start a new one
+                    resumed = False
+                    job_id = upload()
+                    status_url = f"{base_url}/parsing/job/{job_id}"
+                    continue
                 raise RuntimeError(f"Status check failed: HTTP {st_code}")
             st_json = json.loads(st_data)
             st = (st_json.get("status") or "").upper()
@@ -146,6 +174,10 @@ def parse_pdf_bytes(pdf_bytes: bytes, filename: str = "document.pdf") -> Dict[st
                 raise RuntimeError(f"Parsing job failed: {st_json}")
             if time.time() - start_time > 180:
                 raise TimeoutError("Timeout waiting for LlamaParse job to complete")
+            if deadline is not None and time.time() + 2.0 > deadline:
+                raise _DeadlineExceeded(
+                    "Caller deadline reached while waiting for LlamaParse", job_id
+                )
             time.sleep(2.0)
 
         # Step 3: fetch results (json + optional text)
@@ -179,19 +211,24 @@ def parse_pdf_bytes(pdf_bytes: bytes, filename: str = "document.pdf") -> Dict[st
 
         return _normalize_result(rj_json if isinstance(rj_json, dict) else {}, text_value, filename)
 
+    except _DeadlineExceeded:
+        raise
     except Exception:
         # Fallback stub on any failure
         return {
             "text": f"Parsed content for {filename} (stub)",
             "pages": [{"pageNumber": 1, "text": "Example page text (stub)"}],
             "tables": [],
-            "metadata": {"title": filename},
+            "metadata": {"title": filename, "stub": True},
         }
 
 
-def parse_xlsx_bytes(xlsx_bytes: bytes, filename: str = "document.xlsx") -> Dict[str, Any]:
+def parse_xlsx_bytes(
+    xlsx_bytes: bytes, filename: str = "document.xlsx", deadline: Optional[float] = None
+) -> Dict[str, Any]:
     """Parse XLSX via Llama Cloud Parsing API, mirroring the PDF flow.
-    Returns normalized structure with text/pages/tables/metadata.
+    Returns normalized structure with text/pages/tables/metadata. Raises TimeoutError when
+    `deadline` passes while polling, like parse_pdf_bytes.
     """
     api_key = _get_llamaparse_api_key()
     base_url = os.getenv(LLAMAPARSE_BASE_URL_ENV, "https://api.cloud.llamaindex.ai/api/v1").rstrip(
@@ -202,7 +239,7 @@ def parse_xlsx_bytes(xlsx_bytes: bytes, filename: str = "document.xlsx") -> Dict
             "text": f"Parsed content for {filename} (stub)",
             "pages": [],
             "tables": [],
-            "metadata": {"title": filename},
+            "metadata": {"title": filename, "stub": True},
         }
 
     try:
@@ -251,6 +288,10 @@ def parse_xlsx_bytes(xlsx_bytes: bytes, filename: str = "document.xlsx") -> Dict
                 raise RuntimeError(f"Parsing job failed: {st_json}")
             if time.time() - start_time > 180:
                 raise TimeoutError("Timeout waiting for LlamaParse job to complete")
+            if deadline is not None and time.time() + 2.0 > deadline:
+                raise _DeadlineExceeded(
+                    "Caller deadline reached while waiting for LlamaParse", job_id
+                )
             time.sleep(2.0)
 
         # Fetch generic JSON result (some deployments expose raw_xlsx endpoints as well)
@@ -285,10 +326,12 @@ def parse_xlsx_bytes(xlsx_bytes: bytes, filename: str = "document.xlsx") -> Dict
 
         return _normalize_result(rj_json if isinstance(rj_json, dict) else {}, text_value, filename)
 
+    except _DeadlineExceeded:
+        raise
     except Exception:
         return {
             "text": f"Parsed content for {filename} (stub)",
             "pages": [],
             "tables": [],
-            "metadata": {"title": filename},
+            "metadata": {"title": filename, "stub": True},
         }
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError, ParamValidationError
+
+# Per-document artifact manifest: s3://<reports>/manifests/<userId>/<documentId>.json
+#
+# {
+#   "documentId": ..., "userId": ...,
+#   "source": {"key", "etag", "size", "filename"},
+#   "parsed": {"key", "sourceEtag", "status", "updatedAt"},
+#   "index":  {"version", "sourceEtag", "status", "chunks", "filename", "title", "updatedAt"},
+#   "build":  {"version", "sourceEtag", "status": "BUILDING" | "FAILED", "error", "startedAt"},
+#   "parseJob": {"jobId", "sourceEtag", "startedAt"},  LlamaParse job still running for "parsed"
+#   "updatedAt": ...
+# }
+#
+# Parsed JSON and index artifacts are written once under keys that include the source ETag /
+# index version, and the manifest is written last. A single PUT of the manifest is the
+# atomic swap: readers follow "index.version" and never see a half-written index.
+#
+# Several writers update it (index_etl, bedrock_agent and the parse_pdf tool), so each update
+# is a read-modify-write made conditional on the ETag it read (If-None-Match: * when there was
+# no manifest yet) and retried from a fresh read when another writer got there first.
+
+_WRITE_ATTEMPTS = 6
+_CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+
+READY = "READY"
+BUILDING = "BUILDING"
+FAILED = "FAILED"
+
+
+def manifest_key(user_id: str, document_id: str) -> str:
+    return f"manifests/{user_id}/{document_id}.json"
+
+
+def parsed_key(user_id: str, document_id: str, source_etag: str) -> str:
+    return f"parsed/{user_id}/{document_id}/{source_etag or 'unknown'}.json"
+
+
+def legacy_parsed_key(user_id: str, document_id: str) -> str:
+    return f"parsed/{user_id}/{document_id}.json"
+
+
+def new_index_version(source_etag: Optional[str]) -> str:
+    return f"v{int(time.time() * 1000)}-{(source_etag or 'noetag')[:8]}"
+
+
+def now_iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def _read(s3: Any, bucket: str, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    # (manifest, ETag); (None, None) when there is no manifest
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None, None
+        raise
+    try:
+        data = json.loads(obj["Body"].read().decode("utf-8"))
+    except ValueError:
+        data = None
+    return (data if isinstance(data, dict) else None), obj.get("ETag")
+
+
+def load_manifest(s3: Any, bucket: str, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+    if not bucket:
+        return None
+    try:
+        return _read(s3, bucket, manifest_key(user_id, document_id))[0]
+    except Exception:
+        return None
+
+
+def update_manifest(
+    s3: Any, bucket: str, user_id: str, document_id: str, **sections: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Re-read the manifest and replace only the given top-level sections, then write it.
+
+    The write is conditional on the manifest being unchanged since the read, so concurrent
+    writers (index_etl updating "index", a parse updating "parsed") never drop each other's
+    sections; a lost race re-reads and re-applies the sections. A section passed as None is
+    removed. Raises the last conflict when every attempt loses. A botocore without
+    conditional writes falls back to a plain read-modify-write.
+    """
+    key = manifest_key(user_id, document_id)
+
+    def merged(current: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        manifest = current or {"documentId": document_id, "userId": user_id}
+        for name, value in sections.items():
+            if value is None:
+                manifest.pop(name, None)
+            else:
+                manifest[name] = value
+        manifest["updatedAt"] = now_iso()
+        return manifest
+
+    def put(manifest: Dict[str, Any], **condition: str) -> None:
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps(manifest).encode("utf-8"),
+            ContentType="application/json",
+            **condition,
+        )
+
+    for attempt in range(_WRITE_ATTEMPTS):
+        current, etag = _read(s3, bucket, key)
+        manifest = merged(current)
+        try:
+            put(manifest, **({"IfMatch": etag} if etag else {"IfNoneMatch": "*"}))
+            return manifest
+        except ParamValidationError:
+            # botocore without conditional writes
+            break
+        except ClientError as exc:
+            code = str(exc.response.get("Error", {}).get("Code"))
+            if code not in _CONFLICT_CODES or attempt == _WRITE_ATTEMPTS - 1:
+                raise
+        time.sleep(random.uniform(0.05, 0.2) * (attempt + 1))
+
+    # Only reached when conditional writes are unsupported: plain read-modify-write
+    manifest = merged(_read(s3, bucket, key)[0])
+    put(manifest)
+    return manifest
+
+
+def is_current(entry: Optional[Dict[str, Any]], source_etag: Optional[str]) -> bool:
+    """True when an artifact entry is READY and was built from the given source ETag."""
+    return bool(
+        entry
+        and source_etag
+        and entry.get("status") == READY
+        and entry.get("sourceEtag") == source_etag
+    )
+
+
+def index_version(manifest: Optional[Dict[str, Any]]) -> Optional[str]:
+    entry = (manifest or {}).get("index") or {}
+    return entry.get("version") if entry.get("status") == READY else None
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from . import bedrock
+from .context import estimate_tokens, pack_context
+from .deadline import Deadline, run_with_timeout
+
+# Map-reduce answering for questions over many documents, where one packed prompt would keep
+# only the few best chunks and drop most documents.
+#
+#   map     documents (their own retrieval hits) are grouped into at most AGENT_MAP_MAX_CALLS
+#           (default 8) groups, best-scoring first; each group gets a partial answer from its
+#           own evidence (AGENT_MAP_CONTEXT_TOKENS, default 1500; answers capped at
+#           AGENT_MAP_MAX_TOKENS, default 400) or NO_EVIDENCE. Calls run concurrently, at most
+#           AGENT_MAP_CONCURRENCY (default 8, capped one below the model's Bedrock concurrency)
+#           at a time, and stop being started once AGENT_MAP_ENOUGH (default 8) groups have
+#           found evidence or the map deadline passes.
+#   reduce  one call merges the partial answers (AGENT_REDUCE_CONTEXT_TOKENS, default 4000;
+#           AGENT_REDUCE_MAX_TOKENS, default 1000). Citation tags are numbered across all
+#           groups, so the merged answer keeps the partial answers' [n] references. A single
+#           partial answer is used as is.
+#
+# Wall-clock time stays near two model calls however many documents are selected.
+
+NO_EVIDENCE = "NO_EVIDENCE"
+
+_MAP_SYSTEM = (
+    "You are a document analysis assistant reading part of a document collection. Using ONLY "
+    "the evidence given, answer the user's question concisely and cite every fact with the "
+    "bracketed source number it came from, e.g. [3]. If the evidence does not help answer the "
+    f"question, reply with exactly {NO_EVIDENCE}."
+)
+_REDUCE_SYSTEM = (
+    "You are a document analysis assistant. Merge the partial answers, each drawn from "
+    "different documents, into one answer to the user's question. Keep the bracketed source "
+    "numbers, e.g. [3], on every fact you use; never invent new ones. Combine duplicates and "
+    "point out conflicts between documents. Do not add disclaimers or a Sources section. "
+    "Be concise and use bullet points when listing items."
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def wanted(answer_mode: Optional[str], doc_count: int) -> bool:
+    """Whether to answer by map-reduce: answerMode "mapreduce" forces it, "single" disables
+    it and otherwise (auto) it is used from AGENT_MAP_REDUCE_MIN_DOCS (default 6) documents."""
+    mode = (answer_mode or "auto").lower()
+    if mode == "single" or doc_count <= 0:
+        return False
+    return mode == "mapreduce" or doc_count >= _env_int("AGENT_MAP_REDUCE_MIN_DOCS", 6)
+
+
+def _best(hits: List[Dict[str, Any]]) -> float:
+    return max((float(h.get("score") or 0.0) for h in hits), default=0.0)
+
+
+def _groups(per_doc: Dict[str, List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+    ranked = sorted((hits for hits in per_doc.values() if hits), key=_best, reverse=True)
+    if not ranked:
+        return []
+    size = -(-len(ranked) // max(1, _env_int("AGENT_MAP_MAX_CALLS", 8)))
+    return [[h for hits in ranked[i : i + size] for h in hits] for i in range(0, len(ranked), size)]
+
+
+def _text(resp: Dict[str, Any]) -> str:
+    parts = (resp or {}).get("output", {}).get("message", {}).get("content", [])
+    return (parts[0].get("text") or "").strip() if parts else ""
+
+
+def _map_one(
+    model_id: str, prompt: str, part: Dict[str, Any], deadline: Deadline
+) -> Dict[str, Any]:
+    content = (
+        f"Question: {prompt}\n\n"
+        f"Evidence, numbered by source (may be truncated):\n{part['packed']['text']}"
+    )
+    resp = bedrock.converse(
+        model_id,
+        [{"role": "user", "content": [{"text": content}]}],
+        system=[{"text": _MAP_SYSTEM}],
+        deadline=deadline.at,
+        inferenceConfig={"maxTokens": _env_int("AGENT_MAP_MAX_TOKENS", 400), "temperature": 0},
+    )
+    text = _text(resp)
+    return {**part, "text": text, "evidence": bool(text) and not text.startswith(NO_EVIDENCE)}
+
+
+def answer(
+    prompt: str,
+    per_doc: Dict[str, List[Dict[str, Any]]],
+    model_id: str,
+    deadline: Deadline,
+    on_text: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """Answer `prompt` from per-document retrieval hits ({documentId: hits}).
+
+    Returns {"text" ("" when no group found evidence), "evidence" (source list and partial
+    answers, for the report), "documentIds" (documents behind the answer), "notes" (what was
+    cut short)}. `on_text` receives the merged answer as it streams.
+    """
+    notes: List[str] = []
+    # Pack every group up front so citation tags can be numbered across groups
+    parts: List[Dict[str, Any]] = []
+    next_tag = 1
+    for hits in _groups(per_doc):
+        packed = pack_context(hits, _env_int("AGENT_MAP_CONTEXT_TOKENS", 1500), first_tag=next_tag)
+        if not packed["blocks"]:
+            continue
+        next_tag += len(packed["blocks"])
+        parts.append({"packed": packed, "score": _best(hits)})
+    if not parts:
+        return {"text": "", "evidence": "", "documentIds": [], "notes": notes}
+
+    # Leave the merge call the last third of the time
+    map_by = deadline.slice(0.65)
+    enough = max(1, _env_int("AGENT_MAP_ENOUGH", 8))
+    done: List[Dict[str, Any]] = []
+    # Stay under the model's slot count, keeping one free for the merge call
+    slots = max(1, bedrock.max_concurrency(model_id) - 1)
+    pool = ThreadPoolExecutor(
+        max_workers=max(1, min(_env_int("AGENT_MAP_CONCURRENCY", 8), slots, len(parts)))
+    )
+    pending = {pool.submit(_map_one, model_id, prompt, part, map_by) for part in parts}
+    try:
+        while pending and map_by.remaining() > 0:
+            finished, pending = wait(
+                pending, timeout=map_by.remaining(), return_when=FIRST_COMPLETED
+            )
+            for future in finished:
+                try:
+                    done.append(future.result())
+                except Exception:
+                    notes.append("a partial answer failed")
+            if sum(1 for p in done if p["evidence"]) >= enough:
+                # Early exit: enough documents answered; the rest would only add length
+                break
+    finally:
+        # Calls still running are abandoned; queued ones never start
+        pool.shutdown(wait=False, cancel_futures=True)
+    if pending and map_by.remaining() <= 0:
+        notes.append(f"{len(pending)} of {len(parts)} document groups were not read in time")
+
+    useful = sorted((p for p in done if p["evidence"]), key=lambda p: p["score"], reverse=True)
+    if not useful:
+        return {"text": "", "evidence": "", "documentIds": [], "notes": notes}
+
+    # Partial answers best first, as many as fit the merge budget
+    budget = _env_int("AGENT_REDUCE_CONTEXT_TOKENS", 4000)
+    kept: List[Dict[str, Any]] = []
+    used = 0
+    for part in useful:
+        cost = estimate_tokens(part["text"]) + 8
+        if kept and used + cost > budget:
+            break
+        kept.append(part)
+        used += cost
+    sources = "\n".join(block["citation"] for part in kept for block in part["packed"]["blocks"])
+    partials = "\n\n".join(
+        f"Partial answer {i}:\n{part['text']}" for i, part in enumerate(kept, start=1)
+    )
+    evidence = f"Sources:\n{sources}\n\n{partials}"
+    document_ids = list(
+        dict.fromkeys(str(b["documentId"]) for part in kept for b in part["packed"]["blocks"])
+    )
+    if len(kept) == 1:
+        return {
+            "text": kept[0]["text"],
+            "evidence": evidence,
+            "documentIds": document_ids,
+            "notes": notes,
+        }
+
+    messages = [{"role": "user", "content": [{"text": f"Question: {prompt}\n\n{evidence}"}]}]
+    params = {"inferenceConfig": {"maxTokens": _env_int("AGENT_REDUCE_MAX_TOKENS", 1000)}}
+
+    def reduce() -> Dict[str, Any]:
+        if on_text is not None:
+            return bedrock.converse_stream(
+                model_id,
+                messages,
+                on_text,
+                system=[{"text": _REDUCE_SYSTEM}],
+                deadline=deadline.at,
+                **params,
+            )
+        return bedrock.converse(
+            model_id, messages, system=[{"text": _REDUCE_SYSTEM}], deadline=deadline.at, **params
+        )
+
+    try:
+        resp, finished = run_with_timeout(reduce, deadline.remaining(), default={})
+    except Exception:
+        resp, finished = {}, True
+    text = _text(resp)
+    if not text:
+        # The partial answers already cite their sources; hand them over unmerged
+        notes.append("merging partial answers " + ("timed out" if not finished else "failed"))
+        text = "\n\n".join(part["text"] for part in kept)
+    return {"text": text, "evidence": evidence, "documentIds": document_ids, "notes": notes}
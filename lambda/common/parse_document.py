@@ -1,12 +1,24 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from . import llama_parse
 
 
-def parse_pdf_bytes(pdf_bytes: bytes, filename: str) -> Dict[str, Any]:
-    parsed = llama_parse.parse_pdf_bytes(pdf_bytes, filename=filename)
+def is_stub(parsed: Dict[str, Any]) -> bool:
+    """Whether `parsed` is a placeholder for a parse that failed, not the document's content.
+
+    Stubs are never cached, stored or marked READY, so the next request parses again.
+    """
+    return bool((parsed.get("metadata") or {}).get("stub"))
+
+
+def parse_pdf_bytes(
+    pdf_bytes: bytes, filename: str, deadline: Optional[float] = None, job_id: Optional[str] = None
+) -> Dict[str, Any]:
+    parsed = llama_parse.parse_pdf_bytes(
+        pdf_bytes, filename=filename, deadline=deadline, job_id=job_id
+    )
     # Preserve full structure: text, pages, and tables from LlamaParse
     text = parsed.get("text") or ""
     if not text and isinstance(parsed.get("pages"), list) and parsed["pages"]:
@@ -22,9 +34,11 @@ def parse_pdf_bytes(pdf_bytes: bytes, filename: str) -> Dict[str, Any]:
     return normalized
 
 
-def parse_xlsx_bytes(xlsx_bytes: bytes, filename: str) -> Dict[str, Any]:
+def parse_xlsx_bytes(
+    xlsx_bytes: bytes, filename: str, deadline: Optional[float] = None
+) -> Dict[str, Any]:
     # Delegate to LlamaParse's XLSX support
-    result = llama_parse.parse_xlsx_bytes(xlsx_bytes, filename=filename)
+    result = llama_parse.parse_xlsx_bytes(xlsx_bytes, filename=filename, deadline=deadline)
     # Normalize to common structure
     text = result.get("text") or ""
     tables = result.get("tables") or []
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import base64
+import operator
+from array import array
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Compact vector encodings used by the retrieval index:
+#   float32  full precision, little-endian rows of `dim` floats (4 bytes/dim)
+#   int8     symmetric per-vector quantization, one signed byte per dim (4x smaller)
+#   binary   one sign bit per dim, packed big-endian into ceil(dim/8) bytes (32x smaller)
+# Cosine similarity is scale-invariant, so int8 codes can be compared without their scales.
+
+
+def _fit(vec: Sequence[float], dim: int) -> List[float]:
+    vals = [float(x) for x in vec[:dim]]
+    if len(vals) < dim:
+        vals.extend([0.0] * (dim - len(vals)))
+    return vals
+
+
+def common_dim(vectors: Iterable[Sequence[float]]) -> int:
+    return max((len(v) for v in vectors), default=0)
+
+
+def pack_float32(vectors: List[Sequence[float]], dim: int) -> bytes:
+    arr = array("f")
+    for vec in vectors:
+        arr.extend(_fit(vec, dim))
+    if arr.itemsize != 4:  # pragma: no cover - every CPython platform we deploy on
+        raise RuntimeError("float32 arrays unavailable")
+    return arr.tobytes()
+
+
+def unpack_float32(data: bytes, dim: int) -> List[List[float]]:
+    arr = array("f")
+    arr.frombytes(data[: len(data) - len(data) % 4])
+    return [arr[i : i + dim].tolist() for i in range(0, len(arr) - dim + 1, dim)]
+
+
+def quantize_int8(vec: Sequence[float]) -> Tuple[bytes, float]:
+    """Return (codes, scale) with vec ~= codes * scale and codes in [-127, 127]."""
+    peak = max((abs(x) for x in vec), default=0.0)
+    if peak == 0.0:
+        return bytes(len(vec)), 0.0
+    scale = peak / 127.0
+    codes = array("b", [max(-127, min(127, round(x / scale))) for x in vec])
+    return codes.tobytes(), scale
+
+
+def pack_int8(vectors: List[Sequence[float]], dim: int) -> Tuple[bytes, List[float]]:
+    out = bytearray()
+    scales: List[float] = []
+    for vec in vectors:
+        codes, scale = quantize_int8(_fit(vec, dim))
+        out.extend(codes)
+        scales.append(scale)
+    return bytes(out), scales
+
+
+def sign_bits(vec: Sequence[float], dim: int) -> int:
+    """Pack the sign of each component into an int (bit set = positive), MSB first."""
+    bits = 0
+    for x in _fit(vec, dim):
+        bits = (bits << 1) | (1 if x > 0.0 else 0)
+    return bits
+
+
+def pack_binary(vectors: List[Sequence[float]], dim: int) -> bytes:
+    width = (dim + 7) // 8
+    pad = width * 8 - dim
+    return b"".join((sign_bits(v, dim) << pad).to_bytes(width, "big") for v in vectors)
+
+
+def encode_b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def decode_int8_b64(payload: str) -> List[float]:
+    arr = array("b")
+    arr.frombytes(base64.b64decode(payload))
+    return [float(x) for x in arr]
+
+
+class BinaryCodes:
+    """Sign-bit codes for a document; similarity is 1 - 2 * hamming / dim (in [-1, 1])."""
+
+    def __init__(self, data: bytes, dim: int):
+        self.dim = dim
+        width = (dim + 7) // 8
+        pad = width * 8 - dim
+        self.codes = [
+            int.from_bytes(data[i : i + width], "big") >> pad
+            for i in range(0, len(data) - width + 1, width)
+        ]
+
+    @classmethod
+    def from_b64(cls, payload: str, dim: int) -> "BinaryCodes":
+        return cls(base64.b64decode(payload), dim)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def scores(self, q_vec: Sequence[float], ids: Iterable[int]) -> Dict[int, float]:
+        if not self.dim:
+            return {}
+        q_bits = sign_bits(q_vec, self.dim)
+        inv = 2.0 / self.dim
+        codes = self.codes
+        return {i: 1.0 - inv * (q_bits ^ codes[i]).bit_count() for i in ids if i < len(codes)}
+
+
+class Int8Codes:
+    """int8 codes for a document; similarity is the cosine between code vectors."""
+
+    def __init__(self, data: bytes, dim: int):
+        self.dim = dim
+        arr = array("b")
+        arr.frombytes(data[: len(data) - len(data) % dim] if dim else b"")
+        self.codes = [arr[i : i + dim] for i in range(0, len(arr), dim)] if dim else []
+        self.norms = [sum(map(operator.mul, c, c)) ** 0.5 for c in self.codes]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def scores(self, q_vec: Sequence[float], ids: Iterable[int]) -> Dict[int, float]:
+        q_codes, _ = quantize_int8(_fit(q_vec, self.dim))
+        q = array("b")
+        q.frombytes(q_codes)
+        q_norm = sum(map(operator.mul, q, q)) ** 0.5
+        out: Dict[int, float] = {}
+        for i in ids:
+            if i >= len(self.codes):
+                continue
+            denom = q_norm * self.norms[i]
+            out[i] = sum(map(operator.mul, q, self.codes[i])) / denom if denom else 0.0
+        return out
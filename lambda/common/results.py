@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+from typing import Any, Dict, Optional
+
+# Large task results live in the reports bucket, not in the tasks table item.
+#
+# A result (the agentResult JSON string) larger than RESULT_INLINE_MAX_BYTES (default 32 KB)
+# is gzipped to s3://<reports>/results/<taskId>.json.gz and replaced by a small stub with
+# the same top-level shape, so clients that only read "text"/"sources" keep working:
+#
+#   {"text": <first RESULT_PREVIEW_CHARS of the answer>, "sources": [...], "truncated": true,
+#    "summary": {"textChars", "sources", "reportChars"},
+#    "resultRef": {"bucket", "key", "size", "compressedSize", "encoding": "gzip"}}
+#
+# get_result turns resultRef into a presigned URL for the full result.
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def result_key(task_id: str) -> str:
+    return f"results/{task_id}.json.gz"
+
+
+def offload(s3: Any, bucket: str, task_id: Optional[str], agent_result: str) -> str:
+    """Return `agent_result` itself when small enough, else store it and return a stub.
+
+    Falls back to the inline result when there is no task id or bucket or the write fails.
+    """
+    raw = agent_result.encode("utf-8")
+    if len(raw) <= _env_int("RESULT_INLINE_MAX_BYTES", 32 * 1024) or not task_id or not bucket:
+        return agent_result
+    try:
+        result = json.loads(agent_result)
+    except ValueError:
+        result = {"text": agent_result}
+    body = gzip.compress(raw, compresslevel=6)
+    key = result_key(task_id)
+    try:
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=body,
+            ContentType="application/json",
+            # Browsers fetching the presigned URL decompress transparently
+            ContentEncoding="gzip",
+        )
+    except Exception:
+        return agent_result
+    text = str(result.get("text") or "")
+    sources = result.get("sources") or []
+    report = (result.get("report") or {}).get("content") or ""
+    stub = {
+        "text": text[: _env_int("RESULT_PREVIEW_CHARS", 4000)],
+        "sources": sources[:20],
+        "truncated": True,
+        "summary": {"textChars": len(text), "sources": len(sources), "reportChars": len(report)},
+        "resultRef": {
+            "bucket": bucket,
+            "key": key,
+            "size": len(raw),
+            "compressedSize": len(body),
+            "encoding": "gzip",
+        },
+    }
+    for field in ("cached", "degraded"):
+        if field in result:
+            stub[field] = result[field]
+    return json.dumps(stub)
+
+
+def result_ref(agent_result: Optional[str]) -> Optional[Dict[str, Any]]:
+    """The resultRef of an offloaded result, or None for inline results."""
+    if not agent_result or '"resultRef"' not in agent_result:
+        return None
+    try:
+        ref = json.loads(agent_result).get("resultRef")
+    except (ValueError, AttributeError):
+        return None
+    return ref if isinstance(ref, dict) and ref.get("bucket") and ref.get("key") else None
+
+
+def presign(s3: Any, ref: Dict[str, Any], expires_in: Optional[int] = None) -> Optional[str]:
+    try:
+        return s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": ref["bucket"], "Key": ref["key"]},
+            ExpiresIn=expires_in or _env_int("RESULT_URL_TTL_SECONDS", 900),
+        )
+    except Exception:
+        return None
@@ -1,12 +1,27 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, List, Tuple
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
-import boto3
-from botocore.config import Config
+from .aws import get_boto3_client
+from .cache import get_cache
+from .embeddings import embed_texts, get_backend
+from .filters import build_postings, normalize_filters, select_chunk_ids
+from .index_store import (
+    decode_centroid,
+    load_header,
+    load_int8_codes,
+    load_records,
+    load_summary,
+    load_vector_rows,
+)
+from .manifest import index_version, load_manifest
+from .quantization import BinaryCodes
 
-from .embeddings import embed_texts
+# Most chunks handed back through `candidate_pool`
+_POOL_LIMIT = 50
 
 
 def _cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -28,46 +43,226 @@ def _cosine_similarity(a: List[float], b: List[float]) -> float:
     return dot / ((na**0.5) * (nb**0.5))
 
 
+def _coarse_method() -> str:
+    method = (os.environ.get("RETRIEVAL_COARSE_METHOD") or "binary").lower()
+    return method if method in ("binary", "int8", "exact") else "binary"
+
+
+def _env_number(name: str, default: Any) -> Any:
+    try:
+        return type(default)(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def _map_docs(fn: Any, document_ids: List[str]) -> List[Any]:
+    """Run per-document S3 reads concurrently, preserving input order."""
+    if len(document_ids) <= 1:
+        return [fn(d) for d in document_ids]
+    with ThreadPoolExecutor(max_workers=min(8, len(document_ids))) as pool:
+        return list(pool.map(fn, document_ids))
+
+
+def _prune_documents(
+    s3: Any,
+    reports_bucket: str,
+    user_id: str,
+    document_ids: List[str],
+    versions: Dict[str, Optional[str]],
+    query_vector: Callable[[Optional[Dict[str, Any]]], List[float]],
+    max_docs: int,
+    doc_margin: float,
+    max_sections: int,
+) -> Tuple[List[str], Dict[str, Set[int]]]:
+    """Coarse stage: rank documents, then their page/sheet sections, by centroid similarity.
+
+    Keeps at most `max_docs` documents scoring within `doc_margin` of the best one, and for
+    kept documents with more than `max_sections` sections only the best sections' chunk ids.
+    Documents without a summary (older indexes) are always kept and never section-pruned.
+    """
+    summaries = _map_docs(
+        lambda d: load_summary(s3, reports_bucket, user_id, d, versions.get(d)), document_ids
+    )
+    ranked: List[Tuple[float, str, Dict[str, Any]]] = []
+    keep: Set[str] = set()
+    for doc_id, summary in zip(document_ids, summaries):
+        if not summary or not summary.get("centroid"):
+            keep.add(doc_id)
+            continue
+        q_vec = query_vector(summary.get("embedding"))
+        centroid = decode_centroid(summary["centroid"])
+        ranked.append((_cosine_similarity(q_vec, centroid), doc_id, summary))
+    ranked.sort(key=lambda x: x[0], reverse=True)
+    best = ranked[0][0] if ranked else 0.0
+    section_ids: Dict[str, Set[int]] = {}
+    for score, doc_id, summary in ranked[: max(1, max_docs)]:
+        if score < best - doc_margin:
+            break
+        keep.add(doc_id)
+        sections = summary.get("sections") or []
+        if max_sections > 0 and len(sections) > max_sections:
+            q_vec = query_vector(summary.get("embedding"))
+            sections = sorted(
+                sections,
+                key=lambda sec: _cosine_similarity(q_vec, decode_centroid(sec.get("centroid"))),
+                reverse=True,
+            )
+            section_ids[doc_id] = {
+                int(i) for sec in sections[:max_sections] for i in sec.get("chunkIds") or []
+            }
+    return [d for d in document_ids if d in keep], section_ids
+
+
+def embed_query(prompt: str, descriptor: Optional[Dict[str, Any]] = None) -> List[float]:
+    """Embed a prompt with the backend `descriptor` names (default: the configured one).
+
+    Repeated prompts (retries, follow-ups, answer-cache lookups) reuse the container-wide
+    query vector cache.
+    """
+    backend = get_backend(descriptor if isinstance(descriptor, dict) else None)
+    prompt_digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    cache_key = f"{backend.name}|{backend.model_id}|{backend.dimension}|{prompt_digest}"
+    vector_cache = get_cache("vectors", memory_mb=8, disk_mb=16)
+    vec = vector_cache.get(cache_key)
+    if vec is None:
+        vecs = embed_texts([prompt], backend=backend)
+        vec = vecs[0] if vecs else []
+        if any(vec):
+            vector_cache.put(cache_key, vec, size=8 * len(vec) + 64)
+    return vec
+
+
 def retrieve_top_k(
     prompt: str,
     user_id: str,
     document_ids: List[str],
     reports_bucket: str,
     top_k: int = 5,
+    filters: Optional[Dict[str, Any]] = None,
+    rescore_factor: Optional[int] = None,
+    prune_min_docs: Optional[int] = None,
+    max_docs: Optional[int] = None,
+    doc_margin: Optional[float] = None,
+    max_sections: Optional[int] = None,
+    versions: Optional[Dict[str, Optional[str]]] = None,
+    candidate_pool: Optional[List[Dict[str, Any]]] = None,
 ) -> List[Dict[str, Any]]:
-    """Load embeddings JSONL for the given documents and return top-k chunks by similarity.
+    """Load the per-document indexes for the given documents and return top-k chunks by similarity.
+
+    `filters` (pages/rows ranges, sheets, docTypes; see `filters.normalize_filters`) are
+    evaluated against per-document posting lists before any scoring, so only eligible chunks
+    are scored. If no selected document has a chunk matching the filters, they are ignored.
+
+    Quantized indexes are scored in two passes: a coarse pass over binary (default) or int8
+    codes (RETRIEVAL_COARSE_METHOD), then a shortlist of top_k * rescore_factor chunks
+    (RETRIEVAL_RESCORE_FACTOR, default 4) is rescored against the full-precision vectors.
+    Legacy indexes with inline embeddings are scored exactly.
+
+    When at least `prune_min_docs` documents are selected (RETRIEVAL_PRUNE_MIN_DOCS, default 4)
+    and no filters are given, documents are first ranked by their centroid vectors and only the
+    best `max_docs` (RETRIEVAL_MAX_DOCS, default 4) within `doc_margin` (RETRIEVAL_DOC_MARGIN,
+    default 0.1) of the top score are loaded; within those, at most `max_sections` page/sheet
+    sections (RETRIEVAL_MAX_SECTIONS, default 12; 0 disables) are scored.
+
+    `versions` maps document ids to their live index version when the caller already knows it
+    (e.g. from the document catalog); other documents are resolved through their manifests.
 
-    Returns list of { documentId, text, metadata, score } sorted by score desc.
+    Returns list of { documentId, chunkId, text, metadata, score, filename, title } sorted by
+    score desc; filename/title come from the index header (empty for older indexes).
+
+    `candidate_pool`, when given, is extended with the best exactly scored chunks (up to 50,
+    best first) in the same shape plus their full-precision "vector" and the index's
+    "embedding" descriptor, so callers can rescore them for a related query without the index.
     """
     if not prompt or not document_ids:
         return []
 
-    s3 = boto3.client("s3", config=Config(retries={"max_attempts": 3}))
-    # Embed the prompt once
-    q_vecs = embed_texts([prompt])
-    if not q_vecs:
-        return []
-    q_vec = q_vecs[0]
+    s3 = get_boto3_client("s3")
+    norm_filters = normalize_filters(filters)
+    if rescore_factor is None:
+        rescore_factor = _env_number("RETRIEVAL_RESCORE_FACTOR", 4)
+    if prune_min_docs is None:
+        prune_min_docs = _env_number("RETRIEVAL_PRUNE_MIN_DOCS", 4)
+    if max_docs is None:
+        max_docs = _env_number("RETRIEVAL_MAX_DOCS", 4)
+    if doc_margin is None:
+        doc_margin = _env_number("RETRIEVAL_DOC_MARGIN", 0.1)
+    if max_sections is None:
+        max_sections = _env_number("RETRIEVAL_MAX_SECTIONS", 12)
+    method = _coarse_method()
 
-    candidates: List[Tuple[float, Dict[str, Any]]] = []
-    for doc_id in document_ids:
-        key = f"embeddings/{user_id}/{doc_id}.jsonl"
-        try:
-            obj = s3.get_object(Bucket=reports_bucket, Key=key)
-            body = obj["Body"].read()
-        except Exception:
-            continue
-        for line in body.splitlines():
-            try:
-                rec = json.loads(line.decode("utf-8"))
-            except Exception:
-                continue
-            vec = rec.get("embedding") or []
-            score = _cosine_similarity(q_vec, vec)
-            candidates.append((score, rec))
+    # Embed the prompt once per embedding backend; each index records the backend (and
+    # dimension) that produced its vectors, older indexes use the configured default.
+    query_vectors: Dict[Tuple[Any, ...], List[float]] = {}
 
-    if not candidates:
+    def query_vector(descriptor: Optional[Dict[str, Any]] = None) -> List[float]:
+        backend = get_backend(descriptor if isinstance(descriptor, dict) else None)
+        key = (backend.name, backend.model_id, backend.dimension)
+        if key not in query_vectors:
+            query_vectors[key] = embed_query(prompt, descriptor)
+        return query_vectors[key]
+
+    q_is_zero = not any(query_vector())
+
+    # One cheap manifest read per document not resolved by the caller selects the live index
+    # version; documents without a manifest use the unversioned (pre-manifest) index keys
+    versions = {d: v for d, v in (versions or {}).items() if v}
+    unresolved = [d for d in document_ids if d not in versions]
+    manifests = _map_docs(lambda d: load_manifest(s3, reports_bucket, user_id, d), unresolved)
+    versions.update({d: index_version(m) for d, m in zip(unresolved, manifests)})
+
+    # Filters name pages/rows a document may hold whatever its centroid says, so a filtered
+    # question scores every selected document in full
+    section_ids: Dict[str, Set[int]] = {}
+    if not q_is_zero and not norm_filters and len(document_ids) >= max(1, prune_min_docs):
+        document_ids, section_ids = _prune_documents(
+            s3,
+            reports_bucket,
+            user_id,
+            document_ids,
+            versions,
+            query_vector,
+            max_docs=max_docs,
+            doc_margin=doc_margin,
+            max_sections=max_sections,
+        )
+
+    def load_doc(doc_id: str) -> Optional[Dict[str, Any]]:
+        version = versions.get(doc_id)
+        records = load_records(s3, reports_bucket, user_id, doc_id, version)
+        if not records:
+            return None
+        header = load_header(s3, reports_bucket, user_id, doc_id, version) or {}
+        allowed: Optional[Set[int]] = None
+        if norm_filters:
+            postings = header.get("postings")
+            if not isinstance(postings, dict) or header.get("count") != len(records):
+                # Legacy or stale header: derive posting lists from the records themselves
+                postings = build_postings(records)
+            allowed = select_chunk_ids(postings, norm_filters)
+        elif doc_id in section_ids:
+            allowed = section_ids[doc_id]
+        for chunk_id, rec in enumerate(records):
+            if rec:
+                rec.setdefault("chunkId", chunk_id)
+        return {
+            "documentId": doc_id,
+            "version": version,
+            "header": header,
+            "records": records,
+            "ids": allowed,
+        }
+
+    docs: List[Dict[str, Any]] = [d for d in _map_docs(load_doc, document_ids) if d]
+    if not docs:
         return []
+    if norm_filters and not any(d["ids"] for d in docs):
+        for d in docs:
+            d["ids"] = None
+    for d in docs:
+        ids = d["ids"] if d["ids"] is not None else range(len(d["records"]))
+        d["ids"] = [i for i in sorted(ids) if i < len(d["records"]) and d["records"][i]]
+
     # Prefer rows whose Topic matches product/entity terms in the question
     q = (prompt or "").lower()
     q_terms = [t for t in q.replace("?", " ").replace(",", " ").split() if len(t) > 2]
@@ -82,16 +277,84 @@ def retrieve_top_k(
                     return str(v or "").lower()
         return ""
 
-    filtered: List[Tuple[float, Dict[str, Any]]] = []
-    for s, r in candidates:
-        top = topic_of(r)
-        if top and any(term in top for term in q_terms):
-            filtered.append((s, r))
+    def topic_matches(rec: Dict[str, Any]) -> bool:
+        top = topic_of(rec)
+        return bool(top) and any(term in top for term in q_terms)
+
+    topical = [[i for i in d["ids"] if topic_matches(d["records"][i])] for d in docs]
     # Only apply filter if it yields results
-    if filtered:
-        candidates = filtered
+    if any(topical):
+        for d, ids in zip(docs, topical):
+            d["ids"] = ids
+
+    # Every eligible chunk is a candidate for the lexical fallback; `scored` holds the
+    # chunks that received an exact (full-precision) similarity.
+    candidates: List[Tuple[float, Dict[str, Any]]] = []
+    scored: List[Tuple[float, Dict[str, Any]]] = []
+    coarse: List[Tuple[float, Dict[str, Any], int]] = []
+    # id(record) -> (vector, embedding descriptor) for chunks scored exactly
+    pool_vectors: Dict[int, Tuple[List[float], Any]] = {}
+    for d_idx, d in enumerate(docs):
+        records = d["records"]
+        candidates.extend((0.0, records[i]) for i in d["ids"])
+        q_vec = query_vector(d["header"].get("embedding"))
+        d["queryVector"] = q_vec
+        if not any(q_vec):
+            continue
+        vec_info = d["header"].get("vectors") or {}
+        dim = int(vec_info.get("dim") or 0)
+        inline = any("embedding" in rec for rec in records[:1])
+        if inline or dim <= 0 or vec_info.get("count") != len(records) or method == "exact":
+            rows: Dict[int, List[float]] = {}
+            if not inline:
+                rows = load_vector_rows(
+                    s3, reports_bucket, user_id, d["documentId"], dim, d["ids"], d["version"]
+                )
+            for i in d["ids"]:
+                vec = records[i].get("embedding") if inline else rows.get(i)
+                scored.append((_cosine_similarity(q_vec, vec or []), records[i]))
+                if candidate_pool is not None and vec:
+                    pool_vectors[id(records[i])] = (vec, d["header"].get("embedding"))
+            continue
+        codes: Any = None
+        if method == "int8":
+            codes = load_int8_codes(s3, reports_bucket, user_id, d["documentId"], dim, d["version"])
+        if codes is None:
+            codes = BinaryCodes.from_b64(vec_info.get("binary") or "", dim)
+        for i, s in codes.scores(q_vec, d["ids"]).items():
+            coarse.append((s, records[i], d_idx))
+
+    if coarse:
+        coarse.sort(key=lambda x: x[0], reverse=True)
+        shortlist: Dict[int, List[int]] = {}
+        for _, rec, d_idx in coarse[: max(top_k, top_k * max(1, rescore_factor))]:
+            shortlist.setdefault(d_idx, []).append(int(rec["chunkId"]))
+        for d_idx, ids in shortlist.items():
+            d = docs[d_idx]
+            dim = int(d["header"]["vectors"]["dim"])
+            rows = load_vector_rows(
+                s3, reports_bucket, user_id, d["documentId"], dim, ids, d["version"]
+            )
+            for i in ids:
+                score = _cosine_similarity(d["queryVector"], rows.get(i, []))
+                scored.append((score, d["records"][i]))
+                if candidate_pool is not None and rows.get(i):
+                    pool_vectors[id(d["records"][i])] = (rows[i], d["header"].get("embedding"))
+
+    if not candidates:
+        return []
+    # Lightweight per-document metadata so callers need not load the parsed documents
+    doc_info = {
+        d["documentId"]: {
+            "filename": d["header"].get("filename") or "",
+            "title": d["header"].get("title") or "",
+        }
+        for d in docs
+    }
+    if not scored:
+        scored = candidates
     # If all embedding scores are ~0, apply lexical scoring fallback (still strict retrieval)
-    max_score = max(s for s, _ in candidates)
+    max_score = max(s for s, _ in scored)
     if max_score <= 1e-9:
         q = (prompt or "").lower()
         # basic tokenization
@@ -113,21 +376,40 @@ def retrieve_top_k(
             return [
                 {
                     "documentId": r.get("documentId"),
+                    "chunkId": r.get("chunkId"),
                     "text": r.get("text") or "",
                     "metadata": r.get("metadata") or {},
                     "score": s,
+                    **doc_info.get(str(r.get("documentId")), {}),
                 }
                 for s, r in top
             ]
         # If still nothing, fall through to return arbitrary top_k by cosine (all zeros)
-    candidates.sort(key=lambda x: x[0], reverse=True)
-    top = candidates[:top_k]
+    scored.sort(key=lambda x: x[0], reverse=True)
+    if candidate_pool is not None:
+        pooled = [(s, r) for s, r in scored if id(r) in pool_vectors][:_POOL_LIMIT]
+        candidate_pool.extend(
+            {
+                "documentId": r.get("documentId"),
+                "chunkId": r.get("chunkId"),
+                "text": r.get("text") or "",
+                "metadata": r.get("metadata") or {},
+                "score": score,
+                **doc_info.get(str(r.get("documentId")), {}),
+                "vector": pool_vectors[id(r)][0],
+                "embedding": pool_vectors[id(r)][1],
+            }
+            for score, r in pooled
+        )
+    top = scored[:top_k]
     return [
         {
             "documentId": r.get("documentId"),
+            "chunkId": r.get("chunkId"),
             "text": r.get("text") or "",
             "metadata": r.get("metadata") or {},
             "score": score,
+            **doc_info.get(str(r.get("documentId")), {}),
         }
         for score, r in top
     ]
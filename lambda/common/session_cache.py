@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from .cache import get_cache
+from .embeddings import get_backend
+from .quantization import decode_int8_b64, encode_b64, quantize_int8
+from .retrieval import embed_query
+
+# Retrieval state carried across the turns of a chat session, so a follow-up question does not
+# re-resolve, re-load and re-score the same indexes from scratch:
+#
+#   sessions/<hash of user and session id>.json
+#     {"scope": {"documents": [[id, indexVersion], ...], "filters"}, "expiresAt",
+#      "turns": [{"digest", "at", "source", "chunks": [[documentId, chunkId], ...],
+#                 "queryVectors": {<backend>: <int8 b64>}}],
+#      "candidates": [{documentId, chunkId, text, metadata, filename, title, score,
+#                      "vector": <int8 b64>, "embedding": <index backend descriptor>}]}
+#
+# The candidates are the chunks earlier turns scored exactly against the full index. A
+# question over the same documents, index versions and filters counts as a follow-up when its
+# query vector is within SESSION_FOLLOWUP_SIMILARITY (cosine, default 0.45) of an earlier
+# turn's; a follow-up is answered from the rescored candidates if the best of them scores at
+# least SESSION_MIN_SCORE (default 0.3). Anything else goes back to the full index and its
+# hits join the candidates (at most SESSION_MAX_CANDIDATES, default 60, newest first).
+# Re-indexing a document changes the scope, which starts the session's retrieval state over.
+#
+# Stored in the reports bucket, so any container can continue a session, and in the
+# "sessions" memory cache of the container that served the last turn. Writes are best effort:
+# concurrent turns may drop each other's candidates, which only costs a trip to the index.
+# Sessions lapse SESSION_CACHE_TTL_SECONDS (default 1800) after their last turn.
+
+_PREFIX = "sessions"
+_MAX_TURNS = 10
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def enabled() -> bool:
+    return (os.environ.get("SESSION_CACHE_ENABLED") or "1") != "0"
+
+
+def _key(user_id: str, session_id: str) -> str:
+    digest = hashlib.sha256(f"{user_id}\n{session_id}".encode("utf-8")).hexdigest()
+    return f"{_PREFIX}/{digest}.json"
+
+
+def _digest(prompt: str) -> str:
+    return hashlib.sha256((prompt or "").strip().encode("utf-8")).hexdigest()
+
+
+def _backend_key(descriptor: Any) -> str:
+    backend = get_backend(descriptor if isinstance(descriptor, dict) else None)
+    return f"{backend.name}|{backend.model_id}|{backend.dimension}"
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    n = min(len(a), len(b))
+    dot = sum(a[i] * b[i] for i in range(n))
+    na = sum(a[i] * a[i] for i in range(n)) ** 0.5
+    nb = sum(b[i] * b[i] for i in range(n)) ** 0.5
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def _encode(vec: List[float]) -> str:
+    codes, _scale = quantize_int8(vec)
+    return encode_b64(codes)
+
+
+def load(
+    s3: Any,
+    bucket: str,
+    user_id: str,
+    session_id: str,
+    document_ids: List[str],
+    versions: Dict[str, Optional[str]],
+    filters: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """The session's retrieval state for this scope (fresh when there is none or it lapsed).
+
+    None when the session cannot be cached: no session id, or a document without a known
+    index version.
+    """
+    docs = sorted(set(document_ids))
+    if not session_id or not bucket or not docs or not all(versions.get(d) for d in docs):
+        return None
+    scope = {"documents": [[d, versions[d]] for d in docs], "filters": filters or {}}
+    key = _key(user_id, session_id)
+    fresh = {"key": key, "scope": scope, "turns": [], "candidates": []}
+    memory = get_cache("sessions", memory_mb=8, disk_mb=32)
+    state = memory.get(key)
+    if state is None:
+        try:
+            body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+            state = json.loads(body.decode("utf-8"))
+        except Exception:
+            return fresh
+    if not isinstance(state, dict) or float(state.get("expiresAt") or 0) < time.time():
+        return fresh
+    if json.dumps(state.get("scope"), sort_keys=True, default=str) != json.dumps(
+        scope, sort_keys=True, default=str
+    ):
+        return fresh
+    return {**state, "key": key}
+
+
+def _query_vector(state: Dict[str, Any], prompt: str, descriptor: Any) -> List[float]:
+    # A repeated question reuses the vector an earlier turn stored, even on another container
+    backend = _backend_key(descriptor)
+    digest = _digest(prompt)
+    for turn in reversed(state.get("turns") or []):
+        if turn.get("digest") == digest and (turn.get("queryVectors") or {}).get(backend):
+            return decode_int8_b64(turn["queryVectors"][backend])
+    return embed_query(prompt, descriptor)
+
+
+def rescore(state: Dict[str, Any], prompt: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    """Top-k hits from the session's candidates, or [] when `prompt` is not a follow-up they
+    answer well enough and the full index should be searched instead."""
+    candidates = state.get("candidates") or []
+    if not candidates or not prompt:
+        return []
+    vectors: Dict[str, List[float]] = {}
+    for cand in candidates:
+        backend = _backend_key(cand.get("embedding"))
+        if backend not in vectors:
+            vectors[backend] = _query_vector(state, prompt, cand.get("embedding"))
+            if not any(vectors[backend]):
+                return []
+    # Only a follow-up (close to a question the candidates were retrieved for) may use them
+    similarity = 0.0
+    for turn in state.get("turns") or []:
+        for backend, previous in (turn.get("queryVectors") or {}).items():
+            if backend in vectors:
+                similarity = max(similarity, _cosine(vectors[backend], decode_int8_b64(previous)))
+    if similarity < _env_float("SESSION_FOLLOWUP_SIMILARITY", 0.45):
+        return []
+    scored = []
+    for cand in candidates:
+        vec = vectors[_backend_key(cand.get("embedding"))]
+        scored.append((_cosine(vec, decode_int8_b64(cand.get("vector") or "")), cand))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    if scored[0][0] < _env_float("SESSION_MIN_SCORE", 0.3):
+        return []
+    state["queryVectors"] = {k: _encode(v) for k, v in vectors.items()}
+    return [
+        {**{k: v for k, v in cand.items() if k not in ("vector", "embedding")}, "score": score}
+        for score, cand in scored[:top_k]
+    ]
+
+
+def record(
+    s3: Any,
+    bucket: str,
+    state: Dict[str, Any],
+    prompt: str,
+    hits: List[Dict[str, Any]],
+    pool: Optional[List[Dict[str, Any]]] = None,
+) -> None:
+    """Add a turn to the session and store it. `pool` holds the candidates a full index
+    search produced (see retrieve_top_k's candidate_pool); None for turns answered from
+    the session's own candidates."""
+    now = time.time()
+    candidates = list(state.get("candidates") or [])
+    query_vectors = state.pop("queryVectors", None) or {}
+    if pool:
+        seen = {(str(c.get("documentId")), c.get("chunkId")) for c in pool}
+        fresh = [
+            {**c, "vector": _encode(c["vector"])}
+            for c in pool
+            if c.get("vector") and any(c["vector"])
+        ]
+        candidates = fresh + [
+            c for c in candidates if (str(c.get("documentId")), c.get("chunkId")) not in seen
+        ]
+        for c in pool:
+            # The full search embedded the prompt for each backend it met
+            backend = _backend_key(c.get("embedding"))
+            if backend not in query_vectors:
+                vec = embed_query(prompt, c.get("embedding"))
+                if any(vec):
+                    query_vectors[backend] = _encode(vec)
+    turn = {
+        "digest": _digest(prompt),
+        "at": now,
+        "source": "index" if pool is not None else "session",
+        "chunks": [[str(h.get("documentId")), h.get("chunkId")] for h in hits],
+        "queryVectors": query_vectors,
+    }
+    key = state["key"]
+    stored = {
+        "scope": state["scope"],
+        "expiresAt": now + _env_float("SESSION_CACHE_TTL_SECONDS", 1800),
+        "turns": (list(state.get("turns") or []) + [turn])[-_MAX_TURNS:],
+        "candidates": candidates[: int(_env_float("SESSION_MAX_CANDIDATES", 60))],
+    }
+    body = json.dumps(stored, default=str).encode("utf-8")
+    get_cache("sessions", memory_mb=8, disk_mb=32).put(key, stored, size=len(body))
+    try:
+        s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType="application/json")
+    except Exception:
+        pass
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .aws import get_boto3_resource
+
+# Incremental answer text for a running task, written by bedrock_agent as tokens arrive and
+# read by the stream_result endpoint.
+#
+# A stream record is {"text", "seq", "generation", "done", "updatedAt"}: the full text so far
+# (answers are small, so each flush rewrites it rather than appending fragments, which keeps
+# writes idempotent), a flush counter, whether the answer is final and a generation that is
+# bumped when the final text replaces, rather than extends, what was already published (an
+# excerpt fallback after a failed stream): readers on an older generation start over at
+# offset 0. Channels:
+#
+#   dynamodb  streamText/streamSeq/streamGeneration/streamDone attributes on the task's
+#             AGENT_TASKS_TABLE item
+#   local     one JSON file per task under STREAM_LOCAL_DIR, for running the handlers locally
+#
+# STREAM_LOCAL_DIR, when set, wins. Writers flush at most every STREAM_FLUSH_MS (default 200);
+# the first delta is flushed immediately so time-to-first-token is one write.
+
+
+class DynamoStreamChannel:
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+
+    def _table(self) -> Any:
+        return get_boto3_resource("dynamodb").Table(self.table_name)
+
+    def write(self, task_id: str, text: str, seq: int, done: bool, generation: int = 0) -> None:
+        self._table().update_item(
+            Key={"taskId": task_id},
+            UpdateExpression="SET #t = :t, #s = :s, #g = :g, #d = :d, #u = :u",
+            ExpressionAttributeNames={
+                "#t": "streamText",
+                "#s": "streamSeq",
+                "#g": "streamGeneration",
+                "#d": "streamDone",
+                "#u": "streamUpdatedAt",
+            },
+            ExpressionAttributeValues={
+                ":t": text,
+                ":s": seq,
+                ":g": generation,
+                ":d": done,
+                ":u": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            },
+        )
+
+    def read(self, task_id: str) -> Optional[Dict[str, Any]]:
+        item = (
+            self._table()
+            .get_item(
+                Key={"taskId": task_id},
+                ProjectionExpression="#t, #s, #g, #d, #st",
+                ExpressionAttributeNames={
+                    "#t": "streamText",
+                    "#s": "streamSeq",
+                    "#g": "streamGeneration",
+                    "#d": "streamDone",
+                    "#st": "status",
+                },
+                # Increments must not go backwards between polls
+                ConsistentRead=True,
+            )
+            .get("Item")
+        )
+        if item is None:
+            return None
+        return {
+            "text": item.get("streamText") or "",
+            "seq": int(item.get("streamSeq") or 0),
+            "generation": int(item.get("streamGeneration") or 0),
+            "done": bool(item.get("streamDone")),
+            "status": item.get("status"),
+        }
+
+
+class LocalStreamChannel:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, task_id: str) -> str:
+        safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in task_id)
+        return os.path.join(self.directory, f"{safe}.json")
+
+    def write(self, task_id: str, text: str, seq: int, done: bool, generation: int = 0) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        record = {
+            "text": text,
+            "seq": seq,
+            "generation": generation,
+            "done": done,
+            "updatedAt": time.time(),
+        }
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(record, fh)
+        os.replace(tmp, self._path(task_id))
+
+    def read(self, task_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(task_id), "r", encoding="utf-8") as fh:
+                record = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        return {
+            "text": record.get("text") or "",
+            "seq": int(record.get("seq") or 0),
+            "generation": int(record.get("generation") or 0),
+            "done": bool(record.get("done")),
+            "status": "COMPLETED" if record.get("done") else "RUNNING",
+        }
+
+
+def get_channel() -> Any:
+    """The configured stream channel, or None when streaming has nowhere to go."""
+    local_dir = os.environ.get("STREAM_LOCAL_DIR")
+    if local_dir:
+        return LocalStreamChannel(local_dir)
+    table_name = os.environ.get("AGENT_TASKS_TABLE")
+    if table_name:
+        return DynamoStreamChannel(table_name)
+    return None
+
+
+class StreamWriter:
+    """Buffers answer deltas for one task and flushes them to a channel.
+
+    Write failures are swallowed: streaming is best effort and the final result is still
+    persisted by the task workflow.
+    """
+
+    def __init__(self, channel: Any, task_id: str, flush_ms: Optional[float] = None):
+        self.channel = channel
+        self.task_id = task_id
+        if flush_ms is None:
+            try:
+                flush_ms = float(os.environ.get("STREAM_FLUSH_MS") or 200)
+            except ValueError:
+                flush_ms = 200.0
+        self.flush_seconds = max(0.0, flush_ms / 1000.0)
+        self.text = ""
+        self.seq = 0
+        self.generation = 0
+        self.done = False
+        self._flushed_len = 0
+        self._flushed_at = 0.0
+        self._lock = threading.Lock()
+
+    def append(self, delta: str) -> None:
+        if not delta:
+            return
+        with self._lock:
+            if self.done:
+                return
+            self.text += delta
+            first = self._flushed_len == 0
+            if first or time.monotonic() - self._flushed_at >= self.flush_seconds:
+                self._flush(done=False)
+
+    def close(self, final_text: Optional[str] = None) -> None:
+        """Publish the final answer (defaults to the streamed text) and mark the stream done.
+
+        A final text that does not extend what was already flushed starts a new generation,
+        so readers discard the streamed text instead of splicing the two together.
+        """
+        with self._lock:
+            if self.done:
+                return
+            if final_text is not None:
+                if not final_text.startswith(self.text[: self._flushed_len]):
+                    self.generation += 1
+                self.text = final_text
+            self._flush(done=True)
+
+    def _flush(self, done: bool) -> None:
+        self.seq += 1
+        try:
+            self.channel.write(self.task_id, self.text, self.seq, done, self.generation)
+            self._flushed_len = len(self.text)
+            self._flushed_at = time.monotonic()
+            self.done = done
+        except Exception:
+            self.seq -= 1
+
+
+def open_writer(task_id: Optional[str]) -> Optional[StreamWriter]:
+    channel = get_channel() if task_id else None
+    if channel is None:
+        return None
+    return StreamWriter(channel, str(task_id))
@@ -3,10 +3,9 @@ import os
 import time
 from typing import Any, Dict
 
-import boto3
+from common import catalog
+from common.aws import get_boto3_client
 
-
-s3 = boto3.client("s3")
 UPLOADS_BUCKET = os.environ["UPLOADS_BUCKET"]
 
 
@@ -33,9 +32,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             ext = "pdf"
 
     key = f"{user_id}/{document_id}.{ext}"
+    # Catalog the upload so later handlers resolve its key without probing extensions
+    catalog.register_upload(user_id, document_id, key, ext, filename, content_type)
 
     # Include original filename as object metadata via presigned headers
-    url = s3.generate_presigned_url(
+    url = get_boto3_client("s3").generate_presigned_url(
         ClientMethod="put_object",
         Params={
             "Bucket": UPLOADS_BUCKET,
@@ -1,23 +1,114 @@
 import json
 import os
-from typing import Any, Dict
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional
 
-import boto3
+from common import results
+from common.aws import get_boto3_client, get_boto3_resource
 
+_TERMINAL = {"COMPLETED", "FAILED"}
 
-dynamodb = boto3.resource("dynamodb")
-tasks_table = dynamodb.Table(os.environ["AGENT_TASKS_TABLE"])
+
+# Created on first use, not at import, to keep cold starts short
+@lru_cache(maxsize=1)
+def _tasks_table() -> Any:
+    return get_boto3_resource("dynamodb").Table(os.environ["AGENT_TASKS_TABLE"])
+
+
+def _etag(item: Dict[str, Any]) -> str:
+    # "version" is bumped on every status change; the status is part of the tag so items
+    # written before versions existed still change tag when they complete
+    return f'"{int(item.get("version") or 0)}-{item.get("status") or ""}"'
+
+
+def _client_etag(event: Dict[str, Any], params: Dict[str, Any]) -> Optional[str]:
+    headers = {str(k).lower(): v for k, v in (event.get("headers") or {}).items()}
+    tag = headers.get("if-none-match") or params.get("etag")
+    if not tag:
+        return None
+    tag = str(tag).strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    return tag if tag.startswith('"') else f'"{tag}"'
+
+
+def _status(task_id: str) -> Optional[Dict[str, Any]]:
+    """Status and version only: the cheap read used while waiting."""
+    return (
+        _tasks_table()
+        .get_item(
+            Key={"taskId": task_id},
+            ProjectionExpression="#s, #v",
+            ExpressionAttributeNames={"#s": "status", "#v": "version"},
+        )
+        .get("Item")
+    )
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Task status and result (GET /agent-task).
+
+    Query: taskId; optional wait (seconds, capped by RESULT_MAX_WAIT_SECONDS, default 20) and
+    etag (or an If-None-Match header) holding the ETag of the state the client already has.
+    With an ETag the call blocks until the task's status changes or `wait` passes, reading
+    only status and version while it waits, and answers 304 when nothing changed. Without
+    one it returns the current state immediately, as before.
+    """
     params = event.get("queryStringParameters") or {}
-    task_id = params.get("taskId") if isinstance(params, dict) else None
+    params = params if isinstance(params, dict) else {}
+    task_id = params.get("taskId")
+    headers = {"Access-Control-Allow-Origin": "*", "Access-Control-Expose-Headers": "ETag"}
 
     if not task_id:
-        return {"statusCode": 400, "headers": {"Access-Control-Allow-Origin": "*"}, "body": json.dumps({"message": "taskId is required"})}
+        return {
+            "statusCode": 400,
+            "headers": headers,
+            "body": json.dumps({"message": "taskId is required"}),
+        }
+    try:
+        wait = float(params.get("wait") or 0)
+    except ValueError:
+        wait = 0.0
+    wait = min(max(0.0, wait), float(os.environ.get("RESULT_MAX_WAIT_SECONDS") or 20))
+    if context is not None:
+        try:
+            # Always answer before the function times out
+            wait = min(wait, context.get_remaining_time_in_millis() / 1000.0 - 2.0)
+        except Exception:
+            pass
+
+    known = _client_etag(event, params)
+    if known is not None:
+        give_up = time.time() + wait
+        delay = 0.25
+        while True:
+            state = _status(task_id)
+            if state is None or _etag(state) != known:
+                break
+            if state.get("status") in _TERMINAL or time.time() + delay > give_up:
+                return {"statusCode": 304, "headers": {**headers, "ETag": known}, "body": ""}
+            time.sleep(delay)
+            delay = min(1.0, delay * 1.5)
 
-    item = tasks_table.get_item(Key={"taskId": task_id}).get("Item")
+    item = _tasks_table().get_item(Key={"taskId": task_id}).get("Item")
     if not item:
-        return {"statusCode": 404, "headers": {"Access-Control-Allow-Origin": "*"}, "body": json.dumps({"message": "Not found"})}
+        return {"statusCode": 404, "headers": headers, "body": json.dumps({"message": "Not found"})}
 
-    return {"statusCode": 200, "headers": {"Access-Control-Allow-Origin": "*"}, "body": json.dumps({"taskId": task_id, "status": item.get("status"), "result": item.get("result"), "error": item.get("error")})}
+    body = {
+        "taskId": task_id,
+        "status": item.get("status"),
+        "version": int(item.get("version") or 0),
+        "result": item.get("result"),
+        "error": item.get("error"),
+    }
+    # Offloaded results: the item holds a preview; the full result is one presigned GET away
+    ref = results.result_ref(item.get("result"))
+    if ref is not None:
+        body["resultUrl"] = results.presign(get_boto3_client("s3"), ref)
+        body["resultSize"] = ref.get("size")
+    return {
+        "statusCode": 200,
+        "headers": {**headers, "ETag": _etag(item)},
+        "body": json.dumps(body),
+    }
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+from decimal import Decimal
+from typing import Any, Dict, List, Tuple
+
+from common import results
+from common.aws import get_boto3_client, get_boto3_resource
+
+_BATCH_GET_LIMIT = 100
+
+# Status-only reads project away the result, so polling many tasks stays small
+_STATUS_FIELDS = ["taskId", "status", "version", "createdAt", "completedAt", "error"]
+_FULL_FIELDS = _STATUS_FIELDS + ["result", "sessionId"]
+
+
+def _response(status_code: int, body: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "statusCode": status_code,
+        "headers": {"Access-Control-Allow-Origin": "*"},
+        "body": json.dumps(body),
+    }
+
+
+def _plain(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: int(v) if isinstance(v, Decimal) else v for k, v in item.items()}
+
+
+def _batch_get(
+    task_ids: List[str], fields: List[str]
+) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    # (items by task id, ids DynamoDB still left unprocessed after the retries)
+    name = os.environ["AGENT_TASKS_TABLE"]
+    resource = get_boto3_resource("dynamodb")
+    names = {f"#f{i}": field for i, field in enumerate(fields)}
+    out: Dict[str, Dict[str, Any]] = {}
+    unprocessed: List[str] = []
+    for start in range(0, len(task_ids), _BATCH_GET_LIMIT):
+        request: Dict[str, Any] = {
+            name: {
+                "Keys": [{"taskId": t} for t in task_ids[start : start + _BATCH_GET_LIMIT]],
+                "ProjectionExpression": ", ".join(names),
+                "ExpressionAttributeNames": names,
+            }
+        }
+        # BatchGetItem may return part of the batch under load; retry the remainder
+        for attempt in range(4):
+            resp = resource.batch_get_item(RequestItems=request)
+            for item in (resp.get("Responses") or {}).get(name, []):
+                out[str(item.get("taskId"))] = _plain(item)
+            request = resp.get("UnprocessedKeys") or {}
+            if not request:
+                break
+            if attempt < 3:
+                time.sleep(0.05 * (2**attempt))
+        if request:
+            unprocessed.extend(str(k.get("taskId")) for k in request.get(name, {}).get("Keys", []))
+    return out, unprocessed
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Status of many tasks in one call (POST /agent-task/batch).
+
+    Body: {"taskIds": [...], "includeResults": false}. GET with ?taskIds=a,b,c&includeResults=1
+    works too. Returns {"tasks": [{taskId, status, version, createdAt, completedAt, error}],
+    "missing": [...], "unprocessed": [...]} in request order: missing ids do not exist, while
+    unprocessed ids could not be read this time (DynamoDB throttling) and should be asked for
+    again. With includeResults each task also carries its result (and resultUrl for
+    offloaded results). At most BATCH_STATUS_MAX_TASKS (default 200) ids.
+    """
+    params = event.get("queryStringParameters") or {}
+    try:
+        body = json.loads(event.get("body") or "{}")
+    except ValueError:
+        return _response(400, {"message": "body must be JSON"})
+    body = body if isinstance(body, dict) else {}
+    task_ids = body.get("taskIds")
+    if task_ids is None and params.get("taskIds"):
+        task_ids = str(params["taskIds"]).split(",")
+    include = body.get("includeResults")
+    if include is None:
+        include = str(params.get("includeResults") or "").lower() in ("1", "true", "yes")
+
+    if not isinstance(task_ids, list) or not task_ids:
+        return _response(400, {"message": "taskIds is required"})
+    task_ids = list(dict.fromkeys(str(t).strip() for t in task_ids if str(t).strip()))
+    limit = int(os.environ.get("BATCH_STATUS_MAX_TASKS") or 200)
+    if len(task_ids) > limit:
+        return _response(400, {"message": f"At most {limit} taskIds per request"})
+
+    found, unprocessed = _batch_get(task_ids, _FULL_FIELDS if include else _STATUS_FIELDS)
+    tasks = []
+    for task_id in task_ids:
+        item = found.get(task_id)
+        if item is None:
+            continue
+        task = {
+            "taskId": task_id,
+            "status": item.get("status"),
+            "version": int(item.get("version") or 0),
+            "createdAt": item.get("createdAt"),
+            "completedAt": item.get("completedAt"),
+            "error": item.get("error"),
+        }
+        if include:
+            task["result"] = item.get("result")
+            ref = results.result_ref(item.get("result"))
+            if ref is not None:
+                task["resultUrl"] = results.presign(get_boto3_client("s3"), ref)
+                task["resultSize"] = ref.get("size")
+        tasks.append(task)
+    skipped = set(unprocessed)
+    return _response(
+        200,
+        {
+            "tasks": tasks,
+            "missing": [t for t in task_ids if t not in found and t not in skipped],
+            "unprocessed": [t for t in task_ids if t in skipped and t not in found],
+        },
+    )
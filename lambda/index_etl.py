@@ -1,13 +1,16 @@
 import json
 import os
-from typing import Any, Dict, List
-
-import boto3
-from botocore.config import Config
+from typing import Any, Dict, List, Optional, Tuple
 
+from common import catalog
+from common.aws import get_boto3_client
 from common import chunking
+from common import dedup
 from common import parse_document
-from common.embeddings import embed_texts
+from common.cache import get_cache
+from common.embeddings import embed_texts, get_backend
+from common import index_store
+from common import manifest
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -15,7 +18,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
     Supports direct invocation with {documentId, userId} or S3 ObjectCreated event.
     """
-    s3 = boto3.client("s3", config=Config(retries={"max_attempts": 3}))
+    s3 = get_boto3_client("s3")
     uploads_bucket = os.environ.get("UPLOADS_BUCKET", "")
     index_bucket = os.environ.get("REPORTS_BUCKET", "")  # reuse reports bucket for now
 
@@ -50,71 +53,259 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if not user_id:
         user_id = "anon"
 
-    # Locate object by extension
+    # Locate the object: event key, then the catalog entry, then by extension (HEAD only: the
+    # body is fetched once we know work is needed)
+    entry = {} if s3_key else catalog.get_documents(user_id, [document_id]).get(document_id) or {}
     key_pdf = f"{user_id}/{document_id}.pdf"
     key_xlsx = f"{user_id}/{document_id}.xlsx"
 
-    obj = None
+    head = None
     key_used = None
-    for key in (s3_key, key_pdf, key_xlsx):
+    for key in dict.fromkeys((s3_key, entry.get("key"), key_pdf, key_xlsx)):
         if not key:
             continue
         try:
-            obj = s3.get_object(Bucket=uploads_bucket, Key=key)
+            head = s3.head_object(Bucket=uploads_bucket, Key=key)
             key_used = key
             break
         except Exception:
             continue
-    if obj is None or key_used is None:
+    if head is None or key_used is None:
         return {"statusCode": 404, "body": json.dumps({"message": "document not found"})}
 
-    data = obj["Body"].read()
-    if key_used.endswith(".pdf"):
-        parsed = parse_document.parse_pdf_bytes(data, filename=os.path.basename(key_used))
-        chunks = chunking.chunk_pdf(parsed)
-    else:
-        parsed = parse_document.parse_xlsx_bytes(data, filename=os.path.basename(key_used))
-        chunks = chunking.chunk_xlsx(parsed)
+    etag = (head.get("ETag") or "").strip('"')
+    original_filename = (head.get("Metadata") or {}).get("original-filename") or os.path.basename(
+        key_used
+    )
+    doc_type = "pdf" if key_used.endswith(".pdf") else "xlsx"
+    source = {
+        "key": key_used,
+        "etag": etag,
+        "size": head.get("ContentLength"),
+        "filename": original_filename,
+    }
 
-    # Persist normalized parsed JSON for memoization/zero-loss
+    catalog_source = {
+        "key": key_used,
+        "extension": doc_type,
+        "filename": original_filename,
+        "size": head.get("ContentLength"),
+        "etag": etag,
+    }
+
+    # One manifest read tells whether the parsed JSON and the index match this upload
+    current = manifest.load_manifest(s3, index_bucket, user_id, document_id) or {}
+    if manifest.is_current(current.get("index"), etag) and not event.get("force"):
+        catalog.update_document(
+            user_id,
+            document_id,
+            **catalog_source,
+            status=catalog.INDEXED,
+            indexVersion=current["index"]["version"],
+        )
+        return {
+            "statusCode": 200,
+            "body": json.dumps(
+                {
+                    "message": "unchanged",
+                    "version": current["index"]["version"],
+                    "chunks": current["index"].get("chunks"),
+                }
+            ),
+        }
+
+    version = manifest.new_index_version(etag)
+    previous = current.get("index") or {}
+    manifest.update_manifest(
+        s3,
+        index_bucket,
+        user_id,
+        document_id,
+        source=source,
+        build={
+            "version": version,
+            "sourceEtag": etag,
+            "status": manifest.BUILDING,
+            "startedAt": manifest.now_iso(),
+        },
+    )
+    catalog.update_document(user_id, document_id, **catalog_source, status=catalog.INDEXING)
     try:
-        if index_bucket:
-            raw_key = f"parsed/{user_id}/{document_id}.json"
-            s3.put_object(
-                Bucket=index_bucket,
-                Key=raw_key,
-                Body=json.dumps(parsed).encode("utf-8"),
-                ContentType="application/json",
+        parsed, parsed_entry = _load_or_parse(
+            s3, uploads_bucket, index_bucket, user_id, document_id, key_used, etag, current
+        )
+        chunks = chunking.chunk_pdf(parsed) if doc_type == "pdf" else chunking.chunk_xlsx(parsed)
+
+        # Collapse boilerplate and overlap-only chunks before paying for their embeddings
+        duplicates_removed = 0
+        if os.environ.get("INDEX_DEDUP", "1") != "0":
+            chunks, duplicates_removed = dedup.dedupe_chunks(
+                chunks, threshold=float(os.environ.get("INDEX_DEDUP_THRESHOLD") or 0.9)
             )
-    except Exception:
-        pass
-
-    texts = [c.get("text") or "" for c in chunks]
-    vectors = embed_texts(texts)
-
-    # Write JSONL with embeddings and metadata; path: embeddings/<userId>/<documentId>.jsonl
-    lines: List[str] = []
-    for c, v in zip(chunks, vectors):
-        rec = {
-            "documentId": document_id,
-            "userId": user_id,
-            "text": c.get("text"),
-            "metadata": c.get("metadata") or {},
-            "embedding": v,
-        }
-        lines.append(json.dumps(rec))
-    body = ("\n").join(lines).encode("utf-8")
-    out_key = f"embeddings/{user_id}/{document_id}.jsonl"
-    s3.put_object(Bucket=index_bucket, Key=out_key, Body=body, ContentType="application/json")
 
+        texts = [c.get("text") or "" for c in chunks]
+        backend = get_backend()
+        vectors = embed_texts(texts, backend=backend)
+
+        # Records (text + metadata) go to chunks.jsonl; vectors are stored separately as
+        # float32 plus int8/binary codes. The line index is the chunk id referenced by the
+        # header's posting lists and the vector rows.
+        records: List[Dict[str, Any]] = []
+        for chunk_id, c in enumerate(chunks[: len(vectors)]):
+            records.append(
+                {
+                    "documentId": document_id,
+                    "userId": user_id,
+                    "chunkId": chunk_id,
+                    "text": c.get("text"),
+                    "metadata": c.get("metadata") or {},
+                }
+            )
+        title = (parsed.get("metadata") or {}).get("title")
+        header = index_store.build_header(
+            document_id,
+            chunks[: len(vectors)],
+            filename=original_filename,
+            title=title,
+            doc_type=doc_type,
+            embedding=backend.describe(),
+        )
+        header["duplicatesRemoved"] = duplicates_removed
+        sizes = index_store.write_index(
+            s3,
+            index_bucket,
+            user_id,
+            document_id,
+            records,
+            vectors[: len(records)],
+            header,
+            version=version,
+        )
+    except Exception as exc:
+        manifest.update_manifest(
+            s3,
+            index_bucket,
+            user_id,
+            document_id,
+            build={
+                "version": version,
+                "sourceEtag": etag,
+                "status": manifest.FAILED,
+                "error": str(exc),
+                "startedAt": manifest.now_iso(),
+            },
+        )
+        catalog.update_document(user_id, document_id, status=catalog.FAILED, error=str(exc))
+        raise
+
+    # Swap: the manifest PUT is what makes the new version visible to readers
+    manifest.update_manifest(
+        s3,
+        index_bucket,
+        user_id,
+        document_id,
+        source=source,
+        parsed=parsed_entry,
+        index={
+            "version": version,
+            "previousVersion": previous.get("version"),
+            "sourceEtag": etag,
+            "status": manifest.READY,
+            "chunks": len(records),
+            "filename": original_filename,
+            "title": title,
+            "docType": doc_type,
+            "updatedAt": manifest.now_iso(),
+        },
+        build=None,
+    )
+    catalog.update_document(
+        user_id,
+        document_id,
+        status=catalog.INDEXED,
+        indexVersion=version,
+        chunks=len(records),
+        title=title,
+        error=None,
+    )
+    # Readers may still be finishing a query against the version we just replaced, but none
+    # can hold the one before it (unreferenced for a whole build cycle), so drop that one.
+    if previous.get("previousVersion"):
+        index_store.delete_index(
+            s3, index_bucket, user_id, document_id, previous["previousVersion"]
+        )
+
+    out_key = index_store.records_key(user_id, document_id, version)
     return {
         "statusCode": 200,
         "body": json.dumps(
             {
                 "message": "indexed",
+                "version": version,
                 "embeddings": f"s3://{index_bucket}/{out_key}",
-                "parsed": f"s3://{index_bucket}/parsed/{user_id}/{document_id}.json",
+                "parsed": f"s3://{index_bucket}/{parsed_entry['key']}",
                 "chunks": len(chunks),
+                "duplicatesRemoved": duplicates_removed,
+                "indexBytes": sizes,
             }
         ),
     }
+
+
+def _load_or_parse(
+    s3: Any,
+    uploads_bucket: str,
+    index_bucket: str,
+    user_id: str,
+    document_id: str,
+    key_used: str,
+    etag: str,
+    current: Dict[str, Any],
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Reuse the parsed JSON when the manifest says it matches this upload; otherwise parse
+    and write it once under a key derived from the source ETag. Returns (parsed, entry).
+
+    A stub (failed) parse is indexed as before but neither stored nor cached, and its entry
+    is None, so the next build parses again.
+    """
+    entry = current.get("parsed")
+    if manifest.is_current(entry, etag):
+        try:
+            obj = s3.get_object(Bucket=index_bucket, Key=entry["key"])
+            stored = json.loads(obj["Body"].read().decode("utf-8"))
+            if not parse_document.is_stub(stored):
+                return stored, entry
+        except Exception:
+            pass
+
+    # Same container-wide parsed cache (upload key + ETag) as bedrock_agent
+    cache = get_cache("parsed", memory_mb=64, disk_mb=192)
+    cache_key = f"{uploads_bucket}/{key_used}"
+    parsed = cache.get(cache_key, etag=etag)
+    if parsed is None or parse_document.is_stub(parsed):
+        obj = s3.get_object(Bucket=uploads_bucket, Key=key_used)
+        data = obj["Body"].read()
+        if key_used.endswith(".pdf"):
+            parsed = parse_document.parse_pdf_bytes(data, filename=os.path.basename(key_used))
+        else:
+            parsed = parse_document.parse_xlsx_bytes(data, filename=os.path.basename(key_used))
+        if parse_document.is_stub(parsed):
+            return parsed, None
+    serialized = json.dumps(parsed).encode("utf-8")
+    cache.put(cache_key, parsed, size=len(serialized), etag=etag)
+
+    # Persist normalized parsed JSON for memoization/zero-loss
+    raw_key = manifest.parsed_key(user_id, document_id, etag)
+    s3.put_object(
+        Bucket=index_bucket,
+        Key=raw_key,
+        Body=serialized,
+        ContentType="application/json",
+    )
+    entry = {
+        "key": raw_key,
+        "sourceEtag": etag,
+        "status": manifest.READY,
+        "updatedAt": manifest.now_iso(),
+    }
+    return parsed, entry
@@ -0,0 +1,38 @@
+import json
+from typing import Any, Dict
+
+from common import catalog
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """List a user's documents from the catalog, one page per call (GET /documents)."""
+    params = event.get("queryStringParameters") or {}
+    user_id = params.get("userId") or "anon"
+    try:
+        limit = int(params.get("limit") or 50)
+    except ValueError:
+        limit = 50
+
+    items, next_token = catalog.list_documents(
+        user_id, limit=limit, next_token=params.get("nextToken")
+    )
+    documents = [
+        {
+            "documentId": item.get("documentId"),
+            "filename": item.get("filename"),
+            "extension": item.get("extension"),
+            "size": item.get("size"),
+            "status": item.get("status"),
+            "indexVersion": item.get("indexVersion"),
+            "chunks": item.get("chunks"),
+            "title": item.get("title"),
+            "createdAt": item.get("createdAt"),
+            "updatedAt": item.get("updatedAt"),
+        }
+        for item in items
+    ]
+    return {
+        "statusCode": 200,
+        "headers": {"Access-Control-Allow-Origin": "*"},
+        "body": json.dumps({"documents": documents, "nextToken": next_token}),
+    }
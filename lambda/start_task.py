@@ -1,18 +1,66 @@
 import json
 import os
 import time
-from typing import Any, Dict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
 
-import boto3
-from botocore.config import Config
+from common import catalog, results
+from common.aws import get_boto3_client, get_boto3_resource
 
-
-sfn = boto3.client("stepfunctions", config=Config(retries={"max_attempts": 3}))
-dynamodb = boto3.resource("dynamodb")
-tasks_table = dynamodb.Table(os.environ["AGENT_TASKS_TABLE"])
 SFN_ARN = os.environ.get("SFN_ARN", "")
 
 
+# Clients are created on first use, not at import, to keep cold starts short
+@lru_cache(maxsize=1)
+def _tasks_table() -> Any:
+    return get_boto3_resource("dynamodb").Table(os.environ["AGENT_TASKS_TABLE"])
+
+
+def _fast_path_eligible(body: Dict[str, Any], user_id: str, document_ids: List[str]) -> bool:
+    """Inline only non-streaming retrieval questions over a few small, indexed documents."""
+    if (os.environ.get("FAST_PATH_ENABLED") or "1") == "0":
+        return False
+    if (body.get("mode") or "retrieval").lower() != "retrieval" or not document_ids:
+        return False
+    if body.get("stream"):
+        # Streaming clients read /agent-task/stream, which only the workflow path writes
+        return False
+    if len(document_ids) > int(os.environ.get("FAST_PATH_MAX_DOCS") or 5):
+        return False
+    entries = catalog.get_documents(user_id, document_ids)
+    if len(entries) != len(set(document_ids)):
+        return False
+    if any(
+        e.get("status") != catalog.INDEXED or not e.get("indexVersion") for e in entries.values()
+    ):
+        return False
+    total_bytes = sum(int(e.get("size") or 0) for e in entries.values())
+    return total_bytes <= int(os.environ.get("FAST_PATH_MAX_BYTES") or 25 * 1024 * 1024)
+
+
+def _answer_inline(
+    body: Dict[str, Any], agent_event: Dict[str, Any], context: Any
+) -> Optional[Dict[str, Any]]:
+    """Run bedrock_agent in this invocation within FAST_PATH_BUDGET_MS (default 8000).
+
+    Returns the agent's output, or None when the question does not qualify, fails, or comes
+    back degraded (out of budget); the caller then starts the workflow as usual.
+    """
+    try:
+        if not _fast_path_eligible(body, agent_event["userId"], agent_event["documentIds"]):
+            return None
+        # Imported here so tasks that take the workflow do not pay for it at cold start
+        import bedrock_agent
+
+        budget_ms = int(os.environ.get("FAST_PATH_BUDGET_MS") or 8000)
+        out = bedrock_agent.handler({**agent_event, "budgetMs": budget_ms}, context)
+        if json.loads(out["agentResult"]).get("degraded"):
+            return None
+        return out
+    except Exception:
+        return None
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     body = json.loads(event.get("body" or "{}"))
     prompt = body.get("prompt") or ""
@@ -26,36 +74,86 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     task_id = f"task_{int(time.time()*1000)}"
     created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
-    tasks_table.put_item(
-        Item={
+    input_obj = {
+        "taskId": task_id,
+        "prompt": prompt,
+        "createdAt": created_at,
+        "userId": user_id,
+        "sessionId": session_id,
+        "documentIds": document_ids,
+    }
+    if isinstance(body.get("filters"), dict):
+        # Optional structured retrieval scope: {pages, sheets, rows, docTypes}
+        input_obj["filters"] = body["filters"]
+    if body.get("answerMode") in ("auto", "single", "mapreduce"):
+        # Per-document partial answers merged in one call; "auto" switches on for many documents
+        input_obj["answerMode"] = body["answerMode"]
+    if body.get("stream"):
+        # bedrock_agent publishes answer text as it is generated; read it from /agent-task/stream
+        input_obj["stream"] = True
+
+    item = {
+        "taskId": task_id,
+        "status": "RUNNING",
+        # Bumped on every status change; get_result derives its ETag from it
+        "version": 1,
+        "prompt": prompt,
+        "createdAt": created_at,
+        "userId": user_id,
+        "docRefs": document_ids,
+    }
+
+    # Questions over small, already-indexed documents are answered inline; the task record is
+    # the same one the workflow would have written
+    inline = _answer_inline(body, input_obj, context)
+    if inline is not None:
+        item.update(
+            status="COMPLETED",
+            result=inline["agentResult"],
+            completedAt=inline["completedAt"],
+            sessionId=inline["sessionId"],
+        )
+        _tasks_table().put_item(Item=item)
+        response = {
             "taskId": task_id,
-            "status": "RUNNING",
-            "prompt": prompt,
-            "createdAt": created_at,
-            "userId": user_id,
-            "docRefs": document_ids,
+            "sessionId": session_id,
+            "status": "COMPLETED",
+            "result": item["result"],
         }
-    )
+        ref = results.result_ref(item["result"])
+        if ref is not None:
+            # Same shape as GET /agent-task for offloaded results
+            response["resultUrl"] = results.presign(get_boto3_client("s3"), ref)
+            response["resultSize"] = ref.get("size")
+        return {
+            "statusCode": 200,
+            "headers": {"Access-Control-Allow-Origin": "*"},
+            "body": json.dumps(response),
+        }
+
+    _tasks_table().put_item(Item=item)
 
     # Start Step Functions execution (fire-and-forget)
     if SFN_ARN:
-        input_obj = {
-            "taskId": task_id,
-            "prompt": prompt,
-            "createdAt": created_at,
-            "userId": user_id,
-            "sessionId": session_id,
-            "documentIds": document_ids,
-        }
         try:
-            sfn.start_execution(stateMachineArn=SFN_ARN, input=json.dumps(input_obj))
+            get_boto3_client("stepfunctions").start_execution(
+                stateMachineArn=SFN_ARN, input=json.dumps(input_obj)
+            )
         except Exception as exc:
             # Mark task as failed if we cannot start the execution
-            tasks_table.update_item(
+            _tasks_table().update_item(
                 Key={"taskId": task_id},
-                UpdateExpression="SET #status=:s, #error=:e",
-                ExpressionAttributeNames={"#status": "status", "#error": "error"},
-                ExpressionAttributeValues={":s": "FAILED", ":e": str(exc)},
+                UpdateExpression="SET #status=:s, #error=:e ADD #version :one",
+                ExpressionAttributeNames={
+                    "#status": "status",
+                    "#error": "error",
+                    "#version": "version",
+                },
+                ExpressionAttributeValues={":s": "FAILED", ":e": str(exc), ":one": 1},
             )
             return {"statusCode": 500, "headers": {"Access-Control-Allow-Origin": "*"}, "body": json.dumps({"message": "Failed to start task"})}
-    return {"statusCode": 200, "headers": {"Access-Control-Allow-Origin": "*"}, "body": json.dumps({"taskId": task_id, "sessionId": session_id})}
+    return {
+        "statusCode": 200,
+        "headers": {"Access-Control-Allow-Origin": "*"},
+        "body": json.dumps({"taskId": task_id, "sessionId": session_id, "status": "RUNNING"}),
+    }
@@ -0,0 +1,75 @@
+import json
+import os
+import time
+from typing import Any, Dict
+
+from common.stream import get_channel
+
+_TERMINAL = {"COMPLETED", "FAILED"}
+
+
+def _response(status_code: int, body: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "statusCode": status_code,
+        "headers": {"Access-Control-Allow-Origin": "*"},
+        "body": json.dumps(body),
+    }
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Relay a streaming task's answer increments (GET /agent-task/stream).
+
+    Query: taskId, offset (characters the client already has, default 0), generation (of
+    the text the client has, default 0) and wait (seconds, default 10, capped by
+    STREAM_MAX_WAIT_SECONDS, default 20). Waits until text beyond `offset` is available or
+    the task finishes, then returns {taskId, status, delta, offset, generation, reset, done};
+    the client passes the returned offset and generation back on its next call. When the
+    answer was replaced rather than extended, `reset` is true and `delta` is the whole new
+    text, which replaces what the client has. When done, the full result (sources, report)
+    is available from GET /agent-task.
+    """
+    params = event.get("queryStringParameters") or {}
+    task_id = params.get("taskId") if isinstance(params, dict) else None
+    if not task_id:
+        return _response(400, {"message": "taskId is required"})
+    try:
+        offset = max(0, int(params.get("offset") or 0))
+        generation = int(params.get("generation") or 0)
+        wait = float(params.get("wait") or 10)
+    except ValueError:
+        return _response(400, {"message": "offset, generation and wait must be numbers"})
+    max_wait = float(os.environ.get("STREAM_MAX_WAIT_SECONDS") or 20)
+    wait = min(max(0.0, wait), max_wait)
+    poll = float(os.environ.get("STREAM_POLL_MS") or 100) / 1000.0
+
+    channel = get_channel()
+    if channel is None:
+        return _response(500, {"message": "Streaming is not configured"})
+
+    give_up = time.time() + wait
+    while True:
+        record = channel.read(task_id)
+        if record is None:
+            return _response(404, {"message": "Not found"})
+        text = record["text"]
+        done = record["done"] or record.get("status") in _TERMINAL
+        reset = record.get("generation", 0) != generation
+        if reset:
+            # The text the client holds was replaced; send the new one from the start
+            offset = 0
+        if len(text) > offset or reset or done or time.time() + poll > give_up:
+            break
+        time.sleep(poll)
+
+    return _response(
+        200,
+        {
+            "taskId": task_id,
+            "status": record.get("status"),
+            "delta": text[offset:],
+            "offset": max(offset, len(text)),
+            "generation": record.get("generation", 0),
+            "reset": reset,
+            "done": done,
+        },
+    )
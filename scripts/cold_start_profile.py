@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+# Cold-start profile for each Lambda entry point: every handler module is imported in a fresh
+# interpreter with `-X importtime`, which is what a new Lambda container pays during init.
+# Reports the total import time per handler and the heaviest imports by cumulative time.
+# With --budget-ms the script exits non-zero when any handler exceeds the budget, so it
+# can gate CI against cold-start regressions.
+
+ROOT = Path(__file__).resolve().parents[1]
+LAMBDA_DIR = ROOT / "lambda"
+
+HANDLERS = [
+    "start_task",
+    "get_result",
+    "get_results",
+    "bedrock_agent",
+    "index_etl",
+    "agent_chat",
+    "agent_chat_worker",
+    "get_presigned_upload",
+    "list_documents",
+    "stream_result",
+    "agent_tools.parse_pdf",
+]
+
+# Placeholders for the environment variables some modules read at import time
+PLACEHOLDER_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AGENT_TASKS_TABLE": "profile-tasks",
+    "DOCUMENT_CATALOG_TABLE": "profile-documents",
+    "UPLOADS_BUCKET": "profile-uploads",
+    "REPORTS_BUCKET": "profile-reports",
+    "BEDROCK_AGENT_ID": "profile-agent",
+    "BEDROCK_AGENT_ALIAS_ID": "profile-alias",
+}
+
+
+def profile_module(module: str, python: str) -> Dict[str, object]:
+    env = {**PLACEHOLDER_ENV, **os.environ, "PYTHONPATH": str(LAMBDA_DIR)}
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=str(LAMBDA_DIR),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    # Lines look like: "import time:  self [us] | cumulative | imported package"
+    rows: List[Dict[str, object]] = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        try:
+            rows.append(
+                {
+                    "module": name.strip(),
+                    # Nesting is shown by two spaces per level after the single separator space
+                    "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                    "selfMs": int(self_us) / 1000.0,
+                    "cumulativeMs": int(cumulative_us) / 1000.0,
+                }
+            )
+        except ValueError:
+            continue
+    target = next((r for r in reversed(rows) if r["module"] == module), None)
+    return {
+        "handler": module,
+        "ok": proc.returncode == 0,
+        "error": (
+            proc.stderr.strip().splitlines()[-1] if proc.returncode != 0 and proc.stderr else None
+        ),
+        "importMs": target["cumulativeMs"] if target else None,
+        "imports": rows,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Per-handler cold-start import profile")
+    parser.add_argument("handlers", nargs="*", help="Handler modules (default: all)")
+    parser.add_argument("--top", type=int, default=8, help="Heaviest imports to list per handler")
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Fresh interpreters per handler (median)"
+    )
+    parser.add_argument("--budget-ms", type=float, default=None, help="Fail above this import time")
+    parser.add_argument("--json", action="store_true", help="Print a JSON report")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter to profile with")
+    args = parser.parse_args()
+
+    report = []
+    for module in args.handlers or HANDLERS:
+        runs = [profile_module(module, args.python) for _ in range(max(1, args.runs))]
+        ok_runs = sorted(
+            (r for r in runs if r["ok"] and r["importMs"] is not None), key=lambda r: r["importMs"]
+        )
+        if not ok_runs:
+            report.append({"handler": module, "ok": False, "error": runs[-1]["error"]})
+            continue
+        median = ok_runs[len(ok_runs) // 2]
+        # Heaviest third-party/app imports: direct children of the handler and top-level packages
+        heaviest = sorted(
+            (r for r in median["imports"] if r["depth"] <= 1 and r["module"] != module),
+            key=lambda r: r["cumulativeMs"],
+            reverse=True,
+        )[: args.top]
+        report.append(
+            {
+                "handler": module,
+                "ok": True,
+                "importMs": round(median["importMs"], 1),
+                "heaviest": [
+                    {"module": r["module"], "cumulativeMs": round(r["cumulativeMs"], 1)}
+                    for r in heaviest
+                ],
+            }
+        )
+
+    over = [
+        r
+        for r in report
+        if not r["ok"] or (args.budget_ms is not None and r["importMs"] > args.budget_ms)
+    ]
+    if args.json:
+        print(json.dumps({"budgetMs": args.budget_ms, "handlers": report}, indent=2))
+    else:
+        for r in report:
+            if not r["ok"]:
+                print(f"{r['handler']:<24} FAILED  {r['error']}")
+                continue
+            flag = "  OVER BUDGET" if r in over else ""
+            print(f"{r['handler']:<24} {r['importMs']:>8.1f} ms{flag}")
+            for h in r["heaviest"]:
+                print(f"    {h['module']:<40} {h['cumulativeMs']:>8.1f} ms")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
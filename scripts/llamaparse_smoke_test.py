@@ -1,15 +1,12 @@
 import os
 import json
-import importlib.util
+import sys
 from pathlib import Path
 
-# Load module by file path to avoid package import issues
+# Import through the Lambda source root: llama_parse uses package-relative imports
 ROOT = Path(__file__).resolve().parents[1]
-LLAMA_PARSE_PATH = ROOT / "lambda" / "common" / "llama_parse.py"
-spec = importlib.util.spec_from_file_location("llama_parse", str(LLAMA_PARSE_PATH))
-llama_parse = importlib.util.module_from_spec(spec)  # type: ignore[arg-type]
-assert spec and spec.loader
-spec.loader.exec_module(llama_parse)  # type: ignore[union-attr]
+sys.path.insert(0, str(ROOT / "lambda"))
+from common import llama_parse  # noqa: E402
 
 
 def summarize_result(name: str, result: dict) -> dict:
@@ -0,0 +1,105 @@
+import argparse
+import json
+import importlib.util
+import random
+import time
+from pathlib import Path
+
+# Load module by file path to avoid package import issues
+ROOT = Path(__file__).resolve().parents[1]
+QUANTIZATION_PATH = ROOT / "lambda" / "common" / "quantization.py"
+spec = importlib.util.spec_from_file_location("quantization", str(QUANTIZATION_PATH))
+quantization = importlib.util.module_from_spec(spec)  # type: ignore[arg-type]
+assert spec and spec.loader
+spec.loader.exec_module(quantization)  # type: ignore[union-attr]
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    na = sum(x * x for x in a) ** 0.5
+    nb = sum(y * y for y in b) ** 0.5
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, seed: int):
+    rng = random.Random(seed)
+    centers = [[rng.gauss(0, 1) for _ in range(dim)] for _ in range(clusters)]
+    vecs = []
+    for i in range(n):
+        c = centers[i % clusters]
+        vecs.append([x + rng.gauss(0, 0.8) for x in c])
+    return vecs
+
+
+def load_jsonl_vectors(path: Path):
+    """Read a version-1 embeddings JSONL (inline "embedding" per record)."""
+    vecs = []
+    for line in path.read_text().splitlines():
+        if line.strip():
+            vec = json.loads(line).get("embedding")
+            if vec:
+                vecs.append(vec)
+    return vecs
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Recall of quantized coarse pass + rescoring vs exact")
+    ap.add_argument("--jsonl", type=Path, help="legacy embeddings JSONL to evaluate")
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("--dim", type=int, default=1024)
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--rescore-factor", type=int, default=4)
+    args = ap.parse_args()
+
+    if args.jsonl:
+        vecs = load_jsonl_vectors(args.jsonl)
+    else:
+        vecs = synthetic_vectors(args.n, args.dim, clusters=max(1, args.n // 20), seed=7)
+    dim = quantization.common_dim(vecs)
+    rng = random.Random(11)
+    queries = [[x + rng.gauss(0, 0.5) for x in rng.choice(vecs)] for _ in range(args.queries)]
+
+    binary = quantization.BinaryCodes(quantization.pack_binary(vecs, dim), dim)
+    int8 = quantization.Int8Codes(quantization.pack_int8(vecs, dim)[0], dim)
+    ids = range(len(vecs))
+    shortlist_size = args.top_k * args.rescore_factor
+
+    results = {}
+    for name, codes in (("binary", binary), ("int8", int8)):
+        hits = 0
+        t0 = time.perf_counter()
+        for q in queries:
+            exact = sorted(ids, key=lambda i: cosine(q, vecs[i]), reverse=True)[: args.top_k]
+            coarse = codes.scores(q, ids)
+            shortlist = sorted(coarse, key=coarse.get, reverse=True)[:shortlist_size]
+            rescored = sorted(shortlist, key=lambda i: cosine(q, vecs[i]), reverse=True)
+            hits += len(set(exact) & set(rescored[: args.top_k]))
+        results[name] = {
+            "recall_at_k": hits / float(args.top_k * len(queries)),
+            "seconds": round(time.perf_counter() - t0, 3),
+        }
+
+    json_bytes = sum(len(json.dumps(v)) for v in vecs)
+    print(
+        json.dumps(
+            {
+                "vectors": len(vecs),
+                "dim": dim,
+                "top_k": args.top_k,
+                "shortlist": shortlist_size,
+                "bytes": {
+                    "json": json_bytes,
+                    "float32": len(vecs) * dim * 4,
+                    "int8": len(vecs) * dim,
+                    "binary": len(vecs) * ((dim + 7) // 8),
+                },
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
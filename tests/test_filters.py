@@ -0,0 +1,41 @@
+from common import dedup
+from common.filters import build_postings, normalize_filters, select_chunk_ids
+
+BOILERPLATE = "Confidential. Distribution of this report outside the company is prohibited."
+
+
+def _chunk(text, **metadata):
+    return {"text": text, "metadata": {"docType": "pdf", **metadata}}
+
+
+def test_page_filter_matches_page_whose_chunk_was_deduped_away():
+    chunks, removed = dedup.dedupe_chunks(
+        [
+            _chunk("Revenue grew 12% year over year.", page=1),
+            _chunk(BOILERPLATE, page=1),
+            _chunk(BOILERPLATE, page=2),
+        ]
+    )
+    assert removed == 1
+    assert all(c["metadata"].get("page") != 2 for c in chunks)
+
+    postings = build_postings(chunks)
+    selected = select_chunk_ids(postings, normalize_filters({"pages": [2]}))
+
+    assert selected == {1}
+    assert chunks[1]["text"] == BOILERPLATE
+
+
+def test_sheet_and_row_filters_match_every_cited_row():
+    chunks, removed = dedup.dedupe_chunks(
+        [
+            _chunk("Region: East | Total: 10", sheet="Q1", row=2),
+            _chunk("Region: East | Total: 10", sheet="Q2", row=7),
+        ]
+    )
+    assert removed == 1
+
+    postings = build_postings(chunks)
+
+    assert select_chunk_ids(postings, normalize_filters({"sheet": "q2", "rows": "7"})) == {0}
+    assert select_chunk_ids(postings, normalize_filters({"sheet": "Q1"})) == {0}